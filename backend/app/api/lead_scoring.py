@@ -1,12 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import openai
 import numpy as np
 from datetime import datetime
+from app.core import lead_model
 
 router = APIRouter()
 
+MAX_BATCH_LEADS = 10000
+
 class Lead(BaseModel):
     id: str
     name: str
@@ -22,6 +25,18 @@ class LeadScore(BaseModel):
     factors: List[str]
     recommendations: List[str]
 
+class LeadBatch(BaseModel):
+    leads: List[Lead] = Field(..., max_length=MAX_BATCH_LEADS)
+
+class BatchLeadScore(BaseModel):
+    lead_id: str
+    score: float
+    recommendations: List[str]
+
+class BatchScoreResponse(BaseModel):
+    model: dict
+    scores: List[BatchLeadScore]
+
 def analyze_lead_behavior(interactions: List[dict]) -> float:
     """
     Analyze lead behavior patterns using AI
@@ -71,6 +86,26 @@ async def score_lead(lead: Lead):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/score/batch", response_model=BatchScoreResponse)
+def score_leads_batch(batch: LeadBatch):
+    """
+    Score many leads at once with the local model (see app/core/lead_model.py).
+    Interactions are featurized into one matrix and scored in a single predict call.
+    """
+    bundle = lead_model.get_model()
+    if bundle is None:
+        raise HTTPException(status_code=503, detail="Lead scoring model is not available; train it with train_lead_model.py")
+    
+    scores = lead_model.score(lead_model.featurize(batch.leads), bundle)
+    
+    return BatchScoreResponse(
+        model=lead_model.model_info(bundle),
+        scores=[
+            BatchLeadScore(lead_id=lead.id, score=float(score), recommendations=generate_recommendations(lead, score))
+            for lead, score in zip(batch.leads, scores)
+        ]
+    )
+
 def generate_recommendations(lead: Lead, score: float) -> List[str]:
     """
     Generate personalized recommendations based on lead score
@@ -1,28 +1,67 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from app.core.database import get_db
-from app.models.website_tracking import WebsiteVisitor, WebsiteEvent
+from app.models.website_tracking import WebsiteVisitor
 from app.models.business import Business
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from app.models.analytics import AnalyticsRollup
+from app.core import tracking_store, rollups, pagination, event_export, funnels, visitor_sketches, visitor_scoring
+from app.core.event_buffer import event_buffer, BufferFull
+from app.core.sessionizer import sessionizer
+from app.core.live_analytics import live_hub, LIVE_METRICS, LIVE_PUSH_INTERVAL, LIVE_HEARTBEAT_INTERVAL
+from app.core.tracking_cache import visitor_cache, business_config_cache, get_tracking_config
+from app.core import geoip, bot_filter, rate_limit
+from app.core.event_dedup import deduplicator, DEDUP_WINDOW
+from app.core.user_agent import parse_user_agent, cache_stats as user_agent_cache_stats
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, Dict, Any, List, Tuple
+import asyncio
 import uuid
 import json
-from datetime import datetime
-import geoip2.database
-import user_agents
+from datetime import datetime, timedelta
 
 router = APIRouter()
 
+MAX_BATCH_EVENTS = 500
+VISITOR_CONFLICT = "visitor_id belongs to another business"
+MAX_BEACON_BYTES = 64 * 1024  # sendBeacon payloads are capped at 64 KB by browsers
+
+# Visitor and lead listings
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+VISITOR_FIELDS = tuple(column.key for column in WebsiteVisitor.__table__.columns)
+
+# 1x1 transparent PNG
+PIXEL_DATA = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\x00\x01\x00\x00\x05\x00\x01\r\n-\xdb\x00\x00\x00\x00IEND\xaeB`\x82'
+
+# Limits match the website_visitors/website_events columns, so a buffered row can always be written
 class TrackingEvent(BaseModel):
     business_id: int
-    visitor_id: Optional[str] = None
-    event_type: str
-    page_url: str
-    page_title: Optional[str] = None
+    visitor_id: Optional[str] = Field(default=None, max_length=100)
+    event_id: Optional[str] = Field(default=None, max_length=64)  # client-generated, for deduplicating retries
+    event_type: str = Field(max_length=50)
+    page_url: str = Field(max_length=500)
+    page_title: Optional[str] = Field(default=None, max_length=255)
     event_data: Optional[Dict[str, Any]] = None
     duration: Optional[float] = None
     form_fields: Optional[Dict[str, Any]] = None
 
+class TrackingEventBatch(BaseModel):
+    events: List[Dict[str, Any]]
+
+class FunnelStepDefinition(BaseModel):
+    event_type: str
+    page_url: Optional[str] = None
+    element: Optional[str] = None
+
+class FunnelRequest(BaseModel):
+    steps: List[FunnelStepDefinition]
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    window_seconds: Optional[float] = None
+
 class LeadCaptureData(BaseModel):
     business_id: int
     visitor_id: str
@@ -36,15 +75,20 @@ async def tracking_pixel(
     business_id: int,
     request: Request,
     response: Response,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """
     Serves a 1x1 pixel image for website tracking.
     This is loaded on client websites to track visitors.
     """
-    # Check if business exists
-    business = db.query(Business).filter(Business.id == business_id).first()
-    if not business or not business.is_tracking_enabled:
+    if reject_bot(db, request, [business_id]):
+        return pixel_response()
+    if throttle(db, business_id, request.cookies.get("visitor_id")):
+        return pixel_response()
+    
+    # Check if business exists and has tracking enabled
+    if not get_tracking_config(db, business_id)["enabled"]:
         raise HTTPException(status_code=404, detail="Tracking not found")
     
     # Get visitor information
@@ -52,66 +96,80 @@ async def tracking_pixel(
     user_agent_string = request.headers.get("user-agent", "")
     referrer = request.headers.get("referer", "")
     
-    # Parse user agent
-    user_agent = user_agents.parse(user_agent_string)
+    # Parse user agent (memoized)
+    user_agent = parse_user_agent(user_agent_string)
     
     # Generate or get visitor ID
     visitor_id = request.cookies.get("visitor_id")
-    if not visitor_id:
+    if not visitor_id or len(visitor_id) > 100:
         visitor_id = str(uuid.uuid4())
         response.set_cookie("visitor_id", visitor_id, max_age=365*24*60*60)  # 1 year
     
-    # Check if visitor exists
-    visitor = db.query(WebsiteVisitor).filter(
-        WebsiteVisitor.visitor_id == visitor_id,
-        WebsiteVisitor.business_id == business_id
-    ).first()
-    
-    if visitor:
-        # Update existing visitor
-        visitor.last_visit = datetime.utcnow()
-        visitor.total_visits += 1
-        visitor.user_agent = user_agent_string
-        visitor.referrer = referrer
-    else:
-        # Create new visitor
+    now = datetime.utcnow()
+    conflicts = set()
+    visitor_pk = tracking_store.resolve_visitor(db, business_id, visitor_id, conflicts)
+    if conflicts:
+        # The cookie's visitor id is already another business's visitor; it cannot be reused here
+        return pixel_response()
+    
+    if not visitor_pk:
+        # Create new visitor; the visit itself is counted below like any repeat visit
         visitor = WebsiteVisitor(
             business_id=business_id,
             visitor_id=visitor_id,
             ip_address=ip_address,
             user_agent=user_agent_string,
             referrer=referrer,
-            device_type=get_device_type(user_agent),
-            browser=user_agent.browser.family,
-            os=user_agent.os.family,
-            # Geographic info would be added here with GeoIP
+            device_type=user_agent.device_type,
+            browser=user_agent.browser,
+            os=user_agent.os,
+            total_visits=0
         )
         db.add(visitor)
+        db.commit()
+        visitor_pk = visitor.id
+        tracking_store.remember_visitor(business_id, visitor_id, visitor_pk)
+        event_buffer.record_rollup(business_id, "new_visitors", now)
+        # Geographic info is looked up after the response is sent
+        background_tasks.add_task(geoip.enrich_visitors, [visitor_pk], ip_address)
+    
+    # Visit counters, last_visit and rollups are written by the background flush
+    try:
+        event_buffer.record_visit(visitor_pk, business_id, now, user_agent_string, referrer)
+    except BufferFull:
+        deltas = {}
+        tracking_store.add_visit_delta(deltas, visitor_pk, business_id, now, user_agent_string, referrer)
+        tracking_store.write_events(db, [], deltas)
+        db.commit()
     
-    db.commit()
-    
-    # Return 1x1 transparent PNG
-    pixel_data = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\x00\x01\x00\x00\x05\x00\x01\r\n-\xdb\x00\x00\x00\x00IEND\xaeB`\x82'
-    
-    response.headers["Content-Type"] = "image/png"
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    return Response(content=pixel_data, media_type="image/png")
+    return pixel_response()
 
 @router.post("/track-event")
 async def track_event(
     event: TrackingEvent,
     request: Request,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
-    """Track specific events on the website"""
+    """
+    Track specific events on the website.
+    The event is queued for a background bulk write and the response returns immediately.
+    """
+    if reject_bot(db, request, [event.business_id]):
+        return {"status": "ignored"}
+    if throttle(db, event.business_id, event.visitor_id):
+        raise HTTPException(status_code=429, detail="Tracking rate limit exceeded", headers={"Retry-After": "1"})
+    
+    if not get_tracking_config(db, event.business_id)["enabled"]:
+        raise HTTPException(status_code=404, detail="Tracking not found")
     
     # Get or create visitor
-    visitor = db.query(WebsiteVisitor).filter(
-        WebsiteVisitor.visitor_id == event.visitor_id,
-        WebsiteVisitor.business_id == event.business_id
-    ).first()
+    conflicts = set()
+    visitor_pk = tracking_store.resolve_visitor(db, event.business_id, event.visitor_id, conflicts)
+    if conflicts:
+        raise HTTPException(status_code=409, detail=VISITOR_CONFLICT)
     
-    if not visitor:
+    if not visitor_pk:
         # Create visitor if doesn't exist
         visitor = WebsiteVisitor(
             business_id=event.business_id,
@@ -121,28 +179,137 @@ async def track_event(
         )
         db.add(visitor)
         db.commit()
-    
-    # Create event
-    website_event = WebsiteEvent(
-        visitor_id=visitor.id,
-        event_type=event.event_type,
-        page_url=event.page_url,
-        page_title=event.page_title,
-        event_data=event.event_data,
-        duration=event.duration,
-        form_fields=event.form_fields
-    )
-    
-    db.add(website_event)
-    
-    # Update visitor metrics
-    visitor.total_page_views += 1
-    if event.duration:
-        visitor.total_time_spent += event.duration / 60  # Convert to minutes
-    
-    db.commit()
-    
-    return {"status": "success", "event_id": website_event.id}
+        visitor_pk = visitor.id
+        tracking_store.remember_visitor(event.business_id, event.visitor_id, visitor_pk)
+        event_buffer.record_rollup(event.business_id, "new_visitors", datetime.utcnow())
+        background_tasks.add_task(geoip.enrich_visitors, [visitor_pk], request.client.host)
+    
+    now = datetime.utcnow()
+    if is_duplicate_event(db, visitor_pk, event, now):
+        return {"status": "duplicate"}
+    try:
+        event_buffer.enqueue(build_event_row(visitor_pk, event, now), visitor_pk, event.business_id, event.duration, now)
+    except BufferFull:
+        raise HTTPException(status_code=503, detail="Tracking is temporarily overloaded")
+    
+    return {"status": "queued"}
+
+@router.post("/track-events")
+async def track_events(
+    batch: TrackingEventBatch,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    """
+    Track a batch of events, possibly for several visitors and businesses.
+    Visitors are resolved with one query and all events are written in one transaction.
+    """
+    if len(batch.events) > MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_EVENTS} events")
+
+    if reject_bot(db, request, [event.get("business_id") for event in batch.events]):
+        results = [{"index": index, "status": "rejected", "error": "Bot traffic"} for index in range(len(batch.events))]
+        return {"status": "success", "accepted": 0, "rejected": len(results), "results": results}
+
+    results, accepted = validate_events(db, batch.events)
+
+    if accepted:
+        visitor_pks, created_visitors = resolve_event_visitors(db, accepted, request)
+        for index, event in accepted:
+            if (event.business_id, event.visitor_id) not in visitor_pks:
+                results[index] = {"index": index, "status": "rejected", "error": VISITOR_CONFLICT}
+        accepted = [(index, event) for index, event in accepted if results[index] is None]
+
+        now = datetime.utcnow()
+        rows = []
+        deltas = {}
+        duplicates = set()
+        for index, event in accepted:
+            visitor_pk = visitor_pks[(event.business_id, event.visitor_id)]
+            if is_duplicate_event(db, visitor_pk, event, now, rows):
+                results[index] = {"index": index, "status": "duplicate"}
+                duplicates.add(index)
+                continue
+            rows.append(build_event_row(visitor_pk, event, now))
+            tracking_store.add_visitor_delta(deltas, visitor_pk, event.business_id, event.duration, now)
+        accepted = [(index, event) for index, event in accepted if index not in duplicates]
+
+        rollup_deltas = rollups.RollupDeltas()
+        for business_id, _ in created_visitors:
+            rollup_deltas.add(business_id, "new_visitors", now)
+
+        event_ids = tracking_store.write_events(db, rows, deltas, rollup_deltas)
+        db.commit()
+        live_hub.publish_batch(rows, deltas, rollup_deltas)
+        tracking_store.remember_visitors(created_visitors)
+        if created_visitors:
+            background_tasks.add_task(geoip.enrich_visitors, list(created_visitors.values()), request.client.host)
+
+        for (index, _), event_id in zip(accepted, event_ids):
+            results[index] = {"index": index, "status": "accepted", "event_id": event_id}
+
+    duplicates = sum(1 for result in results if result["status"] == "duplicate")
+    return {
+        "status": "success",
+        "accepted": len(accepted),
+        "duplicates": duplicates,
+        "rejected": len(results) - len(accepted) - duplicates,
+        "results": results
+    }
+
+@router.post("/beacon", status_code=204)
+async def track_beacon(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    """
+    Receive batched events from the tracking script.
+    navigator.sendBeacon posts text/plain to avoid a CORS preflight, so the
+    body is parsed here instead of by FastAPI. Events are queued for a
+    background bulk write.
+    """
+    body = await request.body()
+    if len(body) > MAX_BEACON_BYTES:
+        raise HTTPException(status_code=413, detail="Beacon payload too large")
+
+    try:
+        raw_events = json.loads(body)["events"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid beacon payload")
+    if not isinstance(raw_events, list):
+        raise HTTPException(status_code=400, detail="Invalid beacon payload")
+    if len(raw_events) > MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_EVENTS} events")
+
+    if reject_bot(db, request, [event.get("business_id") if isinstance(event, dict) else None for event in raw_events]):
+        return Response(status_code=204)
+
+    _, accepted = validate_events(db, raw_events)
+    if not accepted:
+        return Response(status_code=204)
+
+    visitor_pks, created_visitors = resolve_event_visitors(db, accepted, request)
+    now = datetime.utcnow()
+    if created_visitors:
+        db.commit()
+        tracking_store.remember_visitors(created_visitors)
+        for business_id, _ in created_visitors:
+            event_buffer.record_rollup(business_id, "new_visitors", now)
+        background_tasks.add_task(geoip.enrich_visitors, list(created_visitors.values()), request.client.host)
+
+    try:
+        for _, event in accepted:
+            visitor_pk = visitor_pks.get((event.business_id, event.visitor_id))
+            # Beacons get no per-event results; events of another business's visitor are dropped
+            if visitor_pk is None or is_duplicate_event(db, visitor_pk, event, now):
+                continue
+            event_buffer.enqueue(build_event_row(visitor_pk, event, now), visitor_pk, event.business_id, event.duration, now)
+    except BufferFull:
+        raise HTTPException(status_code=503, detail="Tracking is temporarily overloaded")
+
+    return Response(status_code=204)
 
 @router.post("/capture-lead")
 async def capture_lead(
@@ -150,12 +317,13 @@ async def capture_lead(
     db: Session = Depends(get_db)
 ):
     """Capture lead information from website forms"""
+    if throttle(db, lead_data.business_id, lead_data.visitor_id):
+        raise HTTPException(status_code=429, detail="Tracking rate limit exceeded", headers={"Retry-After": "1"})
     
     # Get visitor
-    visitor = db.query(WebsiteVisitor).filter(
-        WebsiteVisitor.visitor_id == lead_data.visitor_id,
-        WebsiteVisitor.business_id == lead_data.business_id
-    ).first()
+    visitor_pk = tracking_store.resolve_visitor(db, lead_data.business_id, lead_data.visitor_id)
+    # Locked like the rows of a flush, so the score and counters it reads are current
+    visitor = db.get(WebsiteVisitor, visitor_pk, with_for_update=True) if visitor_pk else None
     
     if not visitor:
         raise HTTPException(status_code=404, detail="Visitor not found")
@@ -168,108 +336,491 @@ async def capture_lead(
     if lead_data.name:
         visitor.name = lead_data.name
     
+    is_new_lead = not visitor.is_lead
     visitor.is_lead = True
     visitor.lead_converted_at = datetime.utcnow()
     
-    # Calculate lead score based on behavior
+    # Calculate lead score based on behavior; later events keep it up to date incrementally
+    old_score = visitor.lead_score or 0
     visitor.lead_score = calculate_lead_score(visitor)
+    visitor_scoring.notify_after_commit(db, visitor.id, visitor.business_id, old_score, visitor.lead_score)
     
     db.commit()
     
+    if is_new_lead:
+        event_buffer.record_rollup(lead_data.business_id, "new_leads", visitor.lead_converted_at)
+    
     return {"status": "success", "lead_id": visitor.id, "lead_score": visitor.lead_score}
 
 @router.get("/leads/{business_id}")
 async def get_website_leads(
     business_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[str] = None,
+    format: str = "json",
     db: Session = Depends(get_db)
 ):
-    """Get all leads captured from website"""
+    """
+    Leads captured from the website, most recently active first.
+    Pass next_cursor back as cursor for the next page, or format=ndjson to stream every lead.
+    """
     
-    leads = db.query(WebsiteVisitor).filter(
+    query = db.query(WebsiteVisitor).filter(
         WebsiteVisitor.business_id == business_id,
         WebsiteVisitor.is_lead == True
-    ).all()
+    )
     
-    return {"leads": leads}
+    return list_visitors(db, query, "leads", cursor, limit, fields, format)
 
 @router.get("/visitors/{business_id}")
 async def get_website_visitors(
     business_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[str] = None,
+    format: str = "json",
     db: Session = Depends(get_db)
 ):
-    """Get all website visitors with analytics"""
+    """
+    Website visitors with analytics, most recently active first.
+    Pass next_cursor back as cursor for the next page, or format=ndjson to stream every visitor.
+    """
     
-    visitors = db.query(WebsiteVisitor).filter(
+    query = db.query(WebsiteVisitor).filter(
         WebsiteVisitor.business_id == business_id
-    ).all()
+    )
     
-    return {"visitors": visitors}
+    return list_visitors(db, query, "visitors", cursor, limit, fields, format)
+
+@router.get("/export/{business_id}")
+async def export_events(
+    business_id: int,
+    format: str = "csv",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Stream a business's raw events in [start_date, end_date) as CSV or Parquet.
+    Rows are ordered by created_at, so an interrupted export can be resumed from a later start_date.
+    """
+    if format not in event_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be csv or parquet")
+    if format == "parquet" and not event_export.PYARROW_AVAILABLE:
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    if not get_tracking_config(db, business_id)["exists"]:
+        raise HTTPException(status_code=404, detail="Business not found")
+    
+    filename = f"events_{business_id}"
+    if start_date:
+        filename += f"_from_{start_date:%Y%m%dT%H%M%S}"
+    if end_date:
+        filename += f"_to_{end_date:%Y%m%dT%H%M%S}"
+    
+    return StreamingResponse(
+        stream_export(db.get_bind(), business_id, format, start_date, end_date),
+        media_type="text/csv" if format == "csv" else "application/vnd.apache.parquet",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    )
+
+def stream_export(bind, business_id: int, export_format: str, start: Optional[datetime], end: Optional[datetime]):
+    """Export bytes produced on a dedicated session, like stream_visitors"""
+    db = Session(bind=bind)
+    try:
+        yield from event_export.export_stream(db, business_id, export_format, start, end)
+    finally:
+        db.close()
 
 @router.get("/analytics/{business_id}")
 async def get_website_analytics(
     business_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
     db: Session = Depends(get_db)
 ):
-    """Get website analytics and metrics"""
-    
-    # Get total visitors
-    total_visitors = db.query(WebsiteVisitor).filter(
-        WebsiteVisitor.business_id == business_id
-    ).count()
+    """
+    Get website analytics and metrics.
+    Served from the daily rollups, so the cost does not grow with raw event volume.
+    """
     
-    # Get total leads
-    total_leads = db.query(WebsiteVisitor).filter(
-        WebsiteVisitor.business_id == business_id,
-        WebsiteVisitor.is_lead == True
-    ).count()
+    # Visitors and leads created in the period (all time by default)
+    total_visitors = rollups.metric_total(db, business_id, "new_visitors", start_date, end_date)
+    total_leads = rollups.metric_total(db, business_id, "new_leads", start_date, end_date)
+    total_page_views = rollups.metric_total(db, business_id, "page_views", start_date, end_date)
     
     # Calculate conversion rate
     conversion_rate = (total_leads / total_visitors * 100) if total_visitors > 0 else 0
     
     # Get top pages
-    top_pages = db.query(WebsiteEvent.page_url).filter(
-        WebsiteEvent.visitor.has(business_id=business_id),
-        WebsiteEvent.event_type == "page_view"
-    ).group_by(WebsiteEvent.page_url).limit(10).all()
+    page_views = func.sum(AnalyticsRollup.value)
+    top_pages = rollups.rollup_query(db, business_id, "day", start_date, end_date).filter(
+        AnalyticsRollup.metric == "page_views"
+    ).with_entities(
+        AnalyticsRollup.dimension, page_views
+    ).group_by(AnalyticsRollup.dimension).order_by(page_views.desc()).limit(10).all()
     
     return {
         "total_visitors": total_visitors,
         "total_leads": total_leads,
+        "total_page_views": total_page_views,
         "conversion_rate": conversion_rate,
         "top_pages": [page[0] for page in top_pages]
     }
 
-def get_device_type(user_agent):
-    """Determine device type from user agent"""
-    if user_agent.is_mobile:
-        return "mobile"
-    elif user_agent.is_tablet:
-        return "tablet"
-    else:
-        return "desktop"
+@router.get("/analytics/{business_id}/unique-visitors")
+async def get_unique_visitors(
+    business_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    exact: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Distinct visitors over the UTC days overlapping [start_date, end_date), the last 30 days by default.
+    Estimated by merging the daily HyperLogLog sketches; exact=true counts the raw events instead.
+    """
+    return visitor_sketches.unique_visitors(db, business_id, start_date, end_date, exact)
 
-def calculate_lead_score(visitor: WebsiteVisitor) -> int:
-    """Calculate lead score based on visitor behavior"""
-    score = 0
-    
-    # Base score for becoming a lead
-    score += 10
+@router.get("/live/{business_id}")
+async def live_analytics(business_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Server-sent events stream of live counters for a dashboard, instead of polling /analytics.
+    Each "counters" event carries the page views, new visitors and new leads since the previous
+    event and the current number of active visitors; at most one is sent per push interval.
+    """
+    if not db.query(Business.id).filter(Business.id == business_id).first():
+        raise HTTPException(status_code=404, detail="Business not found")
+    
+    subscription = live_hub.subscribe(business_id)
+    return StreamingResponse(
+        live_events(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/analytics/{business_id}/timeseries")
+async def get_website_timeseries(
+    business_id: int,
+    granularity: str = "day",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """Per-bucket totals of each rollup metric (page_views, events, unique_visitors, new_visitors, new_leads, sessions, bot_hits, throttled_events)"""
+    if granularity not in rollups.GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(rollups.GRANULARITIES)}")
     
-    # Points for multiple visits
-    score += min(visitor.total_visits * 2, 20)
+    totals = rollups.rollup_query(db, business_id, granularity, start_date, end_date).with_entities(
+        AnalyticsRollup.bucket_start,
+        AnalyticsRollup.metric,
+        func.sum(AnalyticsRollup.value)
+    ).group_by(AnalyticsRollup.bucket_start, AnalyticsRollup.metric).order_by(AnalyticsRollup.bucket_start).all()
     
-    # Points for time spent
-    score += min(int(visitor.total_time_spent), 30)
+    buckets = {}
+    for bucket, metric, value in totals:
+        buckets.setdefault(bucket, {"bucket_start": bucket})[metric] = int(value)
     
-    # Points for page views
-    score += min(visitor.total_page_views, 25)
+    return {"granularity": granularity, "buckets": list(buckets.values())}
+
+def validate_events(db: Session, raw_events: List[Any]) -> Tuple[List[Optional[dict]], List[Tuple[int, TrackingEvent]]]:
+    """
+    Validate raw event payloads one by one, and apply the rate limits to the valid ones.
+    Returns per-event rejection results (None where accepted) and the accepted (index, event) pairs.
+    """
+    results = [None] * len(raw_events)
+    valid = []
+    for index, raw_event in enumerate(raw_events):
+        try:
+            event = TrackingEvent.model_validate(raw_event)
+        except ValidationError:
+            results[index] = {"index": index, "status": "rejected", "error": "Invalid event"}
+            continue
+        if not event.visitor_id:
+            results[index] = {"index": index, "status": "rejected", "error": "visitor_id is required"}
+            continue
+        if throttle(db, event.business_id, event.visitor_id):
+            results[index] = {"index": index, "status": "rejected", "error": "Rate limited"}
+            continue
+        valid.append((index, event))
+
+    # Drop events for unknown businesses or businesses with tracking disabled
+    enabled_businesses = {
+        business_id for business_id in {event.business_id for _, event in valid}
+        if get_tracking_config(db, business_id)["enabled"]
+    }
+
+    accepted = []
+    for index, event in valid:
+        if event.business_id not in enabled_businesses:
+            results[index] = {"index": index, "status": "rejected", "error": "Tracking not found"}
+        else:
+            accepted.append((index, event))
+
+    return results, accepted
+
+def resolve_event_visitors(
+    db: Session,
+    accepted: List[Tuple[int, TrackingEvent]],
+    request: Request
+) -> Tuple[Dict[tracking_store.VisitorKey, int], Dict[tracking_store.VisitorKey, int]]:
+    """
+    Resolve the visitor primary keys for a batch of events, inserting visitors seen for the first time.
+    Returns all primary keys and the newly created subset; the caller commits. Keys whose
+    visitor_id belongs to another business (stored, or claimed earlier in the batch) are
+    left out, so their events can be rejected one by one.
+    """
+    keys = {(event.business_id, event.visitor_id) for _, event in accepted}
+    conflicts = set()
+    visitor_pks = tracking_store.resolve_visitors(db, keys, conflicts)
+
+    new_keys = {}
+    for _, event in accepted:
+        key = (event.business_id, event.visitor_id)
+        if key not in visitor_pks and key not in conflicts:
+            # The first business to send a new visitor_id in the batch gets it
+            new_keys.setdefault(event.visitor_id, key)
+
+    user_agent_string = request.headers.get("user-agent", "")
+    created_visitors = tracking_store.create_visitors(db, [
+        {
+            "business_id": business_id,
+            "visitor_id": visitor_id,
+            "ip_address": request.client.host,
+            "user_agent": user_agent_string
+        }
+        for business_id, visitor_id in new_keys.values()
+    ])
+    visitor_pks.update(created_visitors)
+    return visitor_pks, created_visitors
+
+def build_event_row(visitor_pk: int, event: TrackingEvent, created_at: datetime) -> dict:
+    """Build a WebsiteEvent insert row from a tracking event"""
+    return {
+        "visitor_id": visitor_pk,
+        "session_id": None,  # assigned by the sessionizer when the row is written
+        "event_type": event.event_type,
+        "page_url": event.page_url,
+        "page_title": event.page_title,
+        "event_data": event.event_data,
+        "duration": event.duration,
+        "form_fields": event.form_fields,
+        "client_event_id": event.event_id,
+        "created_at": created_at
+    }
+
+def is_duplicate_event(db: Session, visitor_pk: int, event: TrackingEvent, now: datetime, pending: List[dict] = ()) -> bool:
+    """
+    Whether an event carrying a client event id was already accepted. The Bloom filter
+    answers most events without any lookup; possible hits are confirmed against the
+    pending rows of this request, the event buffer and the recently stored events.
+    """
+    if not event.event_id:
+        return False
+    
+    def confirm() -> bool:
+        return (
+            any(row["visitor_id"] == visitor_pk and row["client_event_id"] == event.event_id for row in pending)
+            or event_buffer.has_event(visitor_pk, event.event_id)
+            or tracking_store.event_exists(db, visitor_pk, event.event_id, now - timedelta(seconds=DEDUP_WINDOW))
+        )
     
-    # Points for providing contact info
-    if visitor.email:
-        score += 15
-    if visitor.phone:
-        score += 10
-    if visitor.name:
-        score += 5
+    key = deduplicator.key(event.business_id, event.visitor_id, event.event_id)
+    return deduplicator.is_duplicate(key, confirm)
+
+def select_visitor_fields(fields: Optional[str]) -> List[str]:
+    """Columns to return for a comma-separated fields parameter (all columns when omitted)"""
+    if not fields:
+        return list(VISITOR_FIELDS)
+    
+    selected = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in VISITOR_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    
+    # The id is always returned so rows can be referenced
+    return ["id"] + [name for name in dict.fromkeys(selected) if name != "id"]
+
+def list_visitors(
+    db: Session,
+    query,
+    key: str,
+    cursor: Optional[str],
+    limit: int,
+    fields: Optional[str],
+    format: str
+):
+    """Keyset-paginated or NDJSON-streamed listing of a WebsiteVisitor query, ordered by (last_visit, id)"""
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    
+    try:
+        after = pagination.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    output_fields = select_visitor_fields(fields)
+    # The sort key is always selected; it is only returned when asked for
+    columns = [getattr(WebsiteVisitor, name) for name in dict.fromkeys(output_fields + ["last_visit"])]
+    query = query.with_entities(*columns)
+    
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_visitors(db.get_bind(), query, output_fields, after),
+            media_type="application/x-ndjson"
+        )
     
-    return min(score, 100)  # Cap at 100 
\ No newline at end of file
+    rows, next_cursor = pagination.keyset_page(query, WebsiteVisitor.last_visit, WebsiteVisitor.id, limit, after)
+    return {
+        key: [{name: row._mapping[name] for name in output_fields} for row in rows],
+        "next_cursor": next_cursor
+    }
+
+def stream_visitors(bind, query, output_fields: List[str], after: Optional[pagination.Cursor]):
+    """
+    Yield one JSON line per visitor. Runs on its own session, since the request's
+    session may be closed before the response body has been sent.
+    """
+    db = Session(bind=bind)
+    try:
+        rows = pagination.keyset_stream(
+            query.with_session(db), WebsiteVisitor.last_visit, WebsiteVisitor.id, after, STREAM_BATCH_SIZE
+        )
+        for row in rows:
+            mapping = row._mapping
+            yield json.dumps({name: mapping[name] for name in output_fields}, default=_json_default) + "\n"
+    finally:
+        db.close()
+
+def pixel_response() -> Response:
+    return Response(
+        content=PIXEL_DATA,
+        media_type="image/png",
+        headers={"Cache-Control": "no-cache, no-store, must-revalidate"}
+    )
+
+def reject_bot(db: Session, request: Request, business_ids: List[Any]) -> bool:
+    """
+    Classify a hit before any database work. Bot hits are counted per business
+    (and sampled into the bot_hits rollup) instead of being stored; returns True for them.
+    """
+    reason = bot_filter.classify(request.headers.get("user-agent", ""), request.client.host)
+    if reason is None:
+        return False
+    
+    now = datetime.utcnow()
+    for business_id in business_ids:
+        business_id = business_id if isinstance(business_id, int) else None
+        bot_filter.bot_counters.add(business_id, reason)
+        amount = bot_filter.sampled()
+        # Only sampled hits pay for the (cached) business lookup
+        if amount and business_id is not None and get_tracking_config(db, business_id)["enabled"]:
+            event_buffer.record_rollup(business_id, "bot_hits", now, reason, amount)
+    return True
+
+def throttle(db: Session, business_id: int, visitor_id: Optional[str]) -> Optional[str]:
+    """
+    Spend a business and visitor token for one hit; returns the limit hit, or None if admitted.
+    Throttled hits are counted in memory and optionally sampled into the throttled_events rollup.
+    """
+    limit = rate_limit.admission.check(business_id, visitor_id)
+    if limit is not None:
+        amount = bot_filter.sampled(rate_limit.THROTTLE_SAMPLE_RATE)
+        if amount and get_tracking_config(db, business_id)["enabled"]:
+            event_buffer.record_rollup(business_id, "throttled_events", datetime.utcnow(), limit, amount)
+    return limit
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+async def live_events(
+    request: Request,
+    subscription,
+    interval: float = LIVE_PUSH_INTERVAL,
+    heartbeat: float = LIVE_HEARTBEAT_INTERVAL
+):
+    """Coalesced counter events for one subscriber until the client disconnects"""
+    business_id = subscription.business_id
+    try:
+        active = live_hub.active_visitors(business_id)
+        yield format_sse("counters", {**{metric: 0 for metric in LIVE_METRICS}, "active_visitors": active})
+        idle = 0.0
+        while not await request.is_disconnected():
+            await asyncio.sleep(interval)
+            counters = subscription.drain()
+            current = live_hub.active_visitors(business_id)
+            if counters is not None or current != active:
+                active = current
+                counters = counters or {}
+                yield format_sse("counters", {
+                    **{metric: counters.get(metric, 0) for metric in LIVE_METRICS},
+                    "active_visitors": active
+                })
+                idle = 0.0
+            else:
+                idle += interval
+                if idle >= heartbeat:
+                    # Comment line: keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    idle = 0.0
+    finally:
+        live_hub.unsubscribe(subscription)
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+@router.post("/funnels/{business_id}")
+async def get_funnel(
+    business_id: int,
+    funnel: FunnelRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Ordered conversion funnel, e.g. page_view(/pricing) -> element_click(signup) -> form_submit.
+    Returns visitors, conversion and drop-off per step.
+    """
+    if not 1 <= len(funnel.steps) <= funnels.MAX_FUNNEL_STEPS:
+        raise HTTPException(status_code=400, detail=f"A funnel needs between 1 and {funnels.MAX_FUNNEL_STEPS} steps")
+    if not get_tracking_config(db, business_id)["exists"]:
+        raise HTTPException(status_code=404, detail="Business not found")
+    
+    steps = tuple(funnels.FunnelStep(step.event_type, step.page_url, step.element) for step in funnel.steps)
+    return funnels.compute_funnel(
+        db, business_id, steps, funnel.start_date, funnel.end_date, funnel.window_seconds
+    )
+
+@router.get("/bots/{business_id}")
+async def get_bot_rejections(business_id: int):
+    """Bot and crawler hits rejected for a business since this process started, by reason"""
+    return bot_filter.bot_counters.for_business(business_id)
+
+@router.get("/throttle/{business_id}")
+async def get_throttle_counts(business_id: int):
+    """Tracking hits admitted and shed by the rate limits for a business since this process started"""
+    return rate_limit.admission.for_business(business_id)
+
+@router.get("/stats")
+async def get_tracking_stats():
+    """Internal metrics for the tracking ingestion pipeline"""
+    return {
+        "buffer": event_buffer.stats(),
+        "visitor_cache": visitor_cache.stats(),
+        "business_cache": business_config_cache.stats(),
+        "user_agent_cache": user_agent_cache_stats(),
+        "geoip_cache": geoip.cache_stats(),
+        "funnel_cache": funnels.cache_stats(),
+        "visitor_sketch_cache": visitor_sketches.cache_stats(),
+        "live": live_hub.stats(),
+        "bots": bot_filter.bot_counters.stats(),
+        "dedup": deduplicator.stats(),
+        "throttle": rate_limit.admission.stats(),
+        "sessions": sessionizer.stats()
+    }
+
+def calculate_lead_score(visitor: WebsiteVisitor) -> int:
+    """Calculate lead score based on visitor behavior"""
+    return visitor_scoring.score_visitor(visitor)
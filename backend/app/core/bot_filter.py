@@ -0,0 +1,138 @@
+"""
+Fast rejection of bot and crawler traffic in tracking ingestion.
+
+classify() runs before any database work: it checks the memoized
+user-agent parse (see app/core/user_agent.py) and the blocked IP ranges,
+which are merged into sorted integer intervals and searched with bisect.
+Rejected hits are only counted in memory, per business and reason; with
+TRACKING_BOT_SAMPLE_RATE > 0 a sample of them is also recorded in the
+"bot_hits" analytics rollup, scaled back up to an estimated total.
+
+Blocked ranges come from TRACKING_BLOCKED_IP_RANGES (comma separated CIDRs)
+and TRACKING_BLOCKED_IP_FILE (one CIDR per line, # comments allowed).
+"""
+import bisect
+import ipaddress
+import logging
+import os
+import random
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.core.user_agent import parse_user_agent
+
+logger = logging.getLogger("marketing_automation.tracking")
+
+BOT_SAMPLE_RATE = float(os.getenv("TRACKING_BOT_SAMPLE_RATE", "0"))
+
+# Per-business counters beyond this many businesses are pooled under None
+MAX_COUNTED_BUSINESSES = int(os.getenv("TRACKING_BOT_MAX_BUSINESSES", "10000"))
+
+REASON_USER_AGENT = "user_agent"
+REASON_IP = "ip_range"
+
+class IPRanges:
+    """Set of CIDR blocks answering membership with one bisect per lookup"""
+
+    def __init__(self, cidrs: Iterable[str] = ()):
+        # version -> (sorted interval starts, matching interval ends)
+        self._intervals: Dict[int, Tuple[List[int], List[int]]] = {4: ([], []), 6: ([], [])}
+        self.load(cidrs)
+
+    def load(self, cidrs: Iterable[str]) -> None:
+        intervals = {4: [], 6: []}
+        for cidr in cidrs:
+            cidr = cidr.split("#", 1)[0].strip()
+            if not cidr:
+                continue
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                logger.warning("Ignoring invalid blocked IP range %r", cidr)
+                continue
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+        merged = {}
+        for version, ranges in intervals.items():
+            starts, ends = [], []
+            for start, end in sorted(ranges):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            merged[version] = (starts, ends)
+        self._intervals = merged
+
+    def __contains__(self, ip_address: str) -> bool:
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return False
+        starts, ends = self._intervals[address.version]
+        position = bisect.bisect_right(starts, int(address)) - 1
+        return position >= 0 and int(address) <= ends[position]
+
+    def __len__(self) -> int:
+        return sum(len(starts) for starts, _ in self._intervals.values())
+
+def _configured_ranges() -> List[str]:
+    cidrs = [cidr for cidr in os.getenv("TRACKING_BLOCKED_IP_RANGES", "").split(",")]
+    path = os.getenv("TRACKING_BLOCKED_IP_FILE")
+    if path:
+        try:
+            with open(path) as f:
+                cidrs.extend(f)
+        except OSError:
+            logger.warning("Blocked IP range file %s could not be read", path)
+    return cidrs
+
+blocked_ranges = IPRanges(_configured_ranges())
+
+def classify(user_agent_string: Optional[str], ip_address: Optional[str]) -> Optional[str]:
+    """Reason a hit is bot traffic, or None for a plausible human visitor"""
+    if parse_user_agent(user_agent_string).is_bot:
+        return REASON_USER_AGENT
+    if ip_address and ip_address in blocked_ranges:
+        return REASON_IP
+    return None
+
+class BotCounters:
+    """In-memory counts of rejected hits per business and reason"""
+
+    def __init__(self, max_businesses: int = MAX_COUNTED_BUSINESSES):
+        self.max_businesses = max_businesses
+        self._lock = threading.Lock()
+        self._counts: Dict[Optional[int], Dict[str, int]] = {}
+
+    def add(self, business_id: Optional[int], reason: str, amount: int = 1) -> None:
+        with self._lock:
+            if business_id not in self._counts and len(self._counts) >= self.max_businesses:
+                business_id = None
+            counts = self._counts.setdefault(business_id, {})
+            counts[reason] = counts.get(reason, 0) + amount
+
+    def for_business(self, business_id: int) -> dict:
+        with self._lock:
+            by_reason = dict(self._counts.get(business_id, {}))
+        return {"rejected": sum(by_reason.values()), "by_reason": by_reason}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_reason = {}
+            for counts in self._counts.values():
+                for reason, amount in counts.items():
+                    by_reason[reason] = by_reason.get(reason, 0) + amount
+            businesses = len(self._counts)
+        return {"rejected": sum(by_reason.values()), "by_reason": by_reason, "businesses": businesses}
+
+bot_counters = BotCounters()
+
+def sampled(sample_rate: float = BOT_SAMPLE_RATE) -> int:
+    """Rollup amount to record for one rejected hit: 0 when not sampled, else the hits it stands for"""
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return 0
+    return max(int(round(1 / sample_rate)), 1)
@@ -0,0 +1,302 @@
+"""
+In-process write-behind buffer for website tracking events.
+
+Request handlers enqueue WebsiteEvent rows, visitor counter deltas and
+analytics rollup increments and return immediately; a background thread flushes them to the database with
+bulk INSERTs whenever the buffer reaches its size threshold or the flush
+interval elapses. Each flush also writes the sessions the sessionizer has closed,
+and once committed is published to live dashboard subscribers.
+
+A failed flush is put back in the queue and retried. After max_retries
+consecutive failures the batch is written in halves, split by visitor, so one
+bad row cannot hold back every other tenant's events; the events of a single
+visitor that still cannot be written are moved to a bounded dead-letter list.
+"""
+from collections import deque
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from datetime import datetime
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.core import tracking_store, rollups
+from app.core.sessionizer import sessionizer
+from app.core.live_analytics import live_hub
+
+logger = logging.getLogger("marketing_automation.tracking")
+
+class BufferFull(Exception):
+    """Raised when the buffer is at capacity and cannot accept more events"""
+
+class EventBuffer:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        max_size: int = 10000,
+        flush_size: int = 500,
+        flush_interval: float = 1.0,
+        max_retries: int = 3,
+        dead_letter_size: int = 1000
+    ):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._rows: List[dict] = []
+        self._in_flight: List[dict] = []  # rows taken by a flush that has not committed yet
+        self._event_keys: Set[Tuple[int, str]] = set()  # (visitor_pk, client_event_id) of _rows and _in_flight
+        self._deltas: Dict[int, dict] = {}
+        self._rollups = rollups.RollupDeltas()
+        self._dead_letters = deque(maxlen=dead_letter_size)  # {"rows", "deltas"} of visitors that could not be written
+        self._retries = 0  # consecutive failed flushes
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        # Metrics
+        self._flushes = 0
+        self._flushed_events = 0
+        self._flushed_visitor_updates = 0  # one coalesced UPDATE per visitor per flush
+        self._failed_flushes = 0
+        self._dropped_events = 0
+        self._dead_lettered_events = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def enqueue(
+        self,
+        row: dict,
+        visitor_pk: int,
+        business_id: int,
+        duration: Optional[float] = None,
+        seen_at: Optional[datetime] = None
+    ) -> None:
+        """Queue one event row and its visitor delta; raises BufferFull at capacity"""
+        with self._lock:
+            if len(self._rows) >= self.max_size:
+                self._dropped_events += 1
+                raise BufferFull()
+            self._rows.append(row)
+            if row.get("client_event_id"):
+                self._event_keys.add((visitor_pk, row["client_event_id"]))
+            tracking_store.add_visitor_delta(self._deltas, visitor_pk, business_id, duration, seen_at)
+            depth = len(self._rows)
+
+        if depth >= self.flush_size:
+            self._wakeup.set()
+
+    def record_visit(
+        self,
+        visitor_pk: int,
+        business_id: int,
+        seen_at: datetime,
+        user_agent: Optional[str] = None,
+        referrer: Optional[str] = None
+    ) -> None:
+        """Queue a repeat visit for a visitor; raises BufferFull at capacity"""
+        with self._lock:
+            if visitor_pk not in self._deltas and len(self._deltas) >= self.max_size:
+                raise BufferFull()
+            tracking_store.add_visit_delta(self._deltas, visitor_pk, business_id, seen_at, user_agent, referrer)
+
+    def has_event(self, visitor_pk: int, client_event_id: str) -> bool:
+        """Whether an event with this client event id is queued or being flushed for the visitor"""
+        with self._lock:
+            return (visitor_pk, client_event_id) in self._event_keys
+
+    def record_rollup(self, business_id: int, metric: str, at: datetime, dimension: str = "", amount: int = 1) -> None:
+        """Queue an analytics rollup increment that is not derived from an event row"""
+        with self._lock:
+            self._rollups.add(business_id, metric, at, dimension, amount)
+
+    def flush(self) -> int:
+        """Write everything currently buffered; returns the number of events flushed"""
+        with self._flush_lock:
+            with self._lock:
+                rows, deltas, rollup_deltas = self._rows, self._deltas, self._rollups
+                self._rows, self._deltas, self._rollups = [], {}, rollups.RollupDeltas()
+                self._in_flight = rows
+            finished_sessions = sessionizer.expire()
+
+            if not rows and not deltas and not rollup_deltas and not finished_sessions:
+                return 0
+
+            started = time.perf_counter()
+            restored = False
+            try:
+                if self._write(rows, deltas, rollup_deltas, finished_sessions):
+                    self._retries = 0
+                    flushed = len(rows)
+                else:
+                    self._failed_flushes += 1
+                    self._retries += 1
+                    if self._retries < self.max_retries:
+                        self._restore(rows, deltas, rollup_deltas)
+                        sessionizer.restore(finished_sessions)
+                        restored = True
+                        return 0
+                    self._retries = 0
+                    flushed = self._bisect(rows, deltas, rollup_deltas, finished_sessions)
+            finally:
+                with self._lock:
+                    self._in_flight = []
+                    if not restored:
+                        self._forget_event_keys(rows)
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._flushes += 1
+            self._flushed_events += flushed
+            self._flushed_visitor_updates += len(deltas)
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+            return flushed
+
+    def _write(
+        self,
+        rows: List[dict],
+        deltas: Dict[int, dict],
+        rollup_deltas: rollups.RollupDeltas,
+        finished_sessions: List[dict]
+    ) -> bool:
+        """Write and commit one batch, then publish it; False if it failed"""
+        db = self.session_factory()
+        try:
+            tracking_store.write_events(db, rows, deltas, rollup_deltas, finished_sessions)
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("Failed to flush %d tracking events", len(rows))
+            return False
+        finally:
+            db.close()
+
+        live_hub.publish_batch(rows, deltas, rollup_deltas)
+        return True
+
+    def _bisect(
+        self,
+        rows: List[dict],
+        deltas: Dict[int, dict],
+        rollup_deltas: rollups.RollupDeltas,
+        finished_sessions: List[dict]
+    ) -> int:
+        """
+        Write a repeatedly failing batch in halves split by visitor, down to
+        a single visitor, which is dead-lettered; returns the number of events
+        written. Rollups and finished sessions not tied to an event row go
+        with the first half, and are retried on their own if that half ends
+        up dead-lettered.
+        """
+        visitors = sorted(deltas)
+        if len(visitors) <= 1:
+            if visitors:
+                with self._lock:
+                    self._dead_letters.append({"rows": rows, "deltas": deltas})
+                    self._dead_lettered_events += len(rows)
+                logger.error("Moved %d tracking events of visitor %s to the dead-letter list", len(rows), visitors[0])
+                if not (len(rollup_deltas) or finished_sessions) or self._write([], {}, rollup_deltas, finished_sessions):
+                    return 0
+            logger.error(
+                "Dropped %d rollup increments and %d finished sessions that could not be written",
+                len(rollup_deltas), len(finished_sessions)
+            )
+            return 0
+
+        first = set(visitors[:len(visitors) // 2])
+        written = 0
+        for in_first in (True, False):
+            half_rows = [row for row in rows if (row["visitor_id"] in first) == in_first]
+            half_deltas = {visitor_pk: deltas[visitor_pk] for visitor_pk in visitors if (visitor_pk in first) == in_first}
+            half_rollups, half_sessions = (rollup_deltas, finished_sessions) if in_first else (rollups.RollupDeltas(), [])
+            if self._write(half_rows, half_deltas, half_rollups, half_sessions):
+                written += len(half_rows)
+            else:
+                written += self._bisect(half_rows, half_deltas, half_rollups, half_sessions)
+        return written
+
+    def _restore(self, rows: List[dict], deltas: Dict[int, dict], rollup_deltas: rollups.RollupDeltas) -> None:
+        """Put a failed batch back in front of the queue, dropping what no longer fits along with its deltas"""
+        with self._lock:
+            room = max(self.max_size - len(self._rows), 0)
+            if len(rows) > room:
+                self._dropped_events += len(rows) - room
+                tracking_store.remove_event_deltas(deltas, rows[room:])
+                self._forget_event_keys(rows[room:])
+                rows = rows[:room]
+            self._rows = rows + self._rows
+            tracking_store.merge_visitor_deltas(self._deltas, deltas)
+            self._rollups.merge(rollup_deltas)
+
+    def _forget_event_keys(self, rows: List[dict]) -> None:
+        """Stop reporting rows that left the buffer; the caller holds the lock"""
+        for row in rows:
+            if row.get("client_event_id"):
+                self._event_keys.discard((row["visitor_id"], row["client_event_id"]))
+
+    def dead_letters(self) -> List[dict]:
+        """Batches that could not be written even on their own, oldest first"""
+        with self._lock:
+            return list(self._dead_letters)
+
+    def _run(self) -> None:
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self) -> None:
+        """Start the background flush thread"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="tracking-event-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the flush thread and write out anything still buffered"""
+        if self._running:
+            self._running = False
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        """Queue depth and flush latency metrics"""
+        with self._lock:
+            depth = len(self._rows)
+            pending_visitors = len(self._deltas)
+            pending_rollups = len(self._rollups)
+
+        return {
+            "depth": depth,
+            "capacity": self.max_size,
+            "pending_visitors": pending_visitors,
+            "pending_rollups": pending_rollups,
+            "flushes": self._flushes,
+            "flushed_events": self._flushed_events,
+            "flushed_visitor_updates": self._flushed_visitor_updates,
+            "failed_flushes": self._failed_flushes,
+            "dropped_events": self._dropped_events,
+            "dead_lettered_events": self._dead_lettered_events,
+            "last_flush_ms": round(self._last_flush_ms, 3),
+            "max_flush_ms": round(self._max_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self._flushes, 3) if self._flushes else 0.0
+        }
+
+event_buffer = EventBuffer(
+    SessionLocal,
+    max_size=int(os.getenv("TRACKING_BUFFER_MAX_SIZE", "10000")),
+    flush_size=int(os.getenv("TRACKING_BUFFER_FLUSH_SIZE", "500")),
+    flush_interval=float(os.getenv("TRACKING_BUFFER_FLUSH_INTERVAL", "1.0")),
+    max_retries=int(os.getenv("TRACKING_BUFFER_MAX_RETRIES", "3")),
+    dead_letter_size=int(os.getenv("TRACKING_BUFFER_DEAD_LETTER_SIZE", "1000"))
+)
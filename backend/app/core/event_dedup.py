@@ -0,0 +1,191 @@
+"""
+Deduplication of retried tracking events by their client-generated event id.
+
+Ids seen recently are kept in a rotating Bloom filter: a ring of
+generations, each receiving inserts for window / generations seconds, with
+the oldest dropped on rotation. A lookup that misses every generation is a
+definite "new event" and costs no database access, which is the common case.
+Only a possible hit (a real retry, or a false positive at roughly
+DEDUP_ERROR_RATE) is confirmed with an exact check against the event buffer
+and the recently stored events.
+
+The filter lives in memory, so at startup it is warmed with the ids of the
+events stored within the window; otherwise a retry arriving just after a
+restart would not even be checked.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.models.website_tracking import WebsiteVisitor
+from app.core import event_partitions
+from app.core.database import SessionLocal
+
+logger = logging.getLogger("marketing_automation.tracking")
+
+DEDUP_WINDOW = float(os.getenv("TRACKING_DEDUP_WINDOW", "3600"))
+DEDUP_GENERATIONS = int(os.getenv("TRACKING_DEDUP_GENERATIONS", "4"))
+DEDUP_CAPACITY = int(os.getenv("TRACKING_DEDUP_CAPACITY", "1000000"))  # ids per generation
+DEDUP_ERROR_RATE = float(os.getenv("TRACKING_DEDUP_ERROR_RATE", "0.001"))
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 64)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: str) -> List[int]:
+        """Bit positions of a key, by double hashing one 128-bit digest"""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.size for index in range(self.hash_count)]
+
+    def contains_positions(self, positions: List[int]) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def add_positions(self, positions: List[int]) -> None:
+        bits = self._bits
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return self.contains_positions(self.positions(key))
+
+    def add(self, key: str) -> None:
+        self.add_positions(self.positions(key))
+
+class RotatingBloomFilter:
+    """Bloom filter over the keys added in roughly the last `window` seconds"""
+
+    def __init__(
+        self,
+        window: float = DEDUP_WINDOW,
+        generations: int = DEDUP_GENERATIONS,
+        capacity: int = DEDUP_CAPACITY,
+        error_rate: float = DEDUP_ERROR_RATE,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.window = window
+        self.generations = generations
+        self.capacity = capacity
+        # Each generation is checked, so it gets a share of the overall error rate
+        self.error_rate = error_rate / generations
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._filters: Deque[Tuple[float, BloomFilter]] = deque()
+        self._rotate(self.clock())
+
+    def _rotate(self, now: float) -> None:
+        self._filters.append((now, BloomFilter(self.capacity, self.error_rate)))
+        # A generation stopped receiving keys when the next one started; drop it once that is outside the window
+        while len(self._filters) > self.generations or (len(self._filters) > 1 and self._filters[1][0] < now - self.window):
+            self._filters.popleft()
+
+    def check_and_add(self, key: str) -> bool:
+        """Add a key; returns True if it may have been added within the window"""
+        now = self.clock()
+        with self._lock:
+            started, current = self._filters[-1]
+            if now - started >= self.window / self.generations or current.count >= self.capacity:
+                self._rotate(now)
+                current = self._filters[-1][1]
+            positions = current.positions(key)
+            seen = any(bloom.contains_positions(positions) for _, bloom in self._filters)
+            if not seen:
+                current.add_positions(positions)
+            return seen
+
+    def clear(self) -> None:
+        with self._lock:
+            self._filters.clear()
+            self._rotate(self.clock())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "generations": len(self._filters),
+                "keys": sum(bloom.count for _, bloom in self._filters),
+                "bytes": sum(len(bloom._bits) for _, bloom in self._filters)
+            }
+
+class EventDeduplicator:
+    """Bloom filter pre-check plus exact confirmation, with counters"""
+
+    def __init__(self, bloom: Optional[RotatingBloomFilter] = None):
+        self.bloom = bloom or RotatingBloomFilter()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._checked = 0
+        self._possible_hits = 0
+        self._duplicates = 0
+
+    @staticmethod
+    def key(business_id: int, visitor_id: str, event_id: str) -> str:
+        return f"{business_id}:{visitor_id}:{event_id}"
+
+    def is_duplicate(self, key: str, confirm: Callable[[], bool]) -> bool:
+        """
+        Whether the event with this key was already accepted. confirm() performs
+        the exact check and is only called when the Bloom filter reports a possible hit.
+        """
+        possible = self.bloom.check_and_add(key)
+        duplicate = possible and confirm()
+        with self._lock:
+            self._checked += 1
+            self._possible_hits += possible
+            self._duplicates += duplicate
+        return duplicate
+
+    def warm(self, db: Session, now: Optional[datetime] = None, batch_size: int = 10000) -> int:
+        """Add the client event ids stored within the window; returns how many were added"""
+        since = (now or datetime.utcnow()) - timedelta(seconds=self.bloom.window)
+        events = event_partitions.events_table(db, since)
+        visitors = WebsiteVisitor.__table__
+        query = select(visitors.c.business_id, visitors.c.visitor_id, events.c.client_event_id).select_from(
+            events.join(visitors, events.c.visitor_id == visitors.c.id)
+        ).where(
+            events.c.created_at >= since,
+            events.c.client_event_id.isnot(None)
+        )
+        added = 0
+        for rows in db.execute(query.execution_options(yield_per=batch_size)).partitions():
+            for business_id, visitor_id, client_event_id in rows:
+                self.bloom.check_and_add(self.key(business_id, visitor_id, client_event_id))
+                added += 1
+        return added
+
+    def clear(self) -> None:
+        self.bloom.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checked": self._checked,
+                "possible_hits": self._possible_hits,
+                "duplicates": self._duplicates,
+                "false_positives": self._possible_hits - self._duplicates,
+                **self.bloom.stats()
+            }
+
+deduplicator = EventDeduplicator()
+
+def warm_deduplicator(session_factory: Callable[[], Session] = SessionLocal) -> None:
+    """Warm the global deduplicator at startup; failures are logged, not raised"""
+    db = session_factory()
+    try:
+        logger.info("Loaded %d recent event ids for deduplication", deduplicator.warm(db))
+    except Exception:
+        logger.exception("Failed to load recent event ids for deduplication")
+    finally:
+        db.close()
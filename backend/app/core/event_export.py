@@ -0,0 +1,176 @@
+"""
+Bulk export of raw website events to CSV or Parquet.
+
+Events are read through a server-side cursor and written one chunk at a
+time (one Parquet row group per chunk), so memory is bounded by the chunk
+size whatever the size of the export. Rows are ordered by (created_at, id),
+which makes a time range the unit of resumption: re-running an export from
+the start of an unfinished range reproduces it exactly.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.models.website_tracking import WebsiteVisitor
+from app.core import event_partitions
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+EXPORT_FORMATS = ("csv", "parquet")
+DEFAULT_CHUNK_SIZE = 50000
+
+EXPORT_COLUMNS = (
+    "id",
+    "visitor_pk",
+    "visitor_id",
+    "event_type",
+    "page_url",
+    "page_title",
+    "duration",
+    "event_data",
+    "form_fields",
+    "created_at"
+)
+
+# JSON columns are exported as JSON text
+_JSON_COLUMNS = {"event_data", "form_fields"}
+
+if PYARROW_AVAILABLE:
+    PARQUET_SCHEMA = pa.schema([
+        ("id", pa.int64()),
+        ("visitor_pk", pa.int64()),
+        ("visitor_id", pa.string()),
+        ("event_type", pa.string()),
+        ("page_url", pa.string()),
+        ("page_title", pa.string()),
+        ("duration", pa.float64()),
+        ("event_data", pa.string()),
+        ("form_fields", pa.string()),
+        ("created_at", pa.timestamp("us", tz="UTC"))
+    ])
+
+def events_query(db: Session, business_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Events of one business in [start, end), in export order"""
+    events = event_partitions.events_table(db, start, end)
+    visitors = WebsiteVisitor.__table__
+    query = select(
+        events.c.id,
+        events.c.visitor_id.label("visitor_pk"),
+        visitors.c.visitor_id,
+        events.c.event_type,
+        events.c.page_url,
+        events.c.page_title,
+        events.c.duration,
+        events.c.event_data,
+        events.c.form_fields,
+        events.c.created_at
+    ).select_from(
+        events.join(visitors, events.c.visitor_id == visitors.c.id)
+    ).where(
+        visitors.c.business_id == business_id
+    )
+    if start:
+        query = query.where(events.c.created_at >= start)
+    if end:
+        query = query.where(events.c.created_at < end)
+    return query.order_by(events.c.created_at, events.c.id)
+
+def iter_chunks(
+    db: Session,
+    business_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[List[Tuple]]:
+    """Lists of at most chunk_size event rows, fetched through a server-side cursor"""
+    statement = events_query(db, business_id, start, end).execution_options(yield_per=chunk_size)
+    for rows in db.execute(statement).partitions():
+        yield [_export_row(row) for row in rows]
+
+def _export_row(row) -> Tuple:
+    values = []
+    for name, value in zip(EXPORT_COLUMNS, row):
+        if name in _JSON_COLUMNS and value is not None:
+            value = json.dumps(value, separators=(",", ":"))
+        values.append(value)
+    return tuple(values)
+
+def csv_stream(chunks: Iterable[List[Tuple]]) -> Iterator[bytes]:
+    """Encode chunks as CSV, one block of bytes per chunk, starting with the header"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(
+            tuple(value.isoformat() if isinstance(value, datetime) else value for value in row)
+            for row in rows
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after each row group"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def parquet_stream(chunks: Iterable[List[Tuple]]) -> Iterator[bytes]:
+    """Encode chunks as a Parquet file, one row group per chunk, yielding bytes as they are written"""
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("pyarrow is required for Parquet export")
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, PARQUET_SCHEMA, compression="snappy")
+    try:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, PARQUET_SCHEMA)],
+                schema=PARQUET_SCHEMA
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def export_stream(
+    db: Session,
+    business_id: int,
+    export_format: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Bytes of a CSV or Parquet export of one business's events in [start, end)"""
+    chunks = iter_chunks(db, business_id, start, end, chunk_size)
+    if export_format == "parquet":
+        return parquet_stream(chunks)
+    return csv_stream(chunks)
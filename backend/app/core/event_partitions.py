@@ -0,0 +1,386 @@
+"""
+Monthly partitioning and retention of website_events.
+
+Postgres: website_events is created as a native RANGE (created_at)
+partitioned table (see create_partitioned_events_table) with one partition
+per month, named website_events_YYYY_MM, and a DEFAULT partition that
+catches rows outside them (clock skew, late backfills) instead of failing
+the insert. Inserts and reads go through the parent table; queries filtered
+on created_at are pruned to the partitions they need. Partitions are created
+a few months ahead by ensure_partitions, moving any rows of their month out
+of the DEFAULT partition. An existing unpartitioned table is converted by
+partition_existing_events_table, which attaches it as the DEFAULT partition.
+
+SQLite: website_events holds the current (hot) month. rotate_closed_months
+moves each closed month into its own website_events_YYYY_MM table in
+bounded batches, and events_table() reads the hot table plus only the
+monthly tables overlapping the requested range.
+
+Retention (compact_expired) first makes sure every business-day of an
+expired month is covered by the daily rollups, then drops the month's
+partition or table, which is a metadata operation rather than a long
+DELETE. Rows outside the monthly partitions, and tables that are not
+partitioned, fall back to batched deletes.
+"""
+import logging
+import re
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import MetaData, Table, Column, Index, ForeignKeyConstraint, select, delete, func, text, union_all
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.models.website_tracking import WebsiteVisitor, WebsiteEvent
+from app.models.analytics import AnalyticsRollup
+from app.core import rollups
+
+logger = logging.getLogger("marketing_automation.tracking")
+
+EVENTS_TABLE = WebsiteEvent.__table__.name
+DEFAULT_PARTITION = f"{EVENTS_TABLE}_default"
+LEGACY_TABLE = f"{EVENTS_TABLE}_legacy"
+PARTITION_NAME = re.compile(rf"^{EVENTS_TABLE}_(\d{{4}})_(\d{{2}})$")
+DEFAULT_BATCH_SIZE = 10000
+
+_events = WebsiteEvent.__table__
+_visitors = WebsiteVisitor.__table__
+
+def month_start(value: datetime) -> datetime:
+    value = rollups.as_utc(value)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(value: datetime) -> datetime:
+    return (month_start(value) + timedelta(days=32)).replace(day=1)
+
+def partition_name(month: datetime) -> str:
+    return f"{EVENTS_TABLE}_{month:%Y_%m}"
+
+def partition_month(name: str) -> Optional[datetime]:
+    match = PARTITION_NAME.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+def _dialect(bind) -> str:
+    return bind.dialect.name
+
+# Postgres native partitioning
+
+def _create_partitioned_table(connection) -> None:
+    metadata = MetaData()
+    _visitors.to_metadata(metadata)  # target of the visitor_id foreign key
+    columns = [column._copy() for column in _events.columns]
+    for column in columns:
+        if column.name == "id":
+            column.autoincrement = True
+        elif column.name == "created_at":
+            # The partition key has to be part of the primary key
+            column.primary_key = True
+            column.nullable = False
+    table = Table(
+        EVENTS_TABLE, metadata, *columns,
+        ForeignKeyConstraint(["visitor_id"], [f"{_visitors.name}.id"]),
+        postgresql_partition_by="RANGE (created_at)"
+    )
+    table.create(connection)
+
+def create_partitioned_events_table(engine: Engine) -> bool:
+    """
+    Create website_events as a partitioned table on Postgres, before
+    Base.metadata.create_all (which then only adds the indexes).
+    Returns False when the dialect is not Postgres or the table already exists.
+    """
+    if _dialect(engine) != "postgresql":
+        return False
+    with engine.begin() as connection:
+        if engine.dialect.has_table(connection, EVENTS_TABLE):
+            return False
+        _create_partitioned_table(connection)
+    ensure_partitions(engine)
+    return True
+
+def partition_existing_events_table(engine: Engine) -> bool:
+    """
+    Convert an unpartitioned website_events on Postgres in place. The table
+    is renamed to website_events_legacy and attached as the DEFAULT partition
+    of a new partitioned website_events, so no rows are copied up front;
+    ensure_partitions then moves the current and upcoming months into their
+    own partitions, and older rows are deleted by retention as they expire.
+    Attaching validates every row (created_at must not be NULL), so run it
+    in a maintenance window. Returns False when there is nothing to convert.
+    """
+    if _dialect(engine) != "postgresql":
+        return False
+    with engine.begin() as connection:
+        if not engine.dialect.has_table(connection, EVENTS_TABLE) or is_partitioned(connection):
+            return False
+
+        connection.execute(text(f'ALTER TABLE "{EVENTS_TABLE}" RENAME TO "{LEGACY_TABLE}"'))
+        # Free the index (and primary key) and sequence names for the new table
+        index_names = connection.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :name"), {"name": LEGACY_TABLE}
+        ).scalars().all()
+        for name in index_names:
+            new_name = name.replace(EVENTS_TABLE, LEGACY_TABLE, 1) if EVENTS_TABLE in name else f"{name}_legacy"
+            connection.execute(text(f'ALTER INDEX "{name}" RENAME TO "{new_name}"'))
+        sequence = connection.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": LEGACY_TABLE}).scalar()
+        if sequence:
+            connection.execute(text(f'ALTER SEQUENCE {sequence} RENAME TO "{LEGACY_TABLE}_id_seq"'))
+
+        _create_partitioned_table(connection)
+        # New ids continue after the existing ones
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence(:name, 'id'), "
+            f'COALESCE((SELECT max(id) FROM "{LEGACY_TABLE}"), 0) + 1, false)'
+        ), {"name": EVENTS_TABLE})
+        connection.execute(text(f'ALTER TABLE "{LEGACY_TABLE}" ALTER COLUMN created_at SET NOT NULL'))
+        connection.execute(text(f'ALTER TABLE "{EVENTS_TABLE}" ATTACH PARTITION "{LEGACY_TABLE}" DEFAULT'))
+    ensure_partitions(engine)
+    return True
+
+def is_partitioned(db) -> bool:
+    """Whether website_events is a native partitioned table"""
+    if _dialect(db.get_bind() if isinstance(db, Session) else db) != "postgresql":
+        return False
+    return bool(db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :name"
+    ), {"name": EVENTS_TABLE}).first())
+
+def default_partition(db) -> Optional[str]:
+    """Name of the DEFAULT partition of website_events, if it has one (Postgres)"""
+    return db.execute(text(
+        "SELECT NULLIF(p.partdefid, 0)::regclass::text FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :name"
+    ), {"name": EVENTS_TABLE}).scalar()
+
+def ensure_partitions(bind, months_ahead: int = 3, now: Optional[datetime] = None) -> List[str]:
+    """
+    Create the DEFAULT partition and the partitions for the current month and
+    the next months_ahead months (Postgres only). Rows of a new month already
+    in the DEFAULT partition are moved into it. Warns when website_events on
+    Postgres is not partitioned, since retention then falls back to DELETEs.
+    """
+    created = []
+    with (bind.begin() if isinstance(bind, Engine) else nullcontext(bind)) as connection:
+        if not is_partitioned(connection):
+            if _dialect(connection.get_bind() if isinstance(connection, Session) else connection) == "postgresql":
+                logger.warning(
+                    "%s is not partitioned: retention falls back to batched DELETEs. "
+                    "Convert it with compact_events.py --partition-existing",
+                    EVENTS_TABLE
+                )
+            return created
+
+        # As returned by regclass::text (quoted where needed), so it can go into SQL as is
+        default = default_partition(connection)
+        if default is None:
+            connection.execute(text(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{EVENTS_TABLE}" DEFAULT'))
+            default = DEFAULT_PARTITION
+        columns = ", ".join(f'"{column.name}"' for column in _events.columns)
+
+        month = month_start(now or datetime.utcnow())
+        for _ in range(months_ahead + 1):
+            name = partition_name(month)
+            bounds = f"FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+            in_month = f"created_at >= '{month:%Y-%m-%d}' AND created_at < '{next_month(month):%Y-%m-%d}'"
+            if connection.execute(text("SELECT to_regclass(:name)"), {"name": f'"{name}"'}).scalar() is None:
+                if connection.execute(text(f"SELECT 1 FROM {default} WHERE {in_month} LIMIT 1")).first():
+                    # A new partition cannot overlap rows in the DEFAULT partition: move them first
+                    connection.execute(text(f'CREATE TABLE "{name}" (LIKE "{EVENTS_TABLE}" INCLUDING DEFAULTS)'))
+                    connection.execute(text(
+                        f"WITH moved AS (DELETE FROM {default} WHERE {in_month} RETURNING {columns}) "
+                        f'INSERT INTO "{name}" ({columns}) SELECT {columns} FROM moved'
+                    ))
+                    connection.execute(text(f'ALTER TABLE "{EVENTS_TABLE}" ATTACH PARTITION "{name}" FOR VALUES {bounds}'))
+                    logger.info("Moved %s rows of %s out of %s", EVENTS_TABLE, name, default)
+                else:
+                    connection.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{EVENTS_TABLE}" FOR VALUES {bounds}'))
+            created.append(name)
+            month = next_month(month)
+    return created
+
+# SQLite monthly tables
+
+def list_partitions(db: Session) -> List[str]:
+    """Names of the monthly partitions (Postgres) or monthly tables (SQLite), oldest first"""
+    if _dialect(db.get_bind()) == "postgresql":
+        names = db.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :name"
+        ), {"name": EVENTS_TABLE}).scalars()
+    else:
+        names = db.get_bind().dialect.get_table_names(db.connection())
+    return sorted(name for name in names if PARTITION_NAME.match(name))
+
+def monthly_table(name: str) -> Table:
+    """Table object for a monthly events table, with the same columns and indexes as website_events"""
+    metadata = MetaData()
+    # Archived rows keep their ids; the visitor foreign key is not repeated on every month
+    table = Table(name, metadata, *[
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+        for column in _events.columns
+    ])
+    for index in _events.indexes:
+        Index(
+            index.name.replace(EVENTS_TABLE, name, 1),
+            *[table.c[column.name] for column in index.columns]
+        )
+    return table
+
+def rotate_closed_months(db: Session, batch_size: int = DEFAULT_BATCH_SIZE, now: Optional[datetime] = None) -> int:
+    """
+    SQLite: move events of closed months out of website_events into their
+    monthly tables, batch_size rows per transaction. Returns rows moved.
+    """
+    if _dialect(db.get_bind()) != "sqlite":
+        return 0
+
+    current_month = month_start(now or datetime.utcnow())
+    moved = 0
+    while True:
+        oldest = db.execute(
+            select(func.min(_events.c.created_at)).where(_events.c.created_at < current_month)
+        ).scalar()
+        if oldest is None:
+            break
+
+        month = month_start(oldest)
+        table = monthly_table(partition_name(month))
+        table.create(db.connection(), checkfirst=True)
+        for index in table.indexes:
+            index.create(db.connection(), checkfirst=True)
+
+        batch_ids = select(_events.c.id).where(
+            _events.c.created_at >= month,
+            _events.c.created_at < next_month(month)
+        ).order_by(_events.c.id).limit(batch_size).scalar_subquery()
+        db.execute(table.insert().from_select(
+            [column.name for column in _events.columns],
+            select(*_events.columns).where(_events.c.id.in_(batch_ids))
+        ))
+        count = db.execute(delete(_events).where(_events.c.id.in_(batch_ids))).rowcount
+        db.commit()
+        moved += count
+    return moved
+
+def events_table(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    Selectable with the website_events columns covering [start, end).
+    On SQLite it unions the hot table with the monthly tables that overlap the range.
+    """
+    if _dialect(db.get_bind()) != "sqlite":
+        return _events
+
+    tables = []
+    for name in list_partitions(db):
+        month = partition_month(name)
+        if (end is None or month < rollups.as_utc(end)) and (start is None or next_month(month) > rollups.as_utc(start)):
+            tables.append(monthly_table(name))
+    if not tables:
+        return _events
+
+    return union_all(
+        select(*_events.columns),
+        *[select(*table.columns) for table in tables]
+    ).subquery(EVENTS_TABLE)
+
+# Retention
+
+def compact_month(db: Session, month: datetime, source) -> int:
+    """
+    Rebuild the daily rollups for business-days of a month that have raw
+    events but no rollups (e.g. data ingested before rollups existed).
+    Returns the number of business-days rebuilt.
+    """
+    day = func.date(source.c.created_at)
+    event_days = db.execute(
+        select(_visitors.c.business_id, day).select_from(
+            source.join(_visitors, source.c.visitor_id == _visitors.c.id)
+        ).where(
+            source.c.created_at >= month,
+            source.c.created_at < next_month(month)
+        ).group_by(_visitors.c.business_id, day)
+    ).all()
+
+    rolled_up = {
+        (business_id, rollups.bucket_start(bucket, "day"))
+        for business_id, bucket in db.query(AnalyticsRollup.business_id, AnalyticsRollup.bucket_start).filter(
+            AnalyticsRollup.granularity == "day",
+            AnalyticsRollup.metric == "events",
+            AnalyticsRollup.bucket_start >= month,
+            AnalyticsRollup.bucket_start < next_month(month)
+        ).distinct()
+    }
+
+    rebuilt = 0
+    for business_id, event_day in event_days:
+        day_start = rollups.bucket_start(_as_datetime(event_day), "day")
+        if (business_id, day_start) not in rolled_up:
+            rollups.rebuild_rollups(db, day_start, day_start + timedelta(days=1), business_id, events=source)
+            rebuilt += 1
+    return rebuilt
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return datetime(value.year, value.month, value.day)
+
+def drop_partition(db: Session, name: str) -> None:
+    """Detach and drop a monthly partition (Postgres) or drop a monthly table (SQLite)"""
+    bind = db.get_bind()
+    db.commit()
+    if _dialect(bind) == "postgresql":
+        # DETACH ... CONCURRENTLY only takes a brief lock on the parent but cannot run inside a transaction
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            concurrently = " CONCURRENTLY" if bind.dialect.server_version_info >= (14,) else ""
+            connection.execute(text(f'ALTER TABLE "{EVENTS_TABLE}" DETACH PARTITION "{name}"{concurrently}'))
+            connection.execute(text(f'DROP TABLE "{name}"'))
+    else:
+        db.execute(text(f'DROP TABLE "{name}"'))
+        db.commit()
+
+def delete_expired(db: Session, cutoff: datetime, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Batched delete of raw events older than cutoff left in website_events itself"""
+    deleted = 0
+    while True:
+        batch_ids = select(_events.c.id).where(_events.c.created_at < cutoff).limit(batch_size).scalar_subquery()
+        count = db.execute(delete(_events).where(_events.c.id.in_(batch_ids))).rowcount
+        db.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+def compact_expired(db: Session, retention_days: int, batch_size: int = DEFAULT_BATCH_SIZE, now: Optional[datetime] = None) -> dict:
+    """
+    Compact raw events older than retention_days into the daily rollups and drop them.
+    Whole months are dropped once their last day has expired.
+    """
+    now = now or datetime.utcnow()
+    cutoff = month_start(now - timedelta(days=retention_days))
+    summary = {"moved": 0, "rebuilt_days": 0, "dropped": [], "deleted": 0}
+
+    summary["moved"] = rotate_closed_months(db, batch_size, now)
+
+    for name in list_partitions(db):
+        month = partition_month(name)
+        if next_month(month) > cutoff:
+            continue
+        source = monthly_table(name) if _dialect(db.get_bind()) == "sqlite" else _events
+        summary["rebuilt_days"] += compact_month(db, month, source)
+        db.commit()
+        drop_partition(db, name)
+        summary["dropped"].append(name)
+        logger.info("Dropped event partition %s", name)
+
+    # Rows left in website_events itself (a plain table, or the DEFAULT partition):
+    # summarize month by month, then delete in batches
+    oldest = db.execute(select(func.min(_events.c.created_at))).scalar()
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        summary["rebuilt_days"] += compact_month(db, month, _events)
+        db.commit()
+        month = next_month(month)
+    summary["deleted"] = delete_expired(db, cutoff, batch_size)
+
+    return summary
@@ -0,0 +1,195 @@
+"""
+Ordered conversion funnels over raw website events, computed with NumPy.
+
+Only events matching a step are loaded, in chunks, into arrays of visitor,
+step bitmask (computed in SQL), timestamp and id, sorted by (visitor, time,
+id). Step k is reached by a visitor at their first step-k event after the
+event that reached step k-1; each step is one vectorized pass over the
+arrays.
+
+Results are cached by (business, funnel definition, time window).
+"""
+import os
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
+from sqlalchemy import select, case, and_, or_
+from sqlalchemy.orm import Session
+from app.core.cache import LRUCache
+from app.core import event_partitions, rollups
+from app.models.website_tracking import WebsiteVisitor
+
+MAX_FUNNEL_STEPS = 10
+CHUNK_SIZE = 100000
+
+# Element-click steps match these event_data fields
+ELEMENT_FIELDS = ("element_id", "element_text")
+
+class FunnelStep(NamedTuple):
+    event_type: str
+    page_url: Optional[str] = None  # substring of the page URL
+    element: Optional[str] = None   # substring of the clicked element's id or text
+
+    def matches_element(self, event_data) -> bool:
+        if self.element is None:
+            return True
+        if not isinstance(event_data, dict):
+            return False
+        needle = self.element.lower()
+        return any(needle in str(event_data.get(field) or "").lower() for field in ELEMENT_FIELDS)
+
+_funnel_cache = LRUCache(
+    maxsize=int(os.getenv("FUNNEL_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("FUNNEL_CACHE_TTL", "300"))
+)
+
+def _step_condition(events, step: FunnelStep):
+    condition = events.c.event_type == step.event_type
+    if step.page_url is not None:
+        condition = and_(condition, events.c.page_url.contains(step.page_url, autoescape=True))
+    return condition
+
+def load_event_arrays(
+    db: Session,
+    business_id: int,
+    steps: Tuple[FunnelStep, ...],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Visitor primary key, step bitmask, timestamp and event id of every event
+    in the window that matches at least one step.
+    """
+    events = event_partitions.events_table(db, start, end)
+    visitors = WebsiteVisitor.__table__
+    conditions = [_step_condition(events, step) for step in steps]
+    element_steps = [(index, step) for index, step in enumerate(steps) if step.element is not None]
+
+    # The step bitmask is computed by the database; only element matching needs event_data here
+    mask = sum(case((condition, 1 << index), else_=0) for index, condition in enumerate(conditions))
+    columns = [events.c.visitor_id, mask.label("mask"), events.c.created_at, events.c.id]
+    if element_steps:
+        columns.append(events.c.event_data)
+    query = select(*columns).select_from(
+        events.join(visitors, events.c.visitor_id == visitors.c.id)
+    ).where(
+        visitors.c.business_id == business_id,
+        or_(*conditions)
+    )
+    if start:
+        query = query.where(events.c.created_at >= start)
+    if end:
+        query = query.where(events.c.created_at < end)
+
+    chunks = []
+    result = db.execute(query.execution_options(yield_per=CHUNK_SIZE))
+    for rows in result.partitions():
+        columns = list(zip(*rows))
+        masks = np.array(columns[1], dtype=np.uint32)
+        for index, step in element_steps:
+            bit = np.uint32(1 << index)
+            rejected = [
+                position for position, event_data in enumerate(columns[4])
+                if masks[position] & bit and not step.matches_element(event_data)
+            ]
+            masks[rejected] &= ~bit
+        chunks.append((
+            np.array(columns[0], dtype=np.int64),
+            masks,
+            np.array([rollups.as_utc(value) for value in columns[2]], dtype="datetime64[us]").astype(np.int64),
+            np.array(columns[3], dtype=np.int64)
+        ))
+
+    if not chunks:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, np.empty(0, dtype=np.uint32), empty, empty
+    visitor_pks, masks, timestamps, event_ids = (np.concatenate(parts) for parts in zip(*chunks))
+    keep = masks != 0
+    return visitor_pks[keep], masks[keep], timestamps[keep], event_ids[keep]
+
+def match_steps(
+    visitor_pks: np.ndarray,
+    masks: np.ndarray,
+    timestamps: np.ndarray,
+    event_ids: np.ndarray,
+    step_count: int,
+    window_seconds: Optional[float] = None
+) -> List[int]:
+    """
+    Number of visitors reaching each step, in order. With window_seconds, later
+    steps only count within that time of the visitor's first step-1 event.
+    """
+    if visitor_pks.size == 0:
+        return [0] * step_count
+
+    order = np.lexsort((event_ids, timestamps, visitor_pks))
+    visitor_pks, masks, timestamps = visitor_pks[order], masks[order], timestamps[order]
+    _, visitor_index = np.unique(visitor_pks, return_inverse=True)
+    visitor_count = int(visitor_index.max()) + 1
+    positions = np.arange(visitor_pks.size)
+
+    # Position of the event that reached the previous step; -1 means "before every event"
+    reached_at = np.full(visitor_count, -1, dtype=np.int64)
+    started_at = np.zeros(visitor_count, dtype=np.int64)
+    active = np.ones(visitor_count, dtype=bool)
+    window_us = int(window_seconds * 1_000_000) if window_seconds else None
+
+    counts = []
+    for step in range(step_count):
+        candidate = ((masks >> np.uint32(step)) & np.uint32(1)).astype(bool)
+        candidate &= active[visitor_index]
+        candidate &= positions > reached_at[visitor_index]
+        if step > 0 and window_us is not None:
+            candidate &= timestamps - started_at[visitor_index] <= window_us
+
+        # Events are sorted by visitor, so the first candidate per visitor is the earliest
+        candidate_positions = positions[candidate]
+        first_visitors, first = np.unique(visitor_index[candidate], return_index=True)
+        first_positions = candidate_positions[first]
+
+        active[:] = False
+        active[first_visitors] = True
+        reached_at[first_visitors] = first_positions
+        if step == 0:
+            started_at[first_visitors] = timestamps[first_positions]
+        counts.append(int(first_visitors.size))
+    return counts
+
+def compute_funnel(
+    db: Session,
+    business_id: int,
+    steps: Tuple[FunnelStep, ...],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    window_seconds: Optional[float] = None
+) -> dict:
+    """Per-step visitors, conversion and drop-off for an ordered funnel (cached)"""
+    key = (business_id, steps, start, end, window_seconds)
+    cached = _funnel_cache.get(key)
+    if cached is not None:
+        return cached
+
+    counts = match_steps(*load_event_arrays(db, business_id, steps, start, end), len(steps), window_seconds)
+    entered = counts[0] if counts else 0
+    result = {"entered": entered, "steps": []}
+    for index, (step, count) in enumerate(zip(steps, counts)):
+        previous = counts[index - 1] if index else entered
+        result["steps"].append({
+            "step": index + 1,
+            "event_type": step.event_type,
+            "page_url": step.page_url,
+            "element": step.element,
+            "visitors": count,
+            "conversion_rate": round(count / entered * 100, 2) if entered else 0.0,
+            "step_conversion_rate": round(count / previous * 100, 2) if previous else 0.0,
+            "drop_off": previous - count
+        })
+
+    _funnel_cache.set(key, result)
+    return result
+
+def cache_stats() -> dict:
+    return _funnel_cache.stats()
+
+def clear_cache() -> None:
+    _funnel_cache.clear()
@@ -0,0 +1,156 @@
+"""
+GeoIP enrichment for website visitors.
+
+The MaxMind database is opened once per process in memory-mapped mode, so
+its pages live in the OS page cache and are shared by every request and
+every worker process on the host. Lookups are cached per network prefix
+(/24 for IPv4, /48 for IPv6): addresses in the same prefix almost always
+resolve to the same city, and caching by prefix keeps the cache small.
+
+If the database file is missing, or geoip2 is not installed, lookups
+return None and visitors are simply left without geographic data.
+"""
+import ipaddress
+import logging
+import os
+import threading
+from typing import Callable, Iterable, NamedTuple, Optional
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app.core.cache import LRUCache
+from app.core.database import SessionLocal
+from app.models.website_tracking import WebsiteVisitor
+
+try:
+    import geoip2.database
+    import geoip2.errors
+    GEOIP_AVAILABLE = True
+except ImportError:
+    GEOIP_AVAILABLE = False
+
+logger = logging.getLogger("marketing_automation.tracking")
+
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", "data/GeoLite2-City.mmdb")
+
+class GeoInfo(NamedTuple):
+    country: Optional[str]
+    city: Optional[str]
+    region: Optional[str]
+
+_lock = threading.Lock()
+_db_path = GEOIP_DB_PATH
+_reader = None
+_reader_loaded = False
+
+_visitors = WebsiteVisitor.__table__
+
+# network prefix -> GeoInfo (or None when the address is not in the database)
+_geo_cache = LRUCache(maxsize=int(os.getenv("GEOIP_CACHE_SIZE", "50000")))
+
+def configure(path: Optional[str] = None, reader=None) -> None:
+    """
+    Point enrichment at a different database file or an already-open reader.
+    Used by tests to swap in a small fixture database.
+    """
+    global _db_path, _reader, _reader_loaded
+    with _lock:
+        _db_path = path or GEOIP_DB_PATH
+        _reader = reader
+        _reader_loaded = reader is not None
+    _geo_cache.clear()
+
+def get_reader():
+    """Shared memory-mapped reader, opened on first use; None if unavailable"""
+    global _reader, _reader_loaded
+    if _reader_loaded:
+        return _reader
+
+    with _lock:
+        if not _reader_loaded:
+            _reader_loaded = True
+            if not GEOIP_AVAILABLE:
+                logger.warning("geoip2 is not installed; visitor geo enrichment is disabled")
+            elif not os.path.exists(_db_path):
+                logger.warning("GeoIP database %s not found; visitor geo enrichment is disabled", _db_path)
+            else:
+                _reader = geoip2.database.Reader(_db_path, mode=geoip2.database.MODE_MMAP)
+    return _reader
+
+def network_key(ip_address: str) -> Optional[str]:
+    """Cache key for an address: its /24 (IPv4) or /48 (IPv6) network"""
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    if not address.is_global:
+        return None
+    prefix = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+def lookup(ip_address: str) -> Optional[GeoInfo]:
+    """Country, city and region for an IP address, or None if unknown"""
+    key = network_key(ip_address)
+    if key is None:
+        return None
+
+    cached = _geo_cache.get(key, default=False)
+    if cached is not False:
+        return cached
+
+    reader = get_reader()
+    if reader is None:
+        return None
+
+    try:
+        response = reader.city(ip_address)
+        geo = GeoInfo(
+            country=response.country.name,
+            city=response.city.name,
+            region=response.subdivisions.most_specific.name
+        )
+    except Exception as e:
+        if not (GEOIP_AVAILABLE and isinstance(e, geoip2.errors.AddressNotFoundError)):
+            logger.warning("GeoIP lookup failed for %s: %s", ip_address, e)
+        geo = None
+
+    _geo_cache.set(key, geo)
+    return geo
+
+def enrich_visitors(
+    visitor_pks: Iterable[int],
+    ip_address: str,
+    session_factory: Callable[[], Session] = SessionLocal
+) -> None:
+    """
+    Fill country/city/region for visitors first seen from ip_address.
+    Meant to run as a background task, off the request path and the event loop.
+    """
+    visitor_pks = list(visitor_pks)
+    if not visitor_pks:
+        return
+
+    geo = lookup(ip_address)
+    if geo is None:
+        return
+
+    db = session_factory()
+    try:
+        # last_visit is set to itself so its onupdate stamp does not fire: a new visitor
+        # must still look unseen when the event buffer counts its first unique visit
+        db.execute(
+            update(_visitors).where(_visitors.c.id.in_(visitor_pks)).values(
+                country=geo.country,
+                city=geo.city,
+                region=geo.region,
+                last_visit=_visitors.c.last_visit
+            )
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Failed to store geo data for visitors %s", visitor_pks)
+    finally:
+        db.close()
+
+def cache_stats() -> dict:
+    return {**_geo_cache.stats(), "database_loaded": _reader is not None}
@@ -0,0 +1,96 @@
+"""
+HyperLogLog cardinality sketches.
+
+A sketch is 2**precision one-byte registers. Each item is hashed to 64 bits;
+the top `precision` bits pick a register, which keeps the maximum rank
+(position of the first 1 bit) of the remaining bits seen so far. The
+register-wise maximum of two sketches is the sketch of the union of their
+inputs, so sketches of any set of days merge into one estimate with a
+standard error of about 1.04 / sqrt(2**precision) (0.8% at precision 14).
+"""
+import hashlib
+import math
+import zlib
+from typing import Iterable, Optional
+import numpy as np
+
+DEFAULT_PRECISION = 14
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+# 2 ** -rank for every possible register value
+_INVERSE_POWERS = np.ldexp(1.0, -np.arange(65))
+
+def hash_item(item) -> int:
+    """Stable 64-bit hash of an item's string form (Python's hash() is salted per process)"""
+    return int.from_bytes(hashlib.blake2b(str(item).encode("utf-8"), digest_size=8).digest(), "big")
+
+def relative_error(precision: int = DEFAULT_PRECISION) -> float:
+    return 1.04 / math.sqrt(1 << precision)
+
+class HyperLogLog:
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: Optional[np.ndarray] = None):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"precision must be between {MIN_PRECISION} and {MAX_PRECISION}")
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            registers = np.zeros(self.size, dtype=np.uint8)
+        elif registers.shape != (self.size,):
+            raise ValueError(f"Expected {self.size} registers, got {registers.shape}")
+        self.registers = registers
+
+    def add(self, item) -> None:
+        self.add_hashes([hash_item(item)])
+
+    def update(self, items: Iterable) -> None:
+        self.add_hashes([hash_item(item) for item in items])
+
+    def add_hashes(self, hashes: Iterable[int]) -> None:
+        hashes = np.fromiter(hashes, dtype=np.uint64)
+        if not hashes.size:
+            return
+        width = 64 - self.precision
+        index = (hashes >> np.uint64(width)).astype(np.intp)
+        remainder = hashes & np.uint64((1 << width) - 1)
+        # rank = leading zeros within the remaining bits + 1; frexp's exponent is the bit length.
+        # float64 holds integers exactly only up to 53 bits, and rounding a wider value can carry
+        # into the next power of two, so wider remainders are measured from their top 53 bits
+        # (precisions below 11)
+        shift = max(width - 53, 0)
+        bit_length = np.frexp(remainder.astype(np.float64))[1]
+        if shift:
+            high = remainder >> np.uint64(shift)
+            bit_length = np.where(high > 0, np.frexp(high.astype(np.float64))[1] + shift, bit_length)
+        ranks = (width - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, ranks)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        """Estimated number of distinct items added"""
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / _INVERSE_POWERS[self.registers].sum()
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small cardinalities: linear counting over the empty registers is more accurate
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def is_empty(self) -> bool:
+        return not self.registers.any()
+
+    def copy(self) -> "HyperLogLog":
+        return HyperLogLog(self.precision, self.registers.copy())
+
+    def to_bytes(self) -> bytes:
+        """Compressed register bytes; sparse sketches shrink to a few hundred bytes"""
+        return zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes, precision: int = DEFAULT_PRECISION) -> "HyperLogLog":
+        return cls(precision, np.frombuffer(zlib.decompress(data), dtype=np.uint8).copy())
@@ -0,0 +1,207 @@
+"""
+Lead feature store: one row of numeric features per visitor.
+
+Every flush of tracking data adds its contribution to the visitors'
+lead_features rows in the same transaction: visits and the last time seen
+from the visitor deltas, event, page view, form submit and pricing page
+counts from the event rows, the first-touch UTM source from event URLs, and
+session counts from the sessions the sessionizer finished. The increments
+are applied with one upsert per flush, so readers never re-aggregate raw
+events.
+
+load_matrix() reads the features of a business's visitors (or only its
+leads) with a single query and returns them as a float64 NumPy matrix with
+the columns in MATRIX_COLUMNS; recency and pages per session are derived
+at read time.
+
+Features accumulate from the first flush that touches a visitor; activity
+ingested before this table existed is not included.
+"""
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from sqlalchemy import case, insert, or_, select, update
+from sqlalchemy.orm import Session
+from app.models.analytics import LeadFeatures
+from app.models.website_tracking import WebsiteVisitor
+from app.core import rollups
+
+# Paths (prefixes) counted as pricing page views
+PRICING_PATHS = tuple(
+    path.strip().lower() for path in os.getenv("LEAD_FEATURE_PRICING_PATHS", "/pricing,/plans").split(",") if path.strip()
+)
+
+# utm_source codes; the list is append-only so stored codes keep their meaning
+UTM_SOURCES = (
+    "google", "facebook", "instagram", "linkedin", "twitter", "bing",
+    "youtube", "tiktok", "email", "newsletter", "reddit", "partner"
+)
+UTM_UNKNOWN, UTM_OTHER = 0, len(UTM_SOURCES) + 1
+_UTM_CODES = {source: code for code, source in enumerate(UTM_SOURCES, start=1)}
+
+COUNTERS = ("visits", "events", "page_views", "form_submits", "pricing_page_views", "sessions", "session_page_views")
+MATRIX_COLUMNS = (
+    "recency_days", "visits", "sessions", "events", "pages_per_session",
+    "form_submits", "pricing_page_views", "utm_source_code"
+)
+
+_features = LeadFeatures.__table__
+_visitors = WebsiteVisitor.__table__
+
+def utm_source_code(page_url: Optional[str]) -> int:
+    """Code of the utm_source query parameter of a URL; UTM_UNKNOWN if it has none"""
+    if not page_url or "utm_source=" not in page_url:
+        return UTM_UNKNOWN
+    sources = parse_qs(urlsplit(page_url).query).get("utm_source")
+    if not sources:
+        return UTM_UNKNOWN
+    return _UTM_CODES.get(sources[0].strip().lower(), UTM_OTHER)
+
+def is_pricing_page(page_url: Optional[str]) -> bool:
+    return bool(page_url) and urlsplit(page_url).path.lower().startswith(PRICING_PATHS)
+
+def _epoch(value: Optional[datetime]) -> Optional[float]:
+    # Naive datetimes would be read as local time by timestamp()
+    return rollups.as_utc(value).replace(tzinfo=timezone.utc).timestamp() if value else None
+
+def _feature_row(features: Dict[int, dict], visitor_pk: int, business_id: int) -> dict:
+    row = features.get(visitor_pk)
+    if row is None:
+        row = features[visitor_pk] = {
+            "visitor_id": visitor_pk,
+            "business_id": business_id,
+            "first_seen_at": None,
+            "last_seen_at": None,
+            "utm_source_code": UTM_UNKNOWN,
+            **{counter: 0 for counter in COUNTERS}
+        }
+    return row
+
+def collect(rows: List[dict], deltas: Dict[int, dict], finished_sessions: Optional[List[dict]] = None) -> Dict[int, dict]:
+    """Per-visitor feature increments of a flush: event rows, visitor deltas and finished sessions"""
+    features: Dict[int, dict] = {}
+    for visitor_pk, delta in deltas.items():
+        row = _feature_row(features, visitor_pk, delta["business_id"])
+        row["visits"] = delta["visits"]
+        row["first_seen_at"] = _epoch(delta["first_seen"])
+        row["last_seen_at"] = _epoch(delta["last_visit"])
+
+    for event in rows:
+        row = _feature_row(features, event["visitor_id"], deltas[event["visitor_id"]]["business_id"])
+        row["events"] += 1
+        event_type = event["event_type"]
+        if event_type == "page_view":
+            row["page_views"] += 1
+            if is_pricing_page(event["page_url"]):
+                row["pricing_page_views"] += 1
+        elif event_type == "form_submit":
+            row["form_submits"] += 1
+        if row["utm_source_code"] == UTM_UNKNOWN:
+            row["utm_source_code"] = utm_source_code(event["page_url"])
+
+    for session in finished_sessions or []:
+        row = _feature_row(features, session["visitor_id"], session["business_id"])
+        row["sessions"] += 1
+        row["session_page_views"] += session["page_views"] or 0
+    return features
+
+def apply_features(db: Session, features: Dict[int, dict]) -> None:
+    """Add a flush's feature increments to lead_features; the caller commits"""
+    if not features:
+        return
+
+    # Visitor order, like lock_visitors, so concurrent flushes take row locks in the same order
+    rows = [features[visitor_pk] for visitor_pk in sorted(features)]
+    dialect_insert = rollups._dialect_insert(db)
+    if dialect_insert is not None:
+        stmt = dialect_insert(_features)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["visitor_id"],
+            set_={
+                **{counter: _features.c[counter] + excluded[counter] for counter in COUNTERS},
+                "first_seen_at": case(
+                    (or_(_features.c.first_seen_at.is_(None), excluded.first_seen_at < _features.c.first_seen_at), excluded.first_seen_at),
+                    else_=_features.c.first_seen_at
+                ),
+                "last_seen_at": case(
+                    (or_(_features.c.last_seen_at.is_(None), excluded.last_seen_at > _features.c.last_seen_at), excluded.last_seen_at),
+                    else_=_features.c.last_seen_at
+                ),
+                # First touch: a stored source is never replaced
+                "utm_source_code": case(
+                    (_features.c.utm_source_code == UTM_UNKNOWN, excluded.utm_source_code),
+                    else_=_features.c.utm_source_code
+                )
+            }
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Generic fallback: update existing rows, insert the rest
+    stored = {
+        row.visitor_id: row
+        for row in db.execute(
+            select(_features).where(_features.c.visitor_id.in_(features)).order_by(_features.c.visitor_id).with_for_update()
+        )
+    }
+    for row in rows:
+        existing = stored.get(row["visitor_id"])
+        if existing is None:
+            db.execute(insert(_features), row)
+            continue
+        first_seen = [value for value in (existing.first_seen_at, row["first_seen_at"]) if value is not None]
+        last_seen = [value for value in (existing.last_seen_at, row["last_seen_at"]) if value is not None]
+        db.execute(
+            update(_features).where(_features.c.visitor_id == row["visitor_id"]).values(
+                first_seen_at=min(first_seen, default=None),
+                last_seen_at=max(last_seen, default=None),
+                utm_source_code=existing.utm_source_code or row["utm_source_code"],
+                **{counter: _features.c[counter] + row[counter] for counter in COUNTERS}
+            )
+        )
+
+def load_matrix(
+    db: Session,
+    business_id: int,
+    leads_only: bool = False,
+    now: Optional[float] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Visitor primary keys and their feature matrix (columns MATRIX_COLUMNS),
+    in visitor order, read with one query. now is UTC epoch seconds.
+    """
+    query = select(
+        _features.c.visitor_id,
+        _features.c.last_seen_at,
+        _features.c.visits,
+        _features.c.sessions,
+        _features.c.events,
+        _features.c.session_page_views,
+        _features.c.form_submits,
+        _features.c.pricing_page_views,
+        _features.c.utm_source_code
+    ).where(
+        _features.c.business_id == business_id
+    ).order_by(_features.c.visitor_id)
+    if leads_only:
+        query = query.join(_visitors, _visitors.c.id == _features.c.visitor_id).where(_visitors.c.is_lead == True)
+
+    raw = np.array(db.execute(query).all(), dtype=np.float64).reshape(-1, 9)
+    visitor_pks = raw[:, 0].astype(np.int64)
+    now = time.time() if now is None else now
+    last_seen = raw[:, 1]
+    sessions = raw[:, 3]
+
+    matrix = np.empty((len(raw), len(MATRIX_COLUMNS)))
+    # Visitors without a last_seen_at (only finished sessions recorded so far) count as seen now
+    matrix[:, 0] = np.maximum(now - np.where(np.isnan(last_seen), now, last_seen), 0.0) / 86400
+    matrix[:, 1] = raw[:, 2]
+    matrix[:, 2] = sessions
+    matrix[:, 3] = raw[:, 4]
+    matrix[:, 4] = np.divide(raw[:, 5], sessions, out=np.zeros(len(raw)), where=sessions > 0)
+    matrix[:, 5:] = raw[:, 6:]
+    return visitor_pks, matrix
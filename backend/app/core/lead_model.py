@@ -0,0 +1,293 @@
+"""
+Local lead scoring model.
+
+Leads are turned into a fixed-width numeric feature vector: log counts of
+each known interaction type (tracking event types and CRM touches), total
+and distinct interactions, days since the last contact and since the last
+interaction, and whether a company is known. A batch of leads becomes one
+matrix, scored with a single predict_proba call of a scikit-learn pipeline
+(standardization + logistic regression); the score is the predicted
+conversion probability on a 0-100 scale.
+
+The model is fitted by train_lead_model.py from historical leads that were
+won ("closed", or with a conversion date) or lost, and saved with joblib to
+LEAD_MODEL_PATH. Training leads go through the same featurization as scored
+ones, with the interactions of both sources (their visitors' website events
+and the CRM touches stored on the lead) as they were TRAINING_HORIZON_DAYS
+before the outcome, so nothing recorded on the way to the outcome leaks in.
+
+The saved model is loaded once per process on first use. Without
+scikit-learn or a trained model file, get_model() returns None.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import Interval, func, literal, or_, select
+from sqlalchemy.orm import Session
+from app.models.lead import Lead
+from app.models.website_tracking import WebsiteVisitor
+from app.core import event_partitions
+
+try:
+    import joblib
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import roc_auc_score
+    from sklearn.model_selection import train_test_split
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    SKLEARN_AVAILABLE = True
+except ImportError:
+    SKLEARN_AVAILABLE = False
+
+logger = logging.getLogger("marketing_automation.leads")
+
+LEAD_MODEL_PATH = os.getenv("LEAD_MODEL_PATH", "data/lead_model.joblib")
+# Training features are taken this many days before each lead's outcome
+TRAINING_HORIZON_DAYS = float(os.getenv("LEAD_MODEL_HORIZON_DAYS", "7"))
+
+# Interaction types with their own count feature; anything else is counted as "other"
+INTERACTION_TYPES = (
+    "page_view", "element_click", "form_submit", "page_exit",
+    "email_open", "email_click", "download", "webinar", "meeting", "call"
+)
+FEATURE_NAMES = tuple(f"count_{name}" for name in INTERACTION_TYPES) + (
+    "count_other", "interactions", "distinct_types", "days_since_contact", "days_since_interaction", "has_company"
+)
+_TYPE_COLUMNS = {name: column for column, name in enumerate(INTERACTION_TYPES)}
+_OTHER_COLUMN = len(INTERACTION_TYPES)
+
+WON_STATUSES = ("closed",)
+LOST_STATUSES = ("lost",)
+
+_lock = threading.Lock()
+_model_path = LEAD_MODEL_PATH
+_model = None
+_model_loaded = False
+
+def _naive_utc(value: Any) -> Optional[datetime]:
+    """Naive UTC datetime from a datetime or ISO 8601 string; None if unparseable"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def assemble(counts: np.ndarray, contact_age_days: np.ndarray, interaction_age_days: np.ndarray, has_company: np.ndarray) -> np.ndarray:
+    """
+    Feature matrix from per-lead interaction type counts (one column per
+    INTERACTION_TYPES entry, then "other"), ages in days and company flags
+    """
+    totals = counts.sum(axis=1)
+    return np.column_stack([
+        np.log1p(counts),
+        np.log1p(totals),
+        (counts > 0).sum(axis=1),
+        np.log1p(np.clip(contact_age_days, 0, None)),
+        np.log1p(np.clip(interaction_age_days, 0, None)),
+        has_company
+    ]).astype(np.float64)
+
+# (type, count, latest timestamp) of one or more interactions of the same type
+InteractionCount = Tuple[Any, int, Any]
+
+def _featurize(leads: Sequence[Tuple[Iterable[InteractionCount], Any, Any, datetime]]) -> np.ndarray:
+    """
+    Feature matrix of (interaction counts, last contact, company, reference
+    time) tuples; the reference time is what the ages are measured from
+    """
+    count = len(leads)
+    counts = np.zeros((count, len(INTERACTION_TYPES) + 1))
+    contact_age = np.zeros(count)
+    interaction_age = np.zeros(count)
+    has_company = np.zeros(count)
+
+    for row, (interactions, last_contact, company, now) in enumerate(leads):
+        last_contact = _naive_utc(last_contact)
+        contact_age[row] = (now - last_contact).total_seconds() / 86400 if last_contact else 0.0
+        last_interaction = None
+        for interaction_type, interaction_count, timestamp in interactions:
+            column = _TYPE_COLUMNS.get(str(interaction_type or "").lower(), _OTHER_COLUMN)
+            counts[row, column] += interaction_count
+            at = _naive_utc(timestamp)
+            if at and (last_interaction is None or at > last_interaction):
+                last_interaction = at
+        # Interactions without timestamps are taken to be as recent as the last contact
+        interaction_age[row] = (now - last_interaction).total_seconds() / 86400 if last_interaction else contact_age[row]
+        has_company[row] = 1.0 if company else 0.0
+
+    return assemble(counts, contact_age, interaction_age, has_company)
+
+def _counted(interactions: Iterable[dict]) -> List[InteractionCount]:
+    return [(interaction.get("type"), 1, interaction.get("timestamp")) for interaction in interactions]
+
+def featurize(leads: Sequence, now: Optional[datetime] = None) -> np.ndarray:
+    """
+    Feature matrix of leads with interactions (dicts with a "type" and an
+    optional "timestamp"), last_contact and company, one row per lead
+    """
+    now = now or datetime.utcnow()
+    return _featurize([(_counted(lead.interactions), lead.last_contact, lead.company, now) for lead in leads])
+
+def _before(db: Session, value, delta: timedelta):
+    """SQL expression for the timestamp expression value minus delta"""
+    if db.get_bind().dialect.name == "sqlite":
+        return func.datetime(value, f"-{delta.total_seconds():.0f} seconds")
+    return value - literal(delta, Interval)
+
+def training_data(db: Session, business_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Features and outcomes (1 won, 0 lost) of the historical leads, as they
+    were TRAINING_HORIZON_DAYS before the outcome. Their interactions are the
+    website events of the visitors with the lead's email plus the CRM touches
+    stored on the lead (custom_fields["interactions"], in the format of the
+    scoring payload), both up to that cutoff, which is also the reference
+    time for the recency features. Both go through the same featurization
+    as the leads scored by the API.
+    """
+    leads = Lead.__table__
+    horizon = timedelta(days=TRAINING_HORIZON_DAYS)
+    outcome_at = func.coalesce(leads.c.converted_at, leads.c.updated_at, leads.c.created_at)
+    historical = [or_(leads.c.status.in_(WON_STATUSES + LOST_STATUSES), leads.c.converted_at.isnot(None))]
+    if business_id is not None:
+        historical.append(leads.c.business_id == business_id)
+    query = select(
+        leads.c.id,
+        leads.c.status,
+        leads.c.converted_at,
+        leads.c.company,
+        leads.c.custom_fields,
+        leads.c.last_contact_date,
+        leads.c.last_activity,
+        leads.c.created_at,
+        outcome_at
+    ).where(*historical)
+    rows = db.execute(query.order_by(leads.c.id)).all()
+    if not rows:
+        return np.zeros((0, len(FEATURE_NAMES))), np.zeros(0, dtype=np.int64)
+
+    cutoffs = {row[0]: _naive_utc(row[-1]) - horizon for row in rows}
+    interactions: Dict[int, List[InteractionCount]] = {row[0]: [] for row in rows}
+
+    events = event_partitions.events_table(db)
+    visitors = WebsiteVisitor.__table__
+    event_counts = select(
+        leads.c.id, events.c.event_type, func.count(), func.max(events.c.created_at)
+    ).select_from(
+        leads.join(visitors, (visitors.c.business_id == leads.c.business_id) & (visitors.c.email == leads.c.email))
+        .join(events, events.c.visitor_id == visitors.c.id)
+    ).where(
+        *historical,
+        events.c.created_at <= _before(db, outcome_at, horizon)
+    ).group_by(leads.c.id, events.c.event_type)
+    for lead_id, event_type, event_count, latest in db.execute(event_counts):
+        interactions[lead_id].append((event_type, event_count, latest))
+
+    samples = []
+    outcomes = np.zeros(len(rows), dtype=np.int64)
+    for position, (lead_id, status, converted_at, company, custom_fields, last_contact, last_activity, created_at, _) in enumerate(rows):
+        cutoff = cutoffs[lead_id]
+        touches = (custom_fields or {}).get("interactions") or []
+        # Touches without a timestamp cannot be placed before the cutoff and are left out
+        lead_interactions = interactions[lead_id] + [
+            touch for touch in _counted(touches)
+            if _naive_utc(touch[2]) and _naive_utc(touch[2]) <= cutoff
+        ]
+        # The most recent contact that had already happened at the cutoff
+        contacts = [_naive_utc(value) for value in (last_contact, last_activity, created_at)]
+        contact = next((value for value in contacts if value and value <= cutoff), None)
+        samples.append((lead_interactions, contact, company, cutoff))
+        outcomes[position] = 1 if status in WON_STATUSES or converted_at is not None else 0
+
+    return _featurize(samples), outcomes
+
+def train(features: np.ndarray, outcomes: np.ndarray, test_size: float = 0.2, seed: int = 42) -> dict:
+    """
+    Fit the scoring pipeline. The holdout ROC AUC is measured on a stratified
+    split, then the model is refitted on all the data. Returns the bundle to save.
+    """
+    if not SKLEARN_AVAILABLE:
+        raise RuntimeError("Training the lead scoring model requires scikit-learn")
+    if len(set(outcomes.tolist())) < 2:
+        raise ValueError("Training needs both won and lost leads")
+
+    def fit(x, y):
+        return make_pipeline(StandardScaler(), LogisticRegression(class_weight="balanced", max_iter=1000)).fit(x, y)
+
+    holdout_auc = None
+    if test_size and min(np.bincount(outcomes)) >= 2:
+        train_x, test_x, train_y, test_y = train_test_split(
+            features, outcomes, test_size=test_size, stratify=outcomes, random_state=seed
+        )
+        holdout_auc = float(roc_auc_score(test_y, fit(train_x, train_y).predict_proba(test_x)[:, 1]))
+
+    return {
+        "model": fit(features, outcomes),
+        "features": FEATURE_NAMES,
+        "trained_at": datetime.utcnow().isoformat(),
+        "samples": int(len(outcomes)),
+        "won": int(outcomes.sum()),
+        "holdout_auc": holdout_auc
+    }
+
+def save(bundle: dict, path: Optional[str] = None) -> str:
+    path = path or _model_path
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    joblib.dump(bundle, path)
+    return path
+
+def configure(path: Optional[str] = None, bundle: Optional[dict] = None) -> None:
+    """
+    Load the model from a different file, or use an already-trained bundle.
+    Used by the training command and by tests.
+    """
+    global _model_path, _model, _model_loaded
+    with _lock:
+        _model_path = path or LEAD_MODEL_PATH
+        _model = bundle
+        _model_loaded = bundle is not None
+
+def get_model() -> Optional[dict]:
+    """Model bundle, loaded on first use; None if unavailable"""
+    global _model, _model_loaded
+    if _model_loaded:
+        return _model
+
+    with _lock:
+        if not _model_loaded:
+            _model_loaded = True
+            if not SKLEARN_AVAILABLE:
+                logger.warning("scikit-learn is not installed; local lead scoring is disabled")
+            elif not os.path.exists(_model_path):
+                logger.warning("Lead scoring model %s not found; run train_lead_model.py", _model_path)
+            else:
+                bundle = joblib.load(_model_path)
+                if tuple(bundle.get("features", ())) != FEATURE_NAMES:
+                    logger.warning("Lead scoring model %s was trained on different features; retrain it", _model_path)
+                else:
+                    _model = bundle
+    return _model
+
+def score(features: np.ndarray, bundle: Optional[dict] = None) -> np.ndarray:
+    """Conversion probability of each feature row, scaled to 0-100"""
+    bundle = bundle or get_model()
+    if bundle is None:
+        raise RuntimeError("No lead scoring model is available")
+    if not len(features):
+        return np.zeros(0)
+    return np.round(bundle["model"].predict_proba(features)[:, 1] * 100, 1)
+
+def model_info(bundle: Optional[dict] = None) -> Optional[dict]:
+    bundle = bundle or get_model()
+    if bundle is None:
+        return None
+    return {name: bundle[name] for name in ("trained_at", "samples", "won", "holdout_auc")}
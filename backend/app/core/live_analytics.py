@@ -0,0 +1,144 @@
+"""
+In-process pub/sub of live tracking counters for dashboards.
+
+The event buffer publishes each committed flush: page views, new visitors
+and new leads per business, plus the visitors active in it. Every
+subscriber accumulates the deltas published since its last push, so however
+many flushes happen in between, a subscriber receives at most one message
+per push interval. Active visitors are the distinct visitors seen in the
+last LIVE_ACTIVE_WINDOW seconds, sent as an absolute count.
+
+Subscribers only see activity of the process they are connected to; with
+several workers each serves its own ingestion.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from app.core import rollups
+
+LIVE_PUSH_INTERVAL = float(os.getenv("LIVE_PUSH_INTERVAL", "2.0"))
+LIVE_HEARTBEAT_INTERVAL = float(os.getenv("LIVE_HEARTBEAT_INTERVAL", "15.0"))
+LIVE_ACTIVE_WINDOW = float(os.getenv("LIVE_ACTIVE_WINDOW", "300"))
+
+# Rollup metrics forwarded to subscribers, counted on the daily rollup keys
+LIVE_METRICS = ("page_views", "new_visitors", "new_leads")
+
+class Subscription:
+    """One subscriber's counters accumulated since its last push"""
+
+    def __init__(self, business_id: int):
+        self.business_id = business_id
+        self._pending: Dict[str, int] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def add(self, counters: Dict[str, int]) -> None:
+        with self._lock:
+            for metric, amount in counters.items():
+                self._pending[metric] = self._pending.get(metric, 0) + amount
+            self._dirty = True
+
+    def drain(self) -> Optional[Dict[str, int]]:
+        """Counters accumulated since the previous drain, or None if nothing was published"""
+        with self._lock:
+            if not self._dirty:
+                return None
+            pending, self._pending, self._dirty = self._pending, {}, False
+        return pending
+
+def _prune(active: "OrderedDict[int, float]", cutoff: float) -> None:
+    while active and next(iter(active.values())) < cutoff:
+        active.popitem(last=False)
+
+class LiveHub:
+    def __init__(self, active_window: float = LIVE_ACTIVE_WINDOW):
+        self.active_window = active_window
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, List[Subscription]] = {}
+        # business_id -> visitor primary key -> last seen (monotonic), least recent first
+        self._active: Dict[int, "OrderedDict[int, float]"] = {}
+
+        # Metrics
+        self._published = 0
+
+    def subscribe(self, business_id: int) -> Subscription:
+        subscription = Subscription(business_id)
+        with self._lock:
+            self._subscribers.setdefault(business_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.business_id, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.business_id, None)
+
+    def publish(self, counters: Dict[int, Dict[str, int]], active_visitors: Dict[int, List[int]], now: Optional[float] = None) -> None:
+        """Fan per-business counter deltas out to subscribers and mark visitors active"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for business_id, visitor_pks in active_visitors.items():
+                active = self._active.setdefault(business_id, OrderedDict())
+                for visitor_pk in visitor_pks:
+                    active[visitor_pk] = now
+                    active.move_to_end(visitor_pk)
+                # Visitor sets of businesses nobody is watching are pruned here
+                _prune(active, now - self.active_window)
+            subscribers = {business_id: list(self._subscribers.get(business_id, ())) for business_id in counters}
+            self._published += 1
+
+        for business_id, business_counters in counters.items():
+            for subscription in subscribers[business_id]:
+                subscription.add(business_counters)
+
+    def publish_batch(self, rows: List[dict], deltas: Dict[int, dict], rollup_deltas: rollups.RollupDeltas) -> None:
+        """Publish what a committed flush of the event buffer added"""
+        counters: Dict[int, Dict[str, int]] = {}
+        active_visitors: Dict[int, List[int]] = {}
+        for row in rows:
+            if row["event_type"] == "page_view":
+                business_counters = counters.setdefault(deltas[row["visitor_id"]]["business_id"], {})
+                business_counters["page_views"] = business_counters.get("page_views", 0) + 1
+        for (business_id, granularity, _, metric, _), amount in rollup_deltas.counts.items():
+            if granularity == "day" and metric in LIVE_METRICS:
+                business_counters = counters.setdefault(business_id, {})
+                business_counters[metric] = business_counters.get(metric, 0) + amount
+        for visitor_pk, delta in deltas.items():
+            if delta["last_visit"]:
+                active_visitors.setdefault(delta["business_id"], []).append(visitor_pk)
+                counters.setdefault(delta["business_id"], {})
+        if counters:
+            self.publish(counters, active_visitors)
+
+    def active_visitors(self, business_id: int, now: Optional[float] = None) -> int:
+        """Distinct visitors seen within the active window"""
+        cutoff = (time.monotonic() if now is None else now) - self.active_window
+        with self._lock:
+            active = self._active.get(business_id)
+            if not active:
+                return 0
+            _prune(active, cutoff)
+            if not active:
+                del self._active[business_id]
+                return 0
+            return len(active)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._subscribers.clear()
+            self._active.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "businesses": len(self._subscribers),
+                "tracked_active_visitors": sum(len(active) for active in self._active.values()),
+                "published": self._published
+            }
+
+live_hub = LiveHub()
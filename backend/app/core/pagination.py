@@ -0,0 +1,69 @@
+"""
+Keyset (cursor) pagination over a (timestamp, id) sort key, newest first.
+
+Pages are read with WHERE (ts, id) < (cursor_ts, cursor_id) against a
+composite index, so fetching page 1000 costs the same as fetching page 1.
+Rows whose timestamp is NULL sort after every dated row; they are read in a
+second phase ordered by id alone, which keeps both phases index-ordered on
+databases that disagree about where NULLs go.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+Cursor = Tuple[Optional[datetime], int]  # (timestamp, id) of the last row returned
+
+def encode_cursor(timestamp: Optional[datetime], row_id: int) -> str:
+    payload = json.dumps([timestamp.isoformat() if timestamp else None, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Parse a cursor produced by encode_cursor; raises ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        timestamp = datetime.fromisoformat(timestamp) if timestamp is not None else None
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if not isinstance(row_id, int):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return timestamp, row_id
+
+def _phases(query: Query, timestamp_column, id_column, after: Optional[Cursor]):
+    """The dated and undated halves of the listing, each ordered by the index"""
+    if after is None or after[0] is not None:
+        dated = query.filter(timestamp_column.isnot(None))
+        if after is not None:
+            dated = dated.filter(tuple_(timestamp_column, id_column) < tuple_(*after))
+        yield dated.order_by(timestamp_column.desc(), id_column.desc())
+
+    undated = query.filter(timestamp_column.is_(None))
+    if after is not None and after[0] is None:
+        undated = undated.filter(id_column < after[1])
+    yield undated.order_by(id_column.desc())
+
+def keyset_page(query: Query, timestamp_column, id_column, limit: int, after: Optional[Cursor] = None):
+    """
+    Up to limit rows following the cursor, and the cursor for the next page
+    (None when there are no more rows). The query must select both key columns.
+    """
+    rows = []
+    for phase in _phases(query, timestamp_column, id_column, after):
+        # One extra row tells us whether another page exists
+        rows.extend(phase.limit(limit + 1 - len(rows)).all())
+        if len(rows) > limit:
+            break
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]._mapping
+    return rows, encode_cursor(last[timestamp_column.key], last[id_column.key])
+
+def keyset_stream(query: Query, timestamp_column, id_column, after: Optional[Cursor] = None, batch_size: int = 1000) -> Iterator:
+    """Every row following the cursor, fetched through a server-side cursor in batches"""
+    for phase in _phases(query, timestamp_column, id_column, after):
+        yield from phase.yield_per(batch_size)
@@ -0,0 +1,170 @@
+"""
+In-memory token-bucket admission control for tracking ingestion.
+
+Each business and each (business, visitor) pair has a bucket refilled at a
+steady rate up to a burst size; an event spends one token. The checks run at
+the start of the tracking routes, before any database work, so a tenant's
+traffic spike or a script stuck in a loop is shed in microseconds instead of
+competing with every other tenant for the database.
+
+Rates are events per second. Defaults come from the environment; single
+businesses can be given their own limits with
+TRACKING_BUSINESS_LIMITS="<business_id>:<rate>/<burst>,...". A rate of 0
+disables that limit. Buckets live in bounded LRU maps, so idle visitors are
+forgotten (and come back with a full bucket).
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger("marketing_automation.tracking")
+
+BUSINESS_RATE = float(os.getenv("TRACKING_BUSINESS_RATE", "200"))
+BUSINESS_BURST = float(os.getenv("TRACKING_BUSINESS_BURST", "1000"))
+VISITOR_RATE = float(os.getenv("TRACKING_VISITOR_RATE", "5"))
+VISITOR_BURST = float(os.getenv("TRACKING_VISITOR_BURST", "50"))
+MAX_VISITOR_BUCKETS = int(os.getenv("TRACKING_MAX_VISITOR_BUCKETS", "100000"))
+MAX_BUSINESS_BUCKETS = int(os.getenv("TRACKING_MAX_BUSINESS_BUCKETS", "10000"))
+THROTTLE_SAMPLE_RATE = float(os.getenv("TRACKING_THROTTLE_SAMPLE_RATE", "0"))
+
+LIMIT_BUSINESS = "business"
+LIMIT_VISITOR = "visitor"
+
+def parse_limits(value: str) -> Dict[int, Tuple[float, float]]:
+    """Parse "<business_id>:<rate>/<burst>,..." overrides, skipping malformed entries"""
+    limits = {}
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            business_id, limit = entry.split(":")
+            rate, burst = limit.split("/")
+            limits[int(business_id)] = (float(rate), float(burst))
+        except ValueError:
+            logger.warning("Ignoring invalid tracking limit %r", entry)
+    return limits
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float, cost: float = 1.0) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+class TokenBucketLimiter:
+    """Token buckets keyed by arbitrary hashable keys, least recently used evicted first"""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_keys: int = 10000,
+        overrides: Optional[Dict[Hashable, Tuple[float, float]]] = None,
+        clock=time.monotonic
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.overrides = overrides or {}
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def allow(self, key: Hashable, cost: float = 1.0) -> bool:
+        rate, burst = self.overrides.get(key, (self.rate, self.burst))
+        if rate <= 0:
+            return True
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now, cost)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+class AdmissionControl:
+    """Per-business and per-visitor limits plus per-business throttle counters"""
+
+    def __init__(self, business_limiter: TokenBucketLimiter, visitor_limiter: TokenBucketLimiter):
+        self.business_limiter = business_limiter
+        self.visitor_limiter = visitor_limiter
+        self._lock = threading.Lock()
+        self._admitted: Dict[int, int] = {}
+        self._throttled: Dict[int, Dict[str, int]] = {}
+
+    def check(self, business_id: int, visitor_id: Optional[str] = None) -> Optional[str]:
+        """Spend a token for one event; returns the limit that was hit, or None if admitted"""
+        limit = None
+        # The visitor bucket goes first so a looping visitor does not drain its business's tokens
+        if visitor_id is not None and not self.visitor_limiter.allow((business_id, visitor_id)):
+            limit = LIMIT_VISITOR
+        elif not self.business_limiter.allow(business_id):
+            limit = LIMIT_BUSINESS
+
+        with self._lock:
+            if limit is None:
+                self._admitted[business_id] = self._admitted.get(business_id, 0) + 1
+                while len(self._admitted) > self.business_limiter.max_keys:
+                    del self._admitted[next(iter(self._admitted))]
+            else:
+                counts = self._throttled.setdefault(business_id, {})
+                counts[limit] = counts.get(limit, 0) + 1
+                while len(self._throttled) > self.business_limiter.max_keys:
+                    del self._throttled[next(iter(self._throttled))]
+        return limit
+
+    def for_business(self, business_id: int) -> dict:
+        with self._lock:
+            throttled = dict(self._throttled.get(business_id, {}))
+            admitted = self._admitted.get(business_id, 0)
+        return {"admitted": admitted, "throttled": sum(throttled.values()), "by_limit": throttled}
+
+    def clear(self) -> None:
+        self.business_limiter.clear()
+        self.visitor_limiter.clear()
+        with self._lock:
+            self._admitted.clear()
+            self._throttled.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = {business_id: sum(counts.values()) for business_id, counts in self._throttled.items()}
+        top = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:10]
+        return {
+            "business_buckets": len(self.business_limiter),
+            "visitor_buckets": len(self.visitor_limiter),
+            "throttled": sum(totals.values()),
+            "top_throttled": [{"business_id": business_id, "throttled": count} for business_id, count in top]
+        }
+
+admission = AdmissionControl(
+    TokenBucketLimiter(
+        BUSINESS_RATE, BUSINESS_BURST, MAX_BUSINESS_BUCKETS,
+        overrides=parse_limits(os.getenv("TRACKING_BUSINESS_LIMITS", ""))
+    ),
+    TokenBucketLimiter(VISITOR_RATE, VISITOR_BURST, MAX_VISITOR_BUCKETS)
+)
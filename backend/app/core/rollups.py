@@ -0,0 +1,214 @@
+"""
+Incremental maintenance of the hourly and daily analytics rollups.
+
+Counter changes are accumulated in memory in a RollupDeltas object and then
+applied with one multi-row upsert (value = value + excluded.value), so a
+batch of events touches each (business, bucket, metric, dimension) row once.
+Buckets are in UTC.
+"""
+from sqlalchemy import update, insert, delete, select, func
+from sqlalchemy.orm import Session
+from app.models.analytics import AnalyticsRollup
+from app.models.website_tracking import WebsiteVisitor, WebsiteEvent
+from typing import Dict, Optional, Tuple
+from datetime import datetime, timezone
+
+GRANULARITIES = ("hour", "day")
+
+# Dimension values are truncated to the column size
+MAX_DIMENSION_LENGTH = 500
+
+# Metrics rebuild_rollups can recompute from raw rows; the others (sessions,
+# bot hits, throttled events) are only counted as they happen
+REBUILT_METRICS = ("events", "page_views", "unique_visitors", "new_visitors", "new_leads")
+
+RollupKey = Tuple[int, str, datetime, str, str]  # (business_id, granularity, bucket_start, metric, dimension)
+
+_rollups = AnalyticsRollup.__table__
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Normalize a datetime to naive UTC, the form used for bucket boundaries"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    """Start of the hour or day bucket containing value"""
+    value = as_utc(value)
+    if granularity == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+class RollupDeltas:
+    """In-memory accumulator of rollup counter increments"""
+
+    def __init__(self):
+        self.counts: Dict[RollupKey, int] = {}
+
+    def add(
+        self,
+        business_id: int,
+        metric: str,
+        at: datetime,
+        dimension: Optional[str] = "",
+        amount: int = 1,
+        granularities: Tuple[str, ...] = GRANULARITIES
+    ) -> None:
+        dimension = (dimension or "")[:MAX_DIMENSION_LENGTH]
+        for granularity in granularities:
+            key = (business_id, granularity, bucket_start(at, granularity), metric, dimension)
+            self.counts[key] = self.counts.get(key, 0) + amount
+
+    def merge(self, other: "RollupDeltas") -> None:
+        for key, amount in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + amount
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+def _dialect_insert(db: Session):
+    """INSERT construct supporting ON CONFLICT for the session's dialect, if any"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+def apply_rollups(db: Session, deltas: RollupDeltas) -> None:
+    """Add the accumulated increments to analytics_rollups; the caller commits"""
+    if not deltas.counts:
+        return
+
+    # A stable key order keeps concurrent flushes from deadlocking on the same rows
+    rows = [
+        {
+            "business_id": business_id,
+            "granularity": granularity,
+            "bucket_start": bucket,
+            "metric": metric,
+            "dimension": dimension,
+            "value": amount
+        }
+        for (business_id, granularity, bucket, metric, dimension), amount in sorted(deltas.counts.items())
+        if amount
+    ]
+    if not rows:
+        return
+
+    dialect_insert = _dialect_insert(db)
+    if dialect_insert is not None:
+        stmt = dialect_insert(_rollups)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["business_id", "granularity", "bucket_start", "metric", "dimension"],
+            set_={"value": _rollups.c.value + stmt.excluded.value}
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Generic fallback: increment existing rows, insert the rest
+    for row in rows:
+        result = db.execute(
+            update(_rollups).where(
+                _rollups.c.business_id == row["business_id"],
+                _rollups.c.granularity == row["granularity"],
+                _rollups.c.bucket_start == row["bucket_start"],
+                _rollups.c.metric == row["metric"],
+                _rollups.c.dimension == row["dimension"]
+            ).values(value=_rollups.c.value + row["value"])
+        )
+        if result.rowcount == 0:
+            db.execute(insert(_rollups), row)
+
+def rollup_query(db: Session, business_id: int, granularity: str = "day", start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Base query over one business's rollups, optionally limited to [start, end)"""
+    query = db.query(AnalyticsRollup).filter(
+        AnalyticsRollup.business_id == business_id,
+        AnalyticsRollup.granularity == granularity
+    )
+    if start:
+        query = query.filter(AnalyticsRollup.bucket_start >= bucket_start(start, granularity))
+    if end:
+        query = query.filter(AnalyticsRollup.bucket_start < as_utc(end))
+    return query
+
+def metric_total(db: Session, business_id: int, metric: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+    """Sum of a metric over the daily rollups"""
+    total = rollup_query(db, business_id, "day", start, end).filter(
+        AnalyticsRollup.metric == metric
+    ).with_entities(func.coalesce(func.sum(AnalyticsRollup.value), 0)).scalar()
+    return int(total or 0)
+
+def rebuild_rollups(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    business_id: Optional[int] = None,
+    events=None,
+    batch_size: int = 10000
+) -> int:
+    """
+    Recompute the REBUILT_METRICS rollups with a bucket in [start, end) from raw data;
+    other metrics are left as they are. The caller commits.
+    events is the selectable to read events from (website_events by default).
+    Returns the number of events read.
+    """
+    events = WebsiteEvent.__table__ if events is None else events
+    visitors = WebsiteVisitor.__table__
+    deltas = RollupDeltas()
+    unique_visitors = {}  # (business_id, granularity, bucket_start) -> visitor primary keys
+    
+    query = select(
+        visitors.c.business_id,
+        events.c.visitor_id,
+        events.c.event_type,
+        events.c.page_url,
+        events.c.created_at
+    ).select_from(
+        events.join(visitors, events.c.visitor_id == visitors.c.id)
+    ).where(
+        events.c.created_at >= start,
+        events.c.created_at < end
+    )
+    if business_id:
+        query = query.where(visitors.c.business_id == business_id)
+    
+    event_count = 0
+    for event_business_id, visitor_pk, event_type, page_url, created_at in db.execute(
+        query.execution_options(yield_per=batch_size)
+    ):
+        event_count += 1
+        deltas.add(event_business_id, "events", created_at, event_type)
+        if event_type == "page_view":
+            deltas.add(event_business_id, "page_views", created_at, page_url)
+        for granularity in GRANULARITIES:
+            key = (event_business_id, granularity, bucket_start(created_at, granularity))
+            unique_visitors.setdefault(key, set()).add(visitor_pk)
+    
+    # Unique visitors are rebuilt from events only, since individual pixel hits are not stored
+    for (event_business_id, granularity, bucket), visitor_pks in unique_visitors.items():
+        deltas.add(event_business_id, "unique_visitors", bucket, amount=len(visitor_pks), granularities=(granularity,))
+    
+    for metric, column, extra_filters in (
+        ("new_visitors", visitors.c.created_at, ()),
+        ("new_leads", visitors.c.lead_converted_at, (visitors.c.is_lead == True,))
+    ):
+        query = select(visitors.c.business_id, column).where(column >= start, column < end, *extra_filters)
+        if business_id:
+            query = query.where(visitors.c.business_id == business_id)
+        for visitor_business_id, created_at in db.execute(query.execution_options(yield_per=batch_size)):
+            deltas.add(visitor_business_id, metric, created_at)
+    
+    stale = delete(_rollups).where(
+        _rollups.c.bucket_start >= start,
+        _rollups.c.bucket_start < end,
+        _rollups.c.metric.in_(REBUILT_METRICS)
+    )
+    if business_id:
+        stale = stale.where(_rollups.c.business_id == business_id)
+    db.execute(stale)
+    
+    apply_rollups(db, deltas)
+    return event_count
@@ -0,0 +1,221 @@
+"""
+Streaming sessionization of website events.
+
+Each event is assigned to its visitor's open session, or starts a new one
+when the visitor has been inactive for longer than the timeout (or the open
+session has reached its maximum length). Open sessions are kept in memory,
+ordered by last activity, so expiring idle sessions only looks at the ones
+that actually expired. Finished sessions are written to visitor_sessions by
+the event buffer's flush.
+
+Events carry their session_id, so after a restart the open sessions are
+rebuilt by replaying the events of sessions that were still active and have
+no visitor_sessions row yet.
+"""
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from app.models.website_tracking import WebsiteVisitor, VisitorSession
+from app.core import rollups, event_partitions
+from app.core.database import SessionLocal
+
+logger = logging.getLogger("marketing_automation.tracking")
+
+SESSION_TIMEOUT = float(os.getenv("TRACKING_SESSION_TIMEOUT", "1800"))
+SESSION_MAX_DURATION = float(os.getenv("TRACKING_SESSION_MAX_DURATION", "86400"))
+
+_sessions = VisitorSession.__table__
+_visitors = WebsiteVisitor.__table__
+
+class OpenSession:
+    """State of one in-progress session"""
+    __slots__ = (
+        "session_id", "visitor_pk", "business_id", "started_at", "last_event_at",
+        "page_views", "event_count", "entry_page", "exit_page"
+    )
+
+    def __init__(self, visitor_pk: int, business_id: int, started_at: datetime, session_id: Optional[str] = None):
+        self.session_id = session_id or str(uuid.uuid4())
+        self.visitor_pk = visitor_pk
+        self.business_id = business_id
+        self.started_at = started_at
+        self.last_event_at = started_at
+        self.page_views = 0
+        self.event_count = 0
+        self.entry_page = None
+        self.exit_page = None
+
+    def add(self, event_type: str, page_url: Optional[str], at: datetime) -> None:
+        self.event_count += 1
+        if at > self.last_event_at:
+            self.last_event_at = at
+        if event_type == "page_view":
+            self.page_views += 1
+            if self.entry_page is None:
+                self.entry_page = page_url
+            self.exit_page = page_url
+        elif self.entry_page is None:
+            self.entry_page = page_url
+
+    def to_row(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "visitor_id": self.visitor_pk,
+            "business_id": self.business_id,
+            "started_at": self.started_at,
+            "ended_at": self.last_event_at,
+            "duration": (self.last_event_at - self.started_at).total_seconds(),
+            "page_views": self.page_views,
+            "event_count": self.event_count,
+            "entry_page": self.entry_page,
+            "exit_page": self.exit_page or self.entry_page
+        }
+
+class Sessionizer:
+    def __init__(self, timeout: float = SESSION_TIMEOUT, max_duration: float = SESSION_MAX_DURATION):
+        self.timeout = timedelta(seconds=timeout)
+        self.max_duration = timedelta(seconds=max_duration)
+        self._lock = threading.Lock()
+        # visitor primary key -> OpenSession, least recently active first
+        self._open: "OrderedDict[int, OpenSession]" = OrderedDict()
+        self._finished: List[dict] = []
+
+        # Metrics
+        self._started = 0
+        self._recovered = 0
+
+    def _session_for(self, visitor_pk: int, business_id: int, at: datetime) -> OpenSession:
+        session = self._open.get(visitor_pk)
+        if session is not None and (
+            at - session.last_event_at > self.timeout or at - session.started_at > self.max_duration
+        ):
+            self._finished.append(session.to_row())
+            session = None
+        if session is None:
+            session = self._open[visitor_pk] = OpenSession(visitor_pk, business_id, at)
+            self._started += 1
+        self._open.move_to_end(visitor_pk)
+        return session
+
+    def assign(self, rows: List[dict], deltas: Dict[int, dict]) -> None:
+        """
+        Set session_id on WebsiteEvent rows, in arrival order. Rows that already
+        have one (a batch retried after a failed flush) are left untouched.
+        """
+        with self._lock:
+            for row in rows:
+                if row.get("session_id"):
+                    continue
+                at = rollups.as_utc(row["created_at"])
+                session = self._session_for(row["visitor_id"], deltas[row["visitor_id"]]["business_id"], at)
+                session.add(row["event_type"], row["page_url"], at)
+                row["session_id"] = session.session_id
+
+    def expire(self, now: Optional[datetime] = None) -> List[dict]:
+        """Close sessions idle for longer than the timeout; returns every finished session row"""
+        cutoff = (now or datetime.utcnow()) - self.timeout
+        with self._lock:
+            while self._open:
+                visitor_pk, session = next(iter(self._open.items()))
+                if session.last_event_at > cutoff:
+                    break
+                del self._open[visitor_pk]
+                self._finished.append(session.to_row())
+            finished, self._finished = self._finished, []
+        return finished
+
+    def restore(self, finished: List[dict]) -> None:
+        """Requeue finished sessions whose write failed"""
+        with self._lock:
+            self._finished = finished + self._finished
+
+    def recover(self, db: Session, now: Optional[datetime] = None) -> int:
+        """
+        Rebuild open sessions after a restart by replaying the events of sessions
+        active within the last timeout that have not been written yet.
+        Returns the number of sessions recovered.
+        """
+        now = now or datetime.utcnow()
+        events = event_partitions.events_table(db, now - self.max_duration - self.timeout)
+        recent = select(events.c.session_id).where(
+            events.c.created_at >= now - self.timeout,
+            events.c.session_id.isnot(None)
+        ).distinct()
+        written = select(_sessions.c.session_id).where(_sessions.c.session_id.in_(recent))
+        pending = set(db.execute(recent).scalars()) - set(db.execute(written).scalars())
+        if not pending:
+            return 0
+
+        replay = db.execute(
+            select(
+                events.c.session_id,
+                events.c.visitor_id,
+                _visitors.c.business_id,
+                events.c.event_type,
+                events.c.page_url,
+                events.c.created_at
+            ).select_from(
+                events.join(_visitors, events.c.visitor_id == _visitors.c.id)
+            ).where(
+                events.c.created_at >= now - self.max_duration - self.timeout,
+                events.c.session_id.in_(pending)
+            ).order_by(events.c.created_at, events.c.id)
+        )
+
+        recovered = {}
+        for session_id, visitor_pk, business_id, event_type, page_url, created_at in replay:
+            at = rollups.as_utc(created_at)
+            session = recovered.get(session_id)
+            if session is None:
+                session = recovered[session_id] = OpenSession(visitor_pk, business_id, at, session_id)
+            session.add(event_type, page_url, at)
+
+        with self._lock:
+            for session in sorted(recovered.values(), key=lambda session: session.last_event_at):
+                current = self._open.get(session.visitor_pk)
+                if current is None or current.last_event_at < session.last_event_at:
+                    self._open[session.visitor_pk] = session
+                    self._open.move_to_end(session.visitor_pk)
+            self._recovered += len(recovered)
+        logger.info("Recovered %d open visitor sessions", len(recovered))
+        return len(recovered)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._open.clear()
+            self._finished = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open_sessions": len(self._open),
+                "pending_sessions": len(self._finished),
+                "started": self._started,
+                "recovered": self._recovered
+            }
+
+def write_sessions(db: Session, rows: List[dict], rollup_deltas: rollups.RollupDeltas) -> None:
+    """Insert finished sessions and count them in the rollups; the caller commits"""
+    if not rows:
+        return
+    db.execute(insert(_sessions), rows)
+    for row in rows:
+        rollup_deltas.add(row["business_id"], "sessions", row["started_at"])
+
+sessionizer = Sessionizer()
+
+def recover_sessions(session_factory: Callable[[], Session] = SessionLocal) -> None:
+    """Recover the global sessionizer's open sessions at startup; failures are logged, not raised"""
+    db = session_factory()
+    try:
+        sessionizer.recover(db)
+    except Exception:
+        logger.exception("Failed to recover open visitor sessions")
+    finally:
+        db.close()
@@ -0,0 +1,49 @@
+"""
+Caches for the website tracking hot path.
+"""
+import os
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.core.cache import LRUCache
+from app.models.business import Business
+
+# (business_id, visitor_id) -> WebsiteVisitor.id; the mapping never changes once the row exists
+visitor_cache = LRUCache(
+    maxsize=int(os.getenv("TRACKING_VISITOR_CACHE_SIZE", "100000")),
+    ttl=float(os.getenv("TRACKING_VISITOR_CACHE_TTL", "3600"))
+)
+
+# business_id -> tracking settings. Updates made through the ORM in this process
+# invalidate the entry immediately; other workers pick them up when the TTL expires.
+business_config_cache = LRUCache(
+    maxsize=int(os.getenv("TRACKING_BUSINESS_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TRACKING_BUSINESS_CACHE_TTL", "60"))
+)
+
+def get_tracking_config(db: Session, business_id: int) -> dict:
+    """Tracking settings (exists, enabled, timezone) for a business"""
+    config = business_config_cache.get(business_id)
+    if config is not None:
+        return config
+
+    row = db.query(Business.is_tracking_enabled, Business.timezone).filter(
+        Business.id == business_id
+    ).first()
+
+    if row:
+        config = {"exists": True, "enabled": bool(row.is_tracking_enabled), "timezone": row.timezone or "UTC"}
+    else:
+        config = {"exists": False, "enabled": False, "timezone": None}
+
+    business_config_cache.set(business_id, config)
+    return config
+
+def invalidate_business_config(business_id: int) -> None:
+    """Drop the cached tracking settings for a business"""
+    business_config_cache.pop(business_id)
+
+@event.listens_for(Business, "after_insert")
+@event.listens_for(Business, "after_update")
+@event.listens_for(Business, "after_delete")
+def _invalidate_on_change(mapper, connection, target):
+    invalidate_business_config(target.id)
@@ -0,0 +1,291 @@
+"""
+Build and cache the JavaScript tracking snippet served to client websites.
+
+The script is rendered once per (business, version), minified and
+pre-compressed, so serving it is a dictionary lookup plus a header check.
+"""
+import gzip
+import hashlib
+import os
+import re
+from typing import Dict, Optional
+from app.core.cache import LRUCache
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Bump whenever SCRIPT_TEMPLATE changes so cached copies and ETags roll over
+TRACKING_SCRIPT_VERSION = "3"
+
+TRACKING_API_URL = os.getenv("TRACKING_API_URL", "http://localhost:8000/api/tracking")
+SCRIPT_MAX_AGE = int(os.getenv("TRACKING_SCRIPT_MAX_AGE", "3600"))
+
+SCRIPT_TEMPLATE = """
+(function() {
+    var businessId = __BUSINESS_ID__;
+    var apiUrl = '__API_URL__';
+
+    // Events are queued and sent in batches
+    var MAX_BATCH_SIZE = 20;
+    var FLUSH_INTERVAL = 5000;
+    var queue = [];
+    var flushTimer = null;
+
+    // Generate or get visitor ID
+    var visitorId = getCookie('visitor_id') || generateUUID();
+    setCookie('visitor_id', visitorId, 365);
+
+    // Load tracking pixel
+    var img = new Image();
+    img.src = apiUrl + '/pixel/' + businessId;
+
+    // Track page view
+    trackEvent('page_view', {
+        url: window.location.href,
+        title: document.title,
+        referrer: document.referrer
+    });
+
+    // Track time on page; the page may be discarded once hidden, so flush with sendBeacon
+    var startTime = Date.now();
+    function trackExit() {
+        if (startTime === null) return;
+        var timeSpent = (Date.now() - startTime) / 1000;
+        startTime = null;
+        trackEvent('page_exit', {
+            url: window.location.href
+        }, timeSpent);
+        flush(true);
+    }
+    document.addEventListener('visibilitychange', function() {
+        if (document.visibilityState === 'hidden') {
+            trackExit();
+        } else if (startTime === null) {
+            startTime = Date.now();
+        }
+    });
+    window.addEventListener('pagehide', trackExit);
+
+    // Track form submissions
+    document.addEventListener('submit', function(e) {
+        var form = e.target;
+        var formData = new FormData(form);
+        var fields = {};
+
+        for (var pair of formData.entries()) {
+            fields[pair[0]] = pair[1];
+        }
+
+        // Check if email or phone is captured
+        var email = fields.email || fields.Email || fields.EMAIL;
+        var phone = fields.phone || fields.Phone || fields.PHONE || fields.tel;
+        var name = fields.name || fields.Name || fields.NAME || fields.full_name;
+
+        if (email || phone) {
+            // This is a lead capture
+            captureLeadData({
+                email: email,
+                phone: phone,
+                name: name,
+                form_fields: fields
+            });
+        }
+
+        trackEvent('form_submit', {
+            url: window.location.href,
+            form_fields: fields
+        });
+    });
+
+    // Track clicks on important elements
+    document.addEventListener('click', function(e) {
+        var element = e.target;
+        var tagName = element.tagName.toLowerCase();
+
+        if (tagName === 'a' || tagName === 'button' || element.getAttribute('data-track')) {
+            trackEvent('element_click', {
+                url: window.location.href,
+                element_type: tagName,
+                element_text: element.textContent.trim(),
+                element_id: element.id,
+                element_class: element.className
+            });
+        }
+    });
+
+    function trackEvent(eventType, eventData, duration) {
+        queue.push({
+            business_id: businessId,
+            visitor_id: visitorId,
+            // Lets the server drop copies of this event from retries and beacon fallbacks
+            event_id: generateUUID(),
+            event_type: eventType,
+            page_url: window.location.href,
+            page_title: document.title,
+            event_data: eventData,
+            duration: duration
+        });
+        if (queue.length >= MAX_BATCH_SIZE) {
+            flush(false);
+        } else if (flushTimer === null) {
+            flushTimer = setTimeout(function() { flush(false); }, FLUSH_INTERVAL);
+        }
+    }
+
+    function flush(unloading) {
+        if (flushTimer !== null) {
+            clearTimeout(flushTimer);
+            flushTimer = null;
+        }
+        if (!queue.length) return;
+        var payload = JSON.stringify({ events: queue.splice(0, queue.length) });
+
+        // Plain-text bodies are CORS "simple" requests, so neither path needs a preflight
+        if (unloading && navigator.sendBeacon && navigator.sendBeacon(apiUrl + '/beacon', payload)) {
+            return;
+        }
+        send(payload, 1);
+    }
+
+    function send(payload, retries) {
+        fetch(apiUrl + '/beacon', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'text/plain'
+            },
+            body: payload,
+            keepalive: true
+        }).catch(function(error) {
+            // Events carry ids, so resending a batch that may have arrived is safe
+            if (retries > 0) {
+                setTimeout(function() { send(payload, retries - 1); }, 2000);
+            } else {
+                console.log('Tracking error:', error);
+            }
+        });
+    }
+
+    function captureLeadData(leadData) {
+        fetch(apiUrl + '/capture-lead', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                business_id: businessId,
+                visitor_id: visitorId,
+                email: leadData.email,
+                phone: leadData.phone,
+                name: leadData.name,
+                form_fields: leadData.form_fields
+            })
+        }).catch(function(error) {
+            console.log('Lead capture error:', error);
+        });
+    }
+
+    function generateUUID() {
+        return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
+            var r = Math.random() * 16 | 0, v = c == 'x' ? r : (r & 0x3 | 0x8);
+            return v.toString(16);
+        });
+    }
+
+    function getCookie(name) {
+        var value = "; " + document.cookie;
+        var parts = value.split("; " + name + "=");
+        if (parts.length == 2) return parts.pop().split(";").shift();
+    }
+
+    function setCookie(name, value, days) {
+        var expires = "";
+        if (days) {
+            var date = new Date();
+            date.setTime(date.getTime() + (days * 24 * 60 * 60 * 1000));
+            expires = "; expires=" + date.toUTCString();
+        }
+        document.cookie = name + "=" + (value || "") + expires + "; path=/";
+    }
+
+    // Expose lead capture function globally for manual use
+    window.captureLeadData = captureLeadData;
+    window.trackEvent = trackEvent;
+})();
+"""
+
+_COMMENT_LINE = re.compile(r"^\s*//.*$", re.MULTILINE)
+
+def minify(source: str) -> str:
+    """
+    Conservative minifier: drops comment-only lines, indentation and blank lines.
+    Line breaks are kept so automatic semicolon insertion behaves as in the source.
+    """
+    source = _COMMENT_LINE.sub("", source)
+    return "\n".join(line.strip() for line in source.splitlines() if line.strip())
+
+def render_script(business_id: int) -> str:
+    """Render the minified tracking script for a business"""
+    return minify(SCRIPT_TEMPLATE).replace(
+        "__BUSINESS_ID__", str(int(business_id))
+    ).replace(
+        "__API_URL__", TRACKING_API_URL
+    )
+
+class CompiledScript:
+    """A rendered script with its pre-compressed encodings and strong ETags"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.encodings: Dict[str, bytes] = {"identity": source.encode("utf-8")}
+        self.encodings["gzip"] = gzip.compress(self.encodings["identity"], compresslevel=9, mtime=0)
+        if BROTLI_AVAILABLE:
+            self.encodings["br"] = brotli.compress(self.encodings["identity"])
+
+        digest = hashlib.sha256(self.encodings["identity"]).hexdigest()[:20]
+        # Each encoding is a different byte sequence, so each gets its own strong ETag
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.encodings
+        }
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Pick the best available encoding for an Accept-Encoding header"""
+        accepted = set()
+        for part in accept_encoding.split(","):
+            token, *params = [piece.strip() for piece in part.split(";")]
+            quality = 1.0
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if token and quality > 0:
+                accepted.add(token.lower())
+
+        for encoding in ("br", "gzip"):
+            if encoding in self.encodings and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Whether an If-None-Match header matches any representation of this script"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or not tags.isdisjoint(self.etags.values())
+
+_compiled_scripts = LRUCache(maxsize=int(os.getenv("TRACKING_SCRIPT_CACHE_SIZE", "10000")))
+
+def get_compiled_script(business_id: int) -> CompiledScript:
+    """Compiled tracking script for a business, built once per script version"""
+    key = (business_id, TRACKING_SCRIPT_VERSION)
+    script = _compiled_scripts.get(key)
+    if script is None:
+        script = CompiledScript(render_script(business_id))
+        _compiled_scripts.set(key, script)
+    return script
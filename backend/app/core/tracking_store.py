@@ -0,0 +1,342 @@
+"""
+Bulk persistence helpers for website tracking ingestion.
+
+These functions never commit; callers own the transaction so a whole batch
+of events and visitor counter updates lands atomically.
+"""
+from sqlalchemy import insert, update, select, bindparam, func, case, or_
+from sqlalchemy.orm import Session
+from app.models.website_tracking import WebsiteVisitor, WebsiteEvent
+from app.core.tracking_cache import visitor_cache
+from app.core import rollups, visitor_sketches, visitor_scoring, event_partitions, lead_features
+from app.core.sessionizer import sessionizer, write_sessions
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from datetime import datetime
+
+VisitorKey = Tuple[int, str]  # (business_id, visitor_id)
+
+# Core tables: ORM bulk inserts split rows with NULLs into separate statements
+_visitors = WebsiteVisitor.__table__
+_events = WebsiteEvent.__table__
+
+def resolve_visitors(
+    db: Session,
+    keys: Iterable[VisitorKey],
+    conflicts: Optional[Set[VisitorKey]] = None
+) -> Dict[VisitorKey, int]:
+    """
+    Map (business_id, visitor_id) pairs to WebsiteVisitor primary keys.
+    Cached keys skip the database; the rest are resolved with one query.
+    visitor_id is unique across businesses: keys whose visitor_id belongs to
+    another business are left unresolved and added to conflicts, if given.
+    """
+    resolved = {}
+    missing = set()
+    for key in set(keys):
+        visitor_pk = visitor_cache.get(key)
+        if visitor_pk is None:
+            missing.add(key)
+        else:
+            resolved[key] = visitor_pk
+
+    if not missing:
+        return resolved
+
+    rows = db.query(
+        WebsiteVisitor.id,
+        WebsiteVisitor.business_id,
+        WebsiteVisitor.visitor_id
+    ).filter(
+        WebsiteVisitor.visitor_id.in_({visitor_id for _, visitor_id in missing})
+    ).all()
+
+    owners = {}
+    for visitor_pk, business_id, visitor_id in rows:
+        owners[visitor_id] = business_id
+        key = (business_id, visitor_id)
+        if key in missing:
+            visitor_cache.set(key, visitor_pk)
+            resolved[key] = visitor_pk
+    if conflicts is not None:
+        conflicts.update(
+            (business_id, visitor_id) for business_id, visitor_id in missing
+            if visitor_id in owners and owners[visitor_id] != business_id
+        )
+    return resolved
+
+def resolve_visitor(
+    db: Session,
+    business_id: int,
+    visitor_id: str,
+    conflicts: Optional[Set[VisitorKey]] = None
+) -> Optional[int]:
+    """Primary key of a single visitor, or None if it does not exist yet (or belongs to another business)"""
+    return resolve_visitors(db, [(business_id, visitor_id)], conflicts).get((business_id, visitor_id))
+
+def remember_visitor(business_id: int, visitor_id: str, visitor_pk: int) -> None:
+    """Cache the primary key of a newly created (and committed) visitor"""
+    visitor_cache.set((business_id, visitor_id), visitor_pk)
+
+def remember_visitors(visitor_pks: Dict[VisitorKey, int]) -> None:
+    for (business_id, visitor_id), visitor_pk in visitor_pks.items():
+        remember_visitor(business_id, visitor_id, visitor_pk)
+
+def create_visitors(db: Session, rows: List[dict]) -> Dict[VisitorKey, int]:
+    """
+    Bulk insert WebsiteVisitor rows and return their primary keys.
+    Call remember_visitors once the transaction has committed.
+    """
+    if not rows:
+        return {}
+
+    result = db.execute(
+        insert(_visitors).returning(_visitors.c.id, _visitors.c.business_id, _visitors.c.visitor_id),
+        rows
+    )
+    return {(business_id, visitor_id): pk for pk, business_id, visitor_id in result}
+
+def _visitor_delta(deltas: Dict[int, dict], visitor_pk: int, business_id: int, seen_at: Optional[datetime]) -> dict:
+    delta = deltas.get(visitor_pk)
+    if delta is None:
+        delta = deltas[visitor_pk] = {
+            "business_id": business_id,
+            "visits": 0,
+            "page_views": 0,
+            "time_spent": 0.0,
+            "first_seen": None,
+            "last_visit": None,
+            "user_agent": None,
+            "referrer": None
+        }
+
+    if seen_at:
+        if delta["first_seen"] is None or seen_at < delta["first_seen"]:
+            delta["first_seen"] = seen_at
+        if delta["last_visit"] is None or seen_at > delta["last_visit"]:
+            delta["last_visit"] = seen_at
+    return delta
+
+def add_visitor_delta(
+    deltas: Dict[int, dict],
+    visitor_pk: int,
+    business_id: int,
+    duration: Optional[float] = None,
+    seen_at: Optional[datetime] = None
+) -> None:
+    """Accumulate the counter changes caused by one event for a visitor"""
+    delta = _visitor_delta(deltas, visitor_pk, business_id, seen_at)
+    delta["page_views"] += 1
+    if duration:
+        delta["time_spent"] += duration / 60  # Convert to minutes
+
+def add_visit_delta(
+    deltas: Dict[int, dict],
+    visitor_pk: int,
+    business_id: int,
+    seen_at: datetime,
+    user_agent: Optional[str] = None,
+    referrer: Optional[str] = None
+) -> None:
+    """Accumulate a repeat visit (tracking pixel hit) for a visitor"""
+    delta = _visitor_delta(deltas, visitor_pk, business_id, seen_at)
+    delta["visits"] += 1
+    delta["user_agent"] = user_agent
+    delta["referrer"] = referrer
+
+def merge_visitor_deltas(target: Dict[int, dict], source: Dict[int, dict]) -> None:
+    """Fold the deltas in source into target"""
+    for visitor_pk, delta in source.items():
+        current = target.get(visitor_pk)
+        if current is None:
+            target[visitor_pk] = dict(delta)
+            continue
+
+        current["visits"] += delta["visits"]
+        current["page_views"] += delta["page_views"]
+        current["time_spent"] += delta["time_spent"]
+        if delta["first_seen"] and (current["first_seen"] is None or delta["first_seen"] < current["first_seen"]):
+            current["first_seen"] = delta["first_seen"]
+        if delta["last_visit"] and (current["last_visit"] is None or delta["last_visit"] > current["last_visit"]):
+            current["last_visit"] = delta["last_visit"]
+        for field in ("user_agent", "referrer"):
+            if current[field] is None:
+                current[field] = delta[field]
+
+def remove_event_deltas(deltas: Dict[int, dict], rows: List[dict]) -> None:
+    """Take the counter changes of dropped event rows back out of deltas"""
+    for row in rows:
+        delta = deltas.get(row["visitor_id"])
+        if delta is None:
+            continue
+        delta["page_views"] -= 1
+        if row.get("duration"):
+            delta["time_spent"] -= row["duration"] / 60
+        if delta["page_views"] <= 0 and not delta["visits"]:
+            del deltas[row["visitor_id"]]
+
+def lock_visitors(db: Session, deltas: Dict[int, dict]) -> Dict[int, dict]:
+    """
+    Read (and lock, in id order) the last_visit of the visitors whose last_visit
+    a batch moves, once, before apply_visitor_deltas changes it.
+    Returns visitor_pk -> column values.
+    """
+    seen = [visitor_pk for visitor_pk, delta in deltas.items() if delta["last_visit"]]
+    if not seen:
+        return {}
+
+    rows = db.execute(
+        select(_visitors.c.id, _visitors.c.last_visit).where(
+            _visitors.c.id.in_(seen)
+        ).order_by(_visitors.c.id).with_for_update()
+    )
+    return {row.id: row._asdict() for row in rows}
+
+def count_unique_visitors(state: Dict[int, dict], deltas: Dict[int, dict], rollup_deltas: rollups.RollupDeltas) -> None:
+    """
+    Add unique_visitors rollups for visitors not yet seen in their current hour/day bucket,
+    comparing each delta with the last_visit read by lock_visitors.
+    """
+    for visitor_pk, delta in deltas.items():
+        if not delta["last_visit"] or visitor_pk not in state:
+            continue
+        previous_visit = rollups.as_utc(state[visitor_pk]["last_visit"])
+        for granularity in rollups.GRANULARITIES:
+            first_bucket = rollups.bucket_start(delta["first_seen"], granularity)
+            last_bucket = rollups.bucket_start(delta["last_visit"], granularity)
+            if previous_visit is None or previous_visit < first_bucket:
+                rollup_deltas.add(delta["business_id"], "unique_visitors", first_bucket, granularities=(granularity,))
+            if last_bucket != first_bucket:
+                rollup_deltas.add(delta["business_id"], "unique_visitors", last_bucket, granularities=(granularity,))
+
+def apply_visitor_deltas(db: Session, deltas: Dict[int, dict]) -> None:
+    """
+    Apply accumulated counter deltas as atomic SQL increments: one UPDATE per
+    visitor however many events were coalesced into its delta. last_visit only
+    moves forward, so flushes from several workers can land in any order.
+    lead_score is recomputed from the incremented counters by the same statement.
+    """
+    if not deltas:
+        return
+
+    visits = bindparam("visits")
+    page_views = bindparam("page_views")
+    time_spent = bindparam("time_spent")
+    new_visit = bindparam("last_visit", type_=_visitors.c.last_visit.type)
+    stmt = update(_visitors).where(
+        _visitors.c.id == bindparam("visitor_pk")
+    ).values(
+        total_visits=func.coalesce(_visitors.c.total_visits, 0) + visits,
+        total_page_views=func.coalesce(_visitors.c.total_page_views, 0) + page_views,
+        total_time_spent=func.coalesce(_visitors.c.total_time_spent, 0.0) + time_spent,
+        last_visit=case(
+            (or_(_visitors.c.last_visit.is_(None), new_visit > _visitors.c.last_visit), new_visit),
+            else_=_visitors.c.last_visit
+        ),
+        user_agent=func.coalesce(bindparam("new_user_agent"), _visitors.c.user_agent),
+        referrer=func.coalesce(bindparam("new_referrer"), _visitors.c.referrer),
+        lead_score=visitor_scoring.score_expression(_visitors, visits, page_views, time_spent)
+    )
+    db.execute(stmt, [
+        {
+            "visitor_pk": visitor_pk,
+            "visits": delta["visits"],
+            "page_views": delta["page_views"],
+            "time_spent": delta["time_spent"],
+            "last_visit": delta["last_visit"],
+            "new_user_agent": delta["user_agent"],
+            "new_referrer": delta["referrer"]
+        }
+        for visitor_pk, delta in sorted(deltas.items())
+    ])
+
+def notify_score_crossings(db: Session, deltas: Dict[int, dict]) -> None:
+    """
+    Queue the threshold hooks of visitors whose lead score apply_visitor_deltas
+    raised to the threshold. Only rows now at or above it are read back; they
+    are already locked by the UPDATE.
+    """
+    if not deltas:
+        return
+
+    rows = db.execute(
+        select(
+            _visitors.c.id,
+            _visitors.c.is_lead,
+            _visitors.c.total_visits,
+            _visitors.c.total_page_views,
+            _visitors.c.total_time_spent,
+            _visitors.c.email,
+            _visitors.c.phone,
+            _visitors.c.name,
+            _visitors.c.lead_score
+        ).where(
+            _visitors.c.id.in_(deltas),
+            _visitors.c.lead_score >= visitor_scoring.LEAD_SCORE_THRESHOLD
+        )
+    )
+    for row in rows:
+        delta = deltas[row.id]
+        old_score = visitor_scoring.previous_score(row, delta)
+        visitor_scoring.notify_after_commit(db, row.id, delta["business_id"], old_score, row.lead_score)
+
+def insert_events(db: Session, rows: List[dict]) -> List[int]:
+    """Bulk insert WebsiteEvent rows, returning ids in input order"""
+    if not rows:
+        return []
+
+    result = db.execute(
+        insert(_events).returning(_events.c.id, sort_by_parameter_order=True),
+        rows
+    )
+    return [row[0] for row in result]
+
+def event_exists(db: Session, visitor_pk: int, client_event_id: str, since: datetime) -> bool:
+    """Whether a visitor already has a stored event with this client event id, created after since"""
+    events = event_partitions.events_table(db, since)
+    return db.execute(
+        select(events.c.id).where(
+            events.c.visitor_id == visitor_pk,
+            events.c.client_event_id == client_event_id,
+            events.c.created_at >= since
+        ).limit(1)
+    ).first() is not None
+
+def add_event_rollups(rows: List[dict], deltas: Dict[int, dict], rollup_deltas: rollups.RollupDeltas) -> None:
+    """Page view and event-type rollups for a batch of event rows"""
+    for row in rows:
+        business_id = deltas[row["visitor_id"]]["business_id"]
+        rollup_deltas.add(business_id, "events", row["created_at"], row["event_type"])
+        if row["event_type"] == "page_view":
+            rollup_deltas.add(business_id, "page_views", row["created_at"], row["page_url"])
+
+def write_events(
+    db: Session,
+    rows: List[dict],
+    deltas: Dict[int, dict],
+    rollup_deltas: Optional[rollups.RollupDeltas] = None,
+    finished_sessions: Optional[List[dict]] = None
+) -> List[int]:
+    """
+    Insert a batch of events and any finished sessions, apply the matching
+    visitor deltas and lead scores and update the analytics rollups,
+    unique-visitor sketches and lead features, all in the current transaction.
+    """
+    sessionizer.assign(rows, deltas)
+
+    # Work on a copy so a caller retrying after a failed commit does not double count
+    combined = rollups.RollupDeltas()
+    if rollup_deltas is not None:
+        combined.merge(rollup_deltas)
+    add_event_rollups(rows, deltas, combined)
+    state = lock_visitors(db, deltas)
+    count_unique_visitors(state, deltas, combined)
+
+    event_ids = insert_events(db, rows)
+    write_sessions(db, finished_sessions or [], combined)
+    apply_visitor_deltas(db, deltas)
+    notify_score_crossings(db, deltas)
+    rollups.apply_rollups(db, combined)
+    lead_features.apply_features(db, lead_features.collect(rows, deltas, finished_sessions))
+    # Last, so the per business-day sketch rows stay locked for as short as possible
+    visitor_sketches.apply_sketches(db, visitor_sketches.collect_visitors(rows, deltas))
+    return event_ids
@@ -0,0 +1,79 @@
+"""
+Memoized user-agent parsing.
+
+user_agents.parse() runs a large set of regexes, while real traffic only
+contains a few thousand distinct UA strings, so results are memoized in a
+bounded LRU keyed on the raw header value. is_bot combines the library's
+own detection with BOT_PATTERN, which also catches crawlers, HTTP clients,
+headless browsers and uptime checkers, so bot classification is part of the
+cached result.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import NamedTuple
+import user_agents
+
+# Longer headers are truncated before parsing so cache keys stay small
+MAX_USER_AGENT_LENGTH = 512
+
+# Automated clients user_agents does not flag, as one precompiled alternation. Generic words
+# ("bot", "fetch", "monitor") also occur in real browsers' headers (CUBOT phones, in-app
+# browsers), so crawlers are matched on their conventions instead: a product token ending
+# in bot/spider/crawler with a version, such a token inside "(compatible; ...)", a "+http"
+# info URL, known crawler and automation names, and HTTP client libraries at the start.
+BOT_PATTERN = re.compile(
+    r"\b\w*(?:bot|spider|crawler)/|"
+    r"\(compatible;[^)]*\b\w*(?:bot|spider|crawler|slurp)\b|"
+    r"\+https?://|"
+    r"facebookexternalhit|bingpreview|mediapartners-google|adsbot-google|google-inspectiontool|ia_archiver|slackbot|"
+    r"headlesschrome|phantomjs|selenium|puppeteer|playwright|chrome-lighthouse|pagespeed|"
+    r"pingdom|uptimerobot|statuscake|site24x7|newrelicpinger|datadogsynthetics|"
+    r"^(?:curl|wget|httpie|python-requests|python-urllib|aiohttp|python-httpx|go-http-client|okhttp|java|"
+    r"libwww-perl|apache-httpclient|node-fetch|axios|postmanruntime|insomnia)\b",
+    re.IGNORECASE
+)
+
+class UserAgentInfo(NamedTuple):
+    device_type: str
+    browser: str
+    os: str
+    is_bot: bool
+
+def get_device_type(user_agent):
+    """Determine device type from user agent"""
+    if user_agent.is_mobile:
+        return "mobile"
+    elif user_agent.is_tablet:
+        return "tablet"
+    else:
+        return "desktop"
+
+@lru_cache(maxsize=int(os.getenv("USER_AGENT_CACHE_SIZE", "4096")))
+def _parse(user_agent_string: str) -> UserAgentInfo:
+    user_agent = user_agents.parse(user_agent_string)
+    return UserAgentInfo(
+        device_type=get_device_type(user_agent),
+        browser=user_agent.browser.family,
+        os=user_agent.os.family,
+        # An empty header is never a real browser
+        is_bot=user_agent.is_bot or not user_agent_string or bool(BOT_PATTERN.search(user_agent_string))
+    )
+
+def parse_user_agent(user_agent_string: str) -> UserAgentInfo:
+    """Parse a User-Agent header into (device_type, browser, os, is_bot)"""
+    return _parse((user_agent_string or "")[:MAX_USER_AGENT_LENGTH])
+
+def cache_stats() -> dict:
+    info = _parse.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_ratio": round(info.hits / lookups, 4) if lookups else 0.0
+    }
+
+def clear_cache() -> None:
+    _parse.cache_clear()
@@ -0,0 +1,150 @@
+"""
+Incremental maintenance of WebsiteVisitor.lead_score.
+
+The score is a capped sum of independent components (lead status, visits,
+time on site, page views, contact details), each with its own cap. Ingested
+batches recompute it inside the UPDATE that applies the counter increments
+(score_expression), so the visitor rows are not read or locked for it.
+
+Threshold hooks run after the transaction commits, once for each visitor
+whose score rose from below LEAD_SCORE_THRESHOLD to at or above it. Only
+visitors at or above the threshold after a batch are read back to check.
+"""
+import logging
+import os
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from sqlalchemy import Integer, and_, case, cast, event, func
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("marketing_automation.tracking")
+
+LEAD_SCORE_THRESHOLD = int(os.getenv("LEAD_SCORE_THRESHOLD", "50"))
+MAX_SCORE = 100
+
+# (points per unit, cap) for the counter components
+LEAD_POINTS = 10
+VISIT_POINTS, VISIT_CAP = 2, 20
+TIME_CAP = 30  # one point per minute on site
+PAGE_VIEW_CAP = 25
+EMAIL_POINTS, PHONE_POINTS, NAME_POINTS = 15, 10, 5
+
+# Called with (visitor_pk, business_id, old_score, new_score)
+ThresholdHook = Callable[[int, int, int, int], None]
+_hooks: List[ThresholdHook] = []
+
+class ScoreComponents(NamedTuple):
+    lead: int
+    visits: int
+    time: int
+    page_views: int
+    contact: int
+
+    @property
+    def score(self) -> int:
+        return min(sum(self), MAX_SCORE)
+
+def components(
+    is_lead: bool,
+    total_visits: Optional[int],
+    total_time_spent: Optional[float],
+    total_page_views: Optional[int],
+    email: Optional[str] = None,
+    phone: Optional[str] = None,
+    name: Optional[str] = None
+) -> ScoreComponents:
+    """Score components for a visitor's counters and contact fields"""
+    return ScoreComponents(
+        lead=LEAD_POINTS if is_lead else 0,
+        visits=min((total_visits or 0) * VISIT_POINTS, VISIT_CAP),
+        time=min(int(total_time_spent or 0), TIME_CAP),
+        page_views=min(total_page_views or 0, PAGE_VIEW_CAP),
+        contact=(EMAIL_POINTS if email else 0) + (PHONE_POINTS if phone else 0) + (NAME_POINTS if name else 0)
+    )
+
+def score_visitor(visitor) -> int:
+    """Score of a WebsiteVisitor (or any object with its columns)"""
+    return components(
+        visitor.is_lead, visitor.total_visits, visitor.total_time_spent, visitor.total_page_views,
+        visitor.email, visitor.phone, visitor.name
+    ).score
+
+def _capped(value, cap: int):
+    return case((value >= cap, cap), else_=value)
+
+def _whole(value):
+    """Integer part of a non-negative SQL number; CAST rounds on some databases and truncates on others"""
+    rounded = cast(value, Integer)
+    return case((rounded > value, rounded - 1), else_=rounded)
+
+def _has(column):
+    return and_(column.is_not(None), column != "")
+
+def score_expression(visitors, visits, page_views, time_spent):
+    """
+    SQL expression for the score of a row of the WebsiteVisitor table after
+    adding visits, page_views and time_spent (SQL expressions, typically bind
+    parameters) to its counters; the same arithmetic as components().
+    """
+    c = visitors.c
+    total_visits = func.coalesce(c.total_visits, 0) + visits
+    total_page_views = func.coalesce(c.total_page_views, 0) + page_views
+    total_time_spent = func.coalesce(c.total_time_spent, 0.0) + time_spent
+    return _capped(
+        case((c.is_lead == True, LEAD_POINTS), else_=0)
+        + _capped(total_visits * VISIT_POINTS, VISIT_CAP)
+        + _whole(_capped(total_time_spent, TIME_CAP))
+        + _capped(total_page_views, PAGE_VIEW_CAP)
+        + case((_has(c.email), EMAIL_POINTS), else_=0)
+        + case((_has(c.phone), PHONE_POINTS), else_=0)
+        + case((_has(c.name), NAME_POINTS), else_=0),
+        MAX_SCORE
+    )
+
+def previous_score(row, delta: dict) -> int:
+    """Score of an updated visitor row (counters and contact fields) before delta was added to it"""
+    return components(
+        row.is_lead,
+        (row.total_visits or 0) - delta["visits"],
+        # Rounded so float subtraction cannot drop a whole minute
+        round((row.total_time_spent or 0.0) - delta["time_spent"], 6),
+        (row.total_page_views or 0) - delta["page_views"],
+        row.email, row.phone, row.name
+    ).score
+
+def crossed(old_score: int, new_score: int, threshold: int = LEAD_SCORE_THRESHOLD) -> bool:
+    return old_score < threshold <= new_score
+
+def add_threshold_hook(hook: ThresholdHook) -> None:
+    _hooks.append(hook)
+
+def remove_threshold_hook(hook: ThresholdHook) -> None:
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+def _run_hooks(crossings: List[Tuple[int, int, int, int]]) -> None:
+    for visitor_pk, business_id, old_score, new_score in crossings:
+        logger.info("Visitor %d of business %d reached lead score %d (was %d)", visitor_pk, business_id, new_score, old_score)
+        for hook in list(_hooks):
+            try:
+                hook(visitor_pk, business_id, old_score, new_score)
+            except Exception:
+                logger.exception("Lead score threshold hook %r failed", hook)
+
+def _after_commit(session: Session) -> None:
+    _run_hooks(session.info.pop("lead_score_crossings", []))
+
+def _after_rollback(session: Session) -> None:
+    session.info.pop("lead_score_crossings", None)
+
+def notify_after_commit(db: Session, visitor_pk: int, business_id: int, old_score: int, new_score: int) -> None:
+    """
+    Queue the threshold hooks for a crossing, to run once the session commits
+    (a rolled back batch fires nothing). Non-crossings are ignored.
+    """
+    if not crossed(old_score, new_score):
+        return
+    if not db.info.get("lead_score_listening"):
+        event.listen(db, "after_commit", _after_commit)
+        event.listen(db, "after_rollback", _after_rollback)
+        db.info["lead_score_listening"] = True
+    db.info.setdefault("lead_score_crossings", []).append((visitor_pk, business_id, old_score, new_score))
@@ -0,0 +1,216 @@
+"""
+Approximate unique-visitor counts from per-business, per-day HyperLogLog sketches.
+
+Every ingested batch adds its visitors to the sketch of each (business, UTC
+day) they were active on; a date range is answered by merging the sketches of
+its days, which costs the same whatever the traffic. Adding a visitor twice
+is a no-op, so a batch retried after a failed flush does not inflate counts.
+
+Decoded sketches are cached in process, updated only once the batch that
+changed them commits; a range whose days are all cached is answered without
+touching the database. count_exact gives the exact figure from raw events
+for validation.
+
+Concurrent flushes serialize on the sketch row of each business-day they
+touch, like they do on its daily rollup rows, so write_events applies the
+sketches last, just before the commit.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import event, select, union, func
+from sqlalchemy.orm import Session
+from app.models.analytics import VisitorSketch
+from app.models.website_tracking import WebsiteVisitor
+from app.core.cache import LRUCache
+from app.core.hll import HyperLogLog, DEFAULT_PRECISION, relative_error
+from app.core import rollups, event_partitions
+
+SKETCH_PRECISION = int(os.getenv("VISITOR_SKETCH_PRECISION", str(DEFAULT_PRECISION)))
+DEFAULT_RANGE_DAYS = 30
+
+SketchKey = Tuple[int, datetime]  # (business_id, UTC day start)
+
+_sketches = VisitorSketch.__table__
+_visitors = WebsiteVisitor.__table__
+
+# (business_id, day) -> HyperLogLog, or None for a day without visitors
+_sketch_cache = LRUCache(
+    maxsize=int(os.getenv("VISITOR_SKETCH_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("VISITOR_SKETCH_CACHE_TTL", "60"))
+)
+
+def collect_visitors(rows: List[dict], deltas: Dict[int, dict]) -> Dict[SketchKey, Set[int]]:
+    """Visitor primary keys active on each (business, day) in a batch of event rows and visitor deltas"""
+    active: Dict[SketchKey, Set[int]] = {}
+    for visitor_pk, delta in deltas.items():
+        for seen_at in (delta["first_seen"], delta["last_visit"]):
+            if seen_at:
+                active.setdefault((delta["business_id"], rollups.bucket_start(seen_at, "day")), set()).add(visitor_pk)
+    for row in rows:
+        business_id = deltas[row["visitor_id"]]["business_id"]
+        active.setdefault((business_id, rollups.bucket_start(row["created_at"], "day")), set()).add(row["visitor_id"])
+    return active
+
+def _decode(registers: Optional[bytes], precision: int) -> Optional[HyperLogLog]:
+    return HyperLogLog.from_bytes(registers, precision) if registers else None
+
+def apply_sketches(db: Session, active: Dict[SketchKey, Set[int]]) -> None:
+    """
+    Add a batch's visitors to the stored day sketches; the caller commits.
+    Rows are created empty first and then read with FOR UPDATE in key order,
+    so concurrent flushes merge into the same row instead of overwriting it.
+    """
+    if not active:
+        return
+
+    keys = sorted(active)
+    updated = {}
+    dialect_insert = rollups._dialect_insert(db)
+    placeholders = [{"business_id": business_id, "day": day, "precision": SKETCH_PRECISION} for business_id, day in keys]
+    if dialect_insert is not None:
+        db.execute(dialect_insert(_sketches).on_conflict_do_nothing(index_elements=["business_id", "day"]), placeholders)
+
+    stored = {
+        (business_id, rollups.as_utc(day)): (sketch_id, precision, registers)
+        for sketch_id, business_id, day, precision, registers in db.execute(
+            select(_sketches.c.id, _sketches.c.business_id, _sketches.c.day, _sketches.c.precision, _sketches.c.registers).where(
+                _sketches.c.business_id.in_({business_id for business_id, _ in keys}),
+                _sketches.c.day.in_({day for _, day in keys})
+            ).order_by(_sketches.c.business_id, _sketches.c.day).with_for_update()
+        )
+    }
+
+    for key in keys:
+        existing = stored.get(key)
+        precision = existing[1] if existing else SKETCH_PRECISION
+        sketch = _decode(existing[2], precision) if existing else None
+        sketch = sketch or HyperLogLog(precision)
+        sketch.update(active[key])
+        if existing:
+            db.execute(_sketches.update().where(_sketches.c.id == existing[0]).values(registers=sketch.to_bytes()))
+        else:
+            # Dialects without ON CONFLICT
+            db.execute(_sketches.insert().values(business_id=key[0], day=key[1], precision=precision, registers=sketch.to_bytes()))
+        updated[key] = sketch
+
+    if not db.info.get("visitor_sketches_listening"):
+        event.listen(db, "after_commit", _after_commit)
+        event.listen(db, "after_rollback", _after_rollback)
+        db.info["visitor_sketches_listening"] = True
+    db.info.setdefault("visitor_sketches_pending", {}).update(updated)
+
+def _after_commit(session: Session) -> None:
+    for key, sketch in session.info.pop("visitor_sketches_pending", {}).items():
+        _sketch_cache.set(key, sketch)
+
+def _after_rollback(session: Session) -> None:
+    session.info.pop("visitor_sketches_pending", None)
+
+def day_range(start: datetime, end: datetime) -> List[datetime]:
+    """UTC day starts of the days overlapping [start, end)"""
+    day, end = rollups.bucket_start(start, "day"), rollups.as_utc(end)
+    days = []
+    while day < end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def load_sketches(db: Session, business_id: int, days: Iterable[datetime]) -> List[HyperLogLog]:
+    """Sketches of a business's days, from the cache where possible and one query for the rest"""
+    sketches, missing = [], []
+    for day in days:
+        cached = _sketch_cache.get((business_id, day), False)
+        if cached is False:
+            missing.append(day)
+        elif cached is not None:
+            sketches.append(cached)
+    if not missing:
+        return sketches
+
+    found = {}
+    rows = db.execute(
+        select(_sketches.c.day, _sketches.c.precision, _sketches.c.registers).where(
+            _sketches.c.business_id == business_id,
+            _sketches.c.day >= missing[0],
+            _sketches.c.day <= missing[-1]
+        )
+    )
+    for day, precision, registers in rows:
+        found[rollups.as_utc(day)] = _decode(registers, precision)
+    for day in missing:
+        sketch = found.get(day)
+        _sketch_cache.set((business_id, day), sketch)
+        if sketch is not None:
+            sketches.append(sketch)
+    return sketches
+
+def default_range(start: Optional[datetime], end: Optional[datetime]) -> Tuple[datetime, datetime]:
+    """[start, end) defaulting to the last DEFAULT_RANGE_DAYS days"""
+    end = rollups.as_utc(end) or rollups.bucket_start(datetime.utcnow(), "day") + timedelta(days=1)
+    start = rollups.as_utc(start) or end - timedelta(days=DEFAULT_RANGE_DAYS)
+    return start, end
+
+def count_approximate(db: Session, business_id: int, start: datetime, end: datetime) -> int:
+    """Estimated distinct visitors active on the days overlapping [start, end)"""
+    merged = None
+    for sketch in load_sketches(db, business_id, day_range(start, end)):
+        if merged is None:
+            merged = sketch.copy()
+        else:
+            merged.merge(sketch)
+    return merged.count() if merged is not None else 0
+
+def count_exact(db: Session, business_id: int, start: datetime, end: datetime) -> int:
+    """
+    Exact distinct visitors with an event, a first visit or a last visit on
+    the days overlapping [start, end), the activity the sketches record.
+    Pixel visits other than a visitor's first and latest are not stored, so
+    they cannot be counted. Scans the raw events; meant for validation.
+    """
+    days = day_range(start, end)
+    if not days:
+        return 0
+    start, end = days[0], days[-1] + timedelta(days=1)
+    events = event_partitions.events_table(db, start, end)
+    active = union(
+        select(events.c.visitor_id).select_from(
+            events.join(_visitors, events.c.visitor_id == _visitors.c.id)
+        ).where(
+            _visitors.c.business_id == business_id,
+            events.c.created_at >= start,
+            events.c.created_at < end
+        ),
+        *[
+            select(_visitors.c.id).where(
+                _visitors.c.business_id == business_id,
+                column >= start,
+                column < end
+            )
+            for column in (_visitors.c.first_visit, _visitors.c.last_visit)
+        ]
+    ).subquery()
+    return db.execute(select(func.count()).select_from(active)).scalar() or 0
+
+def unique_visitors(
+    db: Session,
+    business_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    exact: bool = False
+) -> dict:
+    """Distinct visitors over whole UTC days, from the sketches or (exact=True) from the raw events"""
+    start, end = default_range(start, end)
+    if exact:
+        return {"unique_visitors": count_exact(db, business_id, start, end), "mode": "exact", "relative_error": 0.0}
+    return {
+        "unique_visitors": count_approximate(db, business_id, start, end),
+        "mode": "approximate",
+        "relative_error": round(relative_error(SKETCH_PRECISION), 4)
+    }
+
+def cache_stats() -> dict:
+    return _sketch_cache.stats()
+
+def clear_cache() -> None:
+    _sketch_cache.clear()
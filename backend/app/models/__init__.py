@@ -1,7 +1,8 @@
 from .business import Business
 from .lead import Lead
 from .campaign import Campaign
-from .website_tracking import WebsiteVisitor, WebsiteEvent
+from .website_tracking import WebsiteVisitor, WebsiteEvent, VisitorSession
+from .analytics import AnalyticsRollup, VisitorSketch, LeadFeatures
 from .social_media import SocialMediaAccount, SocialMediaPost, AdCampaign
 from .ai_content import AIGeneratedContent, ContentAsset
 from .email_sms import EmailCampaign, SMSCampaign, EmailTemplate, SMSTemplate
@@ -13,6 +14,10 @@ __all__ = [
     "Campaign",
     "WebsiteVisitor",
     "WebsiteEvent",
+    "VisitorSession",
+    "AnalyticsRollup",
+    "VisitorSketch",
+    "LeadFeatures",
     "SocialMediaAccount",
     "SocialMediaPost", 
     "AdCampaign",
@@ -0,0 +1,74 @@
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Index, LargeBinary, UniqueConstraint
+from app.core.database import Base
+
+class AnalyticsRollup(Base):
+    """
+    Pre-aggregated tracking counters per business and time bucket.
+    Maintained incrementally by the ingestion path and rebuilt by backfill_rollups.py.
+    """
+    __tablename__ = "analytics_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    
+    # Bucket
+    granularity = Column(String(10), nullable=False)  # hour, day
+    bucket_start = Column(DateTime(timezone=True), nullable=False)  # UTC
+    
+    # Counter
+    metric = Column(String(50), nullable=False)  # page_views, events, unique_visitors, new_visitors, new_leads, sessions, bot_hits, throttled_events (dimension: reject reason or limit)
+    dimension = Column(String(500), nullable=False, default="")  # page URL for page_views, event type for events
+    value = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint("business_id", "granularity", "bucket_start", "metric", "dimension", name="uq_analytics_rollups_bucket"),
+    )
+
+class VisitorSketch(Base):
+    """
+    HyperLogLog sketch of the visitors seen by a business on one UTC day.
+    Sketches of any set of days merge into the sketch of their union (see app/core/hll.py).
+    """
+    __tablename__ = "visitor_sketches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    day = Column(DateTime(timezone=True), nullable=False)  # UTC day start
+    
+    # Sketch
+    precision = Column(Integer, nullable=False)
+    registers = Column(LargeBinary)  # zlib-compressed register bytes; NULL while empty
+    
+    __table_args__ = (
+        UniqueConstraint("business_id", "day", name="uq_visitor_sketches_day"),
+    )
+
+class LeadFeatures(Base):
+    """
+    Fixed-width numeric features of one visitor, for lead scoring and segmentation.
+    Maintained incrementally by the ingestion path (see app/core/lead_features.py).
+    """
+    __tablename__ = "lead_features"
+
+    visitor_id = Column(Integer, ForeignKey("website_visitors.id"), primary_key=True)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    
+    # Activity window, as UTC epoch seconds
+    first_seen_at = Column(Float)
+    last_seen_at = Column(Float)
+    
+    # Counters
+    visits = Column(Integer, nullable=False, default=0)
+    events = Column(Integer, nullable=False, default=0)
+    page_views = Column(Integer, nullable=False, default=0)
+    form_submits = Column(Integer, nullable=False, default=0)
+    pricing_page_views = Column(Integer, nullable=False, default=0)
+    sessions = Column(Integer, nullable=False, default=0)  # finished sessions
+    session_page_views = Column(Integer, nullable=False, default=0)  # page views of the finished sessions
+    
+    # First-touch traffic source, coded by lead_features.UTM_SOURCES (0 unknown)
+    utm_source_code = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ix_lead_features_business", business_id, visitor_id),
+    )
@@ -25,7 +25,7 @@ class SocialMediaAccount(Base):
     __tablename__ = "social_media_accounts"
 
     id = Column(Integer, primary_key=True, index=True)
-    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False, index=True)
     
     # Platform Information
     platform = Column(Enum(PlatformType), nullable=False)
@@ -61,7 +61,7 @@ class SocialMediaPost(Base):
     __tablename__ = "social_media_posts"
 
     id = Column(Integer, primary_key=True, index=True)
-    account_id = Column(Integer, ForeignKey("social_media_accounts.id"), nullable=False)
+    account_id = Column(Integer, ForeignKey("social_media_accounts.id"), nullable=False, index=True)
     
     # Post Content
     content = Column(Text)
@@ -98,7 +98,7 @@ class AdCampaign(Base):
     __tablename__ = "ad_campaigns"
 
     id = Column(Integer, primary_key=True, index=True)
-    account_id = Column(Integer, ForeignKey("social_media_accounts.id"), nullable=False)
+    account_id = Column(Integer, ForeignKey("social_media_accounts.id"), nullable=False, index=True)
     
     # Campaign Information
     name = Column(String(255), nullable=False)
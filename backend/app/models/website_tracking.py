@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, JSON, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, JSON, ForeignKey, Float, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -57,12 +57,27 @@ class WebsiteVisitor(Base):
     # Relationships
     business = relationship("Business", back_populates="website_visitors")
     events = relationship("WebsiteEvent", back_populates="visitor")
+    
+    __table_args__ = (
+        # Visitor lookups
+        Index("ix_website_visitors_business_visitor", business_id, visitor_id),
+        # Keyset-paginated visitor listings, newest activity first
+        Index("ix_website_visitors_business_last_visit", business_id, last_visit, id),
+        # Lead listings only touch the (small) converted subset
+        Index(
+            "ix_website_visitors_leads_last_visit", business_id, last_visit, id,
+            postgresql_where=(is_lead == True),
+            sqlite_where=(is_lead == True)
+        ),
+    )
 
 class WebsiteEvent(Base):
     __tablename__ = "website_events"
 
     id = Column(Integer, primary_key=True, index=True)
     visitor_id = Column(Integer, ForeignKey("website_visitors.id"), nullable=False)
+    session_id = Column(String(36), index=True)  # VisitorSession.session_id, assigned by the sessionizer
+    client_event_id = Column(String(64))  # Generated by the tracking script; used to drop retried events
     
     # Event Information
     event_type = Column(String(50))  # page_view, form_submit, button_click, download, etc.
@@ -80,4 +95,36 @@ class WebsiteEvent(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
-    visitor = relationship("WebsiteVisitor", back_populates="events") 
\ No newline at end of file
+    visitor = relationship("WebsiteVisitor", back_populates="events")
+    
+    __table_args__ = (
+        # Per-visitor event history, optionally narrowed to one event type and time range
+        Index("ix_website_events_visitor_type_created", visitor_id, event_type, created_at),
+        # Time-range scans (rollup backfill, exports)
+        Index("ix_website_events_created_at", created_at),
+    )
+
+class VisitorSession(Base):
+    """A finished visit: consecutive events of a visitor without a long pause"""
+    __tablename__ = "visitor_sessions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String(36), unique=True, nullable=False)
+    visitor_id = Column(Integer, ForeignKey("website_visitors.id"), nullable=False)
+    business_id = Column(Integer, ForeignKey("businesses.id"), nullable=False)
+    
+    # Timing
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    ended_at = Column(DateTime(timezone=True), nullable=False)
+    duration = Column(Float, default=0.0)  # in seconds, first to last event
+    
+    # Behavior
+    page_views = Column(Integer, default=0)
+    event_count = Column(Integer, default=0)
+    entry_page = Column(String(500))
+    exit_page = Column(String(500))
+    
+    __table_args__ = (
+        Index("ix_visitor_sessions_business_started", business_id, started_at),
+        Index("ix_visitor_sessions_visitor_started", visitor_id, started_at),
+    )
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Rebuild the analytics rollups from raw tracking data.
+
+The time range is processed in day-aligned chunks. For each chunk the
+existing rollups are deleted and recomputed from website_events and
+website_visitors in one transaction, so memory stays bounded by a single
+chunk and an interrupted run can be resumed with --start.
+
+Unique visitors are rebuilt from events only, since individual pixel hits
+are not stored. Run the backfill over closed periods: events ingested into
+a chunk while it is being rebuilt can be counted twice.
+
+Usage:
+    python backfill_rollups.py [--business-id 1] [--start 2024-01-01] [--end 2024-02-01] [--chunk-days 1]
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+
+# Add the app directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal
+from app.core import rollups, event_partitions
+from app.models import WebsiteVisitor
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def first_activity(db, business_id=None):
+    """Earliest event or visitor timestamp, used when --start is omitted"""
+    events = event_partitions.events_table(db)
+    visitors = WebsiteVisitor.__table__
+    candidates = []
+    for query in (
+        select(func.min(events.c.created_at)).select_from(events.join(visitors, events.c.visitor_id == visitors.c.id)),
+        select(func.min(visitors.c.created_at))
+    ):
+        if business_id:
+            query = query.where(visitors.c.business_id == business_id)
+        value = db.execute(query).scalar()
+        if value:
+            candidates.append(rollups.as_utc(value))
+    return min(candidates) if candidates else None
+
+def rebuild_chunk(db, start, end, business_id=None, batch_size=10000):
+    """Recompute every rollup with a bucket in [start, end); returns the number of events read"""
+    events = event_partitions.events_table(db, start, end)
+    event_count = rollups.rebuild_rollups(db, start, end, business_id, events, batch_size)
+    db.commit()
+    return event_count
+
+def backfill(business_id=None, start=None, end=None, chunk_days=1):
+    db = SessionLocal()
+    try:
+        start = start or first_activity(db, business_id)
+        if start is None:
+            print("No tracking data found, nothing to backfill.")
+            return
+
+        start = rollups.bucket_start(start, "day")
+        end = end or rollups.bucket_start(datetime.utcnow(), "day") + timedelta(days=1)
+        chunk = timedelta(days=chunk_days)
+
+        current = start
+        while current < end:
+            chunk_end = min(current + chunk, end)
+            event_count = rebuild_chunk(db, current, chunk_end, business_id)
+            print(f"  {current:%Y-%m-%d} -> {chunk_end:%Y-%m-%d}: {event_count} events")
+            current = chunk_end
+
+        print("✅ Rollups rebuilt")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild analytics rollups from raw tracking events")
+    parser.add_argument("--business-id", type=int, help="Only rebuild this business")
+    parser.add_argument("--start", type=parse_date, help="First day to rebuild (YYYY-MM-DD, default: earliest data)")
+    parser.add_argument("--end", type=parse_date, help="Day to stop before (YYYY-MM-DD, default: tomorrow)")
+    parser.add_argument("--chunk-days", type=int, default=1, help="Days processed per transaction")
+    args = parser.parse_args()
+
+    backfill(args.business_id, args.start, args.end, args.chunk_days)
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Load generator and throughput benchmark for the /api/tracking ingestion routes.
+
+Replays a deterministic stream of synthetic traffic: visitors drawn from a
+Zipf distribution (a few returning visitors account for much of the traffic,
+with a long tail of one-off ones), a weighted mix of pixel hits, single and
+batched events, sendBeacon flushes and lead captures, realistic browser
+User-Agents with a share of crawlers, and a small rate of client retries
+that reuse an event id.
+
+By default the app is driven in-process through httpx's ASGI transport
+against a scratch database, which also counts the SQL statements each
+request runs (and those of the write-behind flushes, reported per request
+on average). With --url the same traffic is sent to a running server; the
+businesses then have to exist there, either seeded into its database with
+--database-url or listed with --business-ids.
+
+In-process runs disable the tracking rate limits unless TRACKING_*_RATE is
+set in the environment, so that hot Zipf visitors are measured rather than
+throttled.
+
+Throughput, p50/p95/p99 latency and queries per request are reported overall
+and per route; --output saves them as a JSON baseline and --baseline fails
+the run on a slowdown or on more queries per request than the baseline.
+
+Usage:
+    python benchmarks/bench_ingestion.py [--requests 20000] [--concurrency 32] [--visitors 100000]
+    python benchmarks/bench_ingestion.py --output ingestion.json
+    python benchmarks/bench_ingestion.py --baseline ingestion.json
+    python benchmarks/bench_ingestion.py --url http://localhost:8000 --business-ids 1,2,3
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Dict, List, NamedTuple, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+# Rate limits are read at import time; measure hot visitors instead of throttling them
+os.environ.setdefault("TRACKING_BUSINESS_RATE", "0")
+os.environ.setdefault("TRACKING_VISITOR_RATE", "0")
+
+import httpx
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from app.core.database import Base, SessionLocal
+from app.core.event_buffer import event_buffer
+from app.core.user_agent import parse_user_agent
+from app.models import Business
+
+# (User-Agent, weight); roughly desktop/mobile browser share plus crawler traffic
+USER_AGENTS = [
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36", 30),
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1", 20),
+    ("Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36", 15),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15", 10),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36 Edg/124.0.0.0", 6),
+    ("Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0", 4),
+    ("Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1", 3),
+    ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", 4),
+    ("Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)", 2),
+    ("Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)", 2),
+    ("python-requests/2.31.0", 1),
+]
+PAGES = ["/", "/pricing", "/features", "/blog", "/blog/launch", "/about", "/contact", "/signup", "/docs", "/careers"]
+EVENT_TYPES = [("page_view", 55), ("element_click", 20), ("page_exit", 15), ("form_submit", 5), ("scroll", 5)]
+USER_AGENT_POOL = 4096
+DEFAULT_MIX = "pixel=40,event=20,events=20,beacon=15,lead=5"
+ROUTES = {
+    "pixel": ("GET", "/api/tracking/pixel/{business_id}"),
+    "event": ("POST", "/api/tracking/track-event"),
+    "events": ("POST", "/api/tracking/track-events"),
+    "beacon": ("POST", "/api/tracking/beacon"),
+    "lead": ("POST", "/api/tracking/capture-lead"),
+}
+
+# p95 latency slower than baseline * factor (and by more than the floor) counts as a regression
+SLOWDOWN_FACTOR = 2.0
+SLOWDOWN_FLOOR_MS = 5.0
+# Throughput below baseline / factor counts as a regression
+THROUGHPUT_FACTOR = 2.0
+# Queries per request beyond the baseline by more than this count as a regression
+QUERY_TOLERANCE = 0.25
+
+class PlannedRequest(NamedTuple):
+    route: str
+    method: str
+    path: str
+    events: int
+    headers: dict
+    json: Optional[dict] = None
+    content: Optional[bytes] = None
+
+class Result(NamedTuple):
+    route: str
+    status: int
+    latency_ms: float
+    queries: Optional[int]
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for entry in value.split(","):
+        route, weight = entry.split("=")
+        if route.strip() not in ROUTES:
+            raise SystemExit(f"Unknown route {route!r} in --mix; expected one of {', '.join(ROUTES)}")
+        mix[route.strip()] = float(weight)
+    return mix
+
+def zipf_weights(count: int, exponent: float) -> List[float]:
+    """Cumulative Zipf weights over ranks 1..count"""
+    return list(itertools.accumulate(1.0 / rank ** exponent for rank in range(1, count + 1)))
+
+def build_traffic(
+    business_ids: List[int],
+    requests: int,
+    visitors: int,
+    exponent: float,
+    mix: Dict[str, float],
+    retry_rate: float,
+    lead_delay: int,
+    seed: int = 42
+) -> List[PlannedRequest]:
+    """
+    Deterministic request stream. Visitor ranks are Zipf distributed and a
+    visitor's business follows from its rank, so busy businesses get busy
+    visitors. Lead captures go to human visitors first seen at least
+    lead_delay requests earlier, so that the visitor exists by the time they
+    are sent.
+    """
+    rng = random.Random(seed)
+    user_agents = [user_agent for user_agent, _ in USER_AGENTS]
+    user_agent_weights = [weight for _, weight in USER_AGENTS]
+    event_types = [event_type for event_type, _ in EVENT_TYPES]
+    event_type_weights = [weight for _, weight in EVENT_TYPES]
+    routes, route_weights = list(mix), list(mix.values())
+
+    ranks = rng.choices(range(visitors), cum_weights=zipf_weights(visitors, exponent), k=requests)
+    # A visitor keeps its User-Agent; visitors sharing a pool slot share one
+    agents = rng.choices(user_agents, weights=user_agent_weights, k=min(visitors, USER_AGENT_POOL))
+    first_seen: Dict[int, int] = {}
+    sent_events: List[dict] = []
+
+    def visitor(rank: int):
+        return business_ids[rank % len(business_ids)], f"bench-{rank}", agents[rank % len(agents)]
+
+    def tracking_event(rank: int) -> dict:
+        business_id, visitor_id, _ = visitor(rank)
+        if sent_events and rng.random() < retry_rate:
+            return dict(rng.choice(sent_events))
+        event_type = rng.choices(event_types, weights=event_type_weights)[0]
+        tracking = {
+            "business_id": business_id,
+            "visitor_id": visitor_id,
+            "event_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "event_type": event_type,
+            "page_url": f"https://example.com{rng.choice(PAGES)}",
+        }
+        if event_type == "page_exit":
+            tracking["duration"] = round(rng.expovariate(1 / 45), 1)
+        elif event_type == "element_click":
+            tracking["event_data"] = {"element": rng.choice(["button", "a", "input"]), "text": "Get started"}
+        sent_events.append(tracking)
+        if len(sent_events) > 1000:
+            sent_events.pop(0)
+        return tracking
+
+    traffic = []
+    for index, rank in enumerate(ranks):
+        business_id, visitor_id, user_agent = visitor(rank)
+        first_seen.setdefault(rank, index)
+        headers = {"user-agent": user_agent}
+        route = rng.choices(routes, weights=route_weights)[0]
+        # Crawlers do not fill in forms, and their hits never create the visitor
+        if route == "lead" and (index - first_seen[rank] < lead_delay or parse_user_agent(user_agent).is_bot):
+            route = "pixel"
+        method, path = ROUTES[route]
+
+        if route == "pixel":
+            headers["cookie"] = f"visitor_id={visitor_id}"
+            headers["referer"] = rng.choice(["https://www.google.com/", "https://t.co/", ""])
+            traffic.append(PlannedRequest(route, method, path.format(business_id=business_id), 1, headers))
+        elif route == "event":
+            traffic.append(PlannedRequest(route, method, path, 1, headers, json=tracking_event(rank)))
+        elif route in ("events", "beacon"):
+            batch = [tracking_event(rank) for _ in range(rng.randint(2, 12))]
+            if route == "events":
+                traffic.append(PlannedRequest(route, method, path, len(batch), headers, json={"events": batch}))
+            else:
+                # sendBeacon posts text/plain
+                headers["content-type"] = "text/plain;charset=UTF-8"
+                content = json.dumps({"events": batch}).encode()
+                traffic.append(PlannedRequest(route, method, path, len(batch), headers, content=content))
+        else:
+            lead = {"business_id": business_id, "visitor_id": visitor_id, "email": f"{visitor_id}@example.com"}
+            if rng.random() < 0.5:
+                lead["name"] = f"Visitor {rank}"
+            traffic.append(PlannedRequest(route, method, path, 0, headers, json=lead))
+    return traffic
+
+def seed_businesses(engine, count: int, drop: bool) -> List[int]:
+    if drop:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        businesses = [Business(name=f"Bench Business {n}", is_tracking_enabled=True) for n in range(count)]
+        db.add_all(businesses)
+        db.commit()
+        return [business.id for business in businesses]
+
+class QueryCounter:
+    """Counts SQL statements per request (via a context variable) and for the flush thread"""
+
+    def __init__(self, engine):
+        self.current: contextvars.ContextVar = contextvars.ContextVar("bench_queries", default=None)
+        self.background = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        counter = self.current.get()
+        if counter is None:
+            self.background += 1
+        else:
+            counter[0] += 1
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+def summarize(results: List[Result], elapsed: float, events: int) -> dict:
+    latencies = sorted(result.latency_ms for result in results)
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[str(result.status)] = statuses.get(str(result.status), 0) + 1
+    counted = [result.queries for result in results if result.queries is not None]
+    return {
+        "requests": len(results),
+        "events": events,
+        "requests_per_sec": round(len(results) / elapsed, 1) if elapsed else 0.0,
+        "events_per_sec": round(events / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+        "queries_per_request": round(sum(counted) / len(counted), 3) if counted else None,
+        "statuses": statuses
+    }
+
+async def drive(client: httpx.AsyncClient, traffic: List[PlannedRequest], concurrency: int, warmup: int, counter: Optional[QueryCounter]):
+    """Send the traffic with a fixed number of concurrent clients; returns the measured results and elapsed time"""
+
+    async def send(planned: PlannedRequest) -> Result:
+        queries = [0]
+        token = counter.current.set(queries) if counter else None
+        started = time.perf_counter()
+        try:
+            response = await client.request(
+                planned.method, planned.path, headers=planned.headers, json=planned.json, content=planned.content
+            )
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        latency_ms = (time.perf_counter() - started) * 1000
+        if counter:
+            counter.current.reset(token)
+        return Result(planned.route, status, latency_ms, queries[0] if counter else None)
+
+    # Warm-up requests fill the caches and are not measured
+    for planned in traffic[:warmup]:
+        await send(planned)
+    if counter:
+        counter.background = 0
+
+    results: List[Optional[Result]] = [None] * (len(traffic) - warmup)
+    pending = iter(range(warmup, len(traffic)))
+
+    async def worker():
+        for index in pending:
+            results[index - warmup] = await send(traffic[index])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+def report(traffic: List[PlannedRequest], results: List[Result], elapsed: float, warmup: int) -> dict:
+    measured = traffic[warmup:]
+    by_route = {}
+    for route in ROUTES:
+        route_results = [result for result in results if result.route == route]
+        if route_results:
+            events = sum(planned.events for planned in measured if planned.route == route)
+            by_route[route] = summarize(route_results, elapsed, events)
+    return {"overall": summarize(results, elapsed, sum(planned.events for planned in measured)), "routes": by_route}
+
+def run_in_process(engine, traffic: List[PlannedRequest], concurrency: int, warmup: int) -> dict:
+    # The app and every module-level session factory (event buffer, sessionizer, geoip) use the scratch database
+    SessionLocal.configure(bind=engine)
+    # main.py mounts ./uploads relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        from main import app
+    finally:
+        os.chdir(cwd)
+
+    counter = QueryCounter(engine)
+    transport = httpx.ASGITransport(app=app, client=("203.0.113.10", 50000))
+
+    async def main():
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await drive(client, traffic, concurrency, warmup, counter)
+
+    event_buffer.start()
+    try:
+        results, elapsed = asyncio.run(main())
+    finally:
+        flush_queries = counter.background
+        drain_started = time.perf_counter()
+        event_buffer.stop()
+        drain_ms = (time.perf_counter() - drain_started) * 1000
+
+    summary = report(traffic, results, elapsed, warmup)
+    # The write-behind flushes do most of the writing; charge them to the measured requests
+    summary["overall"]["flush_queries_per_request"] = round(counter.background / len(results), 3) if results else None
+    summary["buffer"] = {**event_buffer.stats(), "drain_ms": round(drain_ms, 3), "flush_queries_during_run": flush_queries}
+    return summary
+
+def run_remote(url: str, traffic: List[PlannedRequest], concurrency: int, warmup: int) -> dict:
+    async def main():
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+            return await drive(client, traffic, concurrency, warmup, None)
+
+    results, elapsed = asyncio.run(main())
+    return report(traffic, results, elapsed, warmup)
+
+def compare(results: dict, baseline: dict) -> list:
+    """Regressions against a baseline run: lower throughput, slower p95, or more queries per request"""
+    problems = []
+    previous = baseline["overall"]
+    current = results["overall"]
+    if current["requests_per_sec"] < previous["requests_per_sec"] / THROUGHPUT_FACTOR:
+        problems.append(f"throughput {current['requests_per_sec']:.0f} req/s vs baseline {previous['requests_per_sec']:.0f} req/s")
+    for name in ("queries_per_request", "flush_queries_per_request"):
+        if current.get(name) is not None and previous.get(name) is not None and current[name] > previous[name] + QUERY_TOLERANCE:
+            problems.append(f"overall: {name} {current[name]:.2f} vs baseline {previous[name]:.2f}")
+
+    for route, result in results["routes"].items():
+        previous = baseline["routes"].get(route)
+        if previous is None:
+            continue
+        limit = max(previous["p95_ms"] * SLOWDOWN_FACTOR, previous["p95_ms"] + SLOWDOWN_FLOOR_MS)
+        if result["p95_ms"] > limit:
+            problems.append(f"{route}: p95 {result['p95_ms']:.1f} ms vs baseline {previous['p95_ms']:.1f} ms")
+        if result["queries_per_request"] is not None and previous["queries_per_request"] is not None \
+                and result["queries_per_request"] > previous["queries_per_request"] + QUERY_TOLERANCE:
+            problems.append(
+                f"{route}: {result['queries_per_request']:.2f} queries per request vs baseline {previous['queries_per_request']:.2f}"
+            )
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of the app in-process")
+    parser.add_argument("--database-url", help="Database to seed businesses into; in-process runs default to "
+                        "sqlite:///bench_ingestion.db, which is dropped and recreated")
+    parser.add_argument("--business-ids", help="Comma separated existing businesses to send traffic to, instead of seeding")
+    parser.add_argument("--businesses", type=int, default=20)
+    parser.add_argument("--visitors", type=int, default=100000, help="Size of the visitor population")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of visitor popularity")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=500, help="Unmeasured requests sent first")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Route weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--retry-rate", type=float, default=0.01, help="Share of events resent with a previous event id")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Fail if throughput, latency or queries per request regressed against this JSON file")
+    args = parser.parse_args()
+
+    database_url = args.database_url or (None if args.url else "sqlite:///bench_ingestion.db")
+    engine = None
+    if database_url:
+        connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
+        engine = create_engine(database_url, connect_args=connect_args)
+
+    if args.business_ids:
+        business_ids = [int(business_id) for business_id in args.business_ids.split(",")]
+    elif engine is not None:
+        # Only a scratch in-process database is reset; a server's database just gets new businesses
+        business_ids = seed_businesses(engine, args.businesses, drop=not args.url)
+    else:
+        parser.error("--url needs --business-ids or a --database-url to seed businesses into")
+
+    traffic = build_traffic(
+        business_ids, args.requests + args.warmup, args.visitors, args.zipf,
+        parse_mix(args.mix), args.retry_rate, lead_delay=args.concurrency * 2, seed=args.seed
+    )
+    print(f"Sending {args.requests} requests ({sum(planned.events for planned in traffic[args.warmup:])} events) "
+          f"with {args.concurrency} concurrent clients to {args.url or 'the app in-process'}")
+
+    if args.url:
+        results = run_remote(args.url, traffic, args.concurrency, args.warmup)
+    else:
+        results = run_in_process(engine, traffic, args.concurrency, args.warmup)
+
+    header = f"{'route':<10} {'requests':>9} {'req/s':>9} {'events/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}"
+    print(header)
+    for name, result in [("overall", results["overall"]), *results["routes"].items()]:
+        queries = "-" if result["queries_per_request"] is None else f"{result['queries_per_request']:.2f}"
+        print(f"{name:<10} {result['requests']:>9} {result['requests_per_sec']:>9.1f} {result['events_per_sec']:>9.1f} "
+              f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {queries:>8}")
+        errors = {status: count for status, count in result["statuses"].items() if not status.startswith("2")}
+        if errors:
+            print(f"{'':<10} non-2xx responses: {errors}")
+    if "buffer" in results:
+        buffer = results["buffer"]
+        print(f"Flush queries per request: {results['overall']['flush_queries_per_request']}  "
+              f"flushes: {buffer['flushes']}  avg flush: {buffer['avg_flush_ms']:.1f} ms  drain: {buffer['drain_ms']:.1f} ms")
+
+    results["config"] = {
+        "target": "server" if args.url else "in-process",
+        "database": engine.dialect.name if engine is not None else None,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "visitors": args.visitors,
+        "zipf": args.zipf,
+        "mix": args.mix,
+        "retry_rate": args.retry_rate,
+        "seed": args.seed
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print("No throughput, latency or query count regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression benchmark for the tracking and social media hot paths.
+
+Seeds a realistic volume of businesses, visitors, events, rollups and social
+media rows into SQLite or Postgres, then records the EXPLAIN plan and the
+timing of each endpoint query. Plans that fall back to a full table scan are
+flagged, and a run can be compared with a saved baseline so that a dropped
+or unused index fails the check.
+
+Usage:
+    python benchmarks/bench_query_plans.py [--database-url sqlite:///bench.db] [--events 2000000]
+    python benchmarks/bench_query_plans.py --skip-seed --output plans.json
+    python benchmarks/bench_query_plans.py --skip-seed --baseline plans.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, text, func, tuple_
+from sqlalchemy.orm import Session
+from app.core.database import Base
+from app.core import rollups
+from app.models import (
+    Business, WebsiteVisitor, WebsiteEvent, AnalyticsRollup,
+    SocialMediaAccount, SocialMediaPost, AdCampaign
+)
+from app.models.social_media import PlatformType
+
+EVENT_TYPES = ["page_view", "page_view", "page_view", "element_click", "page_exit", "form_submit"]
+CHUNK_SIZE = 10000
+
+# Timings slower than baseline * factor (and by more than the floor) count as regressions
+SLOWDOWN_FACTOR = 3.0
+SLOWDOWN_FLOOR_MS = 5.0
+
+def chunked_insert(db: Session, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK_SIZE:
+            db.execute(insert(table), batch)
+            batch = []
+    if batch:
+        db.execute(insert(table), batch)
+
+def seed(db: Session, businesses: int, visitors: int, events: int, lead_ratio: float, days: int, seed_value: int = 42):
+    """Insert synthetic tracking, rollup and social media data"""
+    rng = random.Random(seed_value)
+    now = datetime.utcnow().replace(microsecond=0)
+    pages = [f"https://example.com/page-{n}" for n in range(25)]
+
+    db.execute(insert(Business.__table__), [
+        {"id": business_id, "name": f"Benchmark business {business_id}", "is_tracking_enabled": True}
+        for business_id in range(1, businesses + 1)
+    ])
+
+    # Zipf-like traffic: a few businesses get most visitors
+    business_weights = [1.0 / rank for rank in range(1, businesses + 1)]
+    visitor_business = rng.choices(range(1, businesses + 1), weights=business_weights, k=visitors)
+    visitor_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(visitors)]
+    visitor_created = [now - timedelta(seconds=rng.randrange(days * 86400)) for _ in range(visitors)]
+
+    def visitor_rows():
+        for index in range(visitors):
+            first_visit = visitor_created[index]
+            is_lead = rng.random() < lead_ratio
+            yield {
+                "id": index + 1,
+                "business_id": visitor_business[index],
+                "visitor_id": visitor_ids[index],
+                "first_visit": first_visit,
+                "last_visit": first_visit + timedelta(seconds=rng.randrange(86400)),
+                "created_at": first_visit,
+                "total_visits": 1,
+                "total_page_views": 0,
+                "total_time_spent": 0.0,
+                "is_lead": is_lead,
+                "lead_converted_at": first_visit if is_lead else None,
+                "lead_score": rng.randrange(100) if is_lead else 0
+            }
+
+    chunked_insert(db, WebsiteVisitor.__table__, visitor_rows())
+
+    deltas = rollups.RollupDeltas()
+
+    def event_rows():
+        for _ in range(events):
+            visitor_index = rng.randrange(visitors)
+            event_type = rng.choice(EVENT_TYPES)
+            page_url = rng.choice(pages)
+            created_at = now - timedelta(seconds=rng.randrange(days * 86400))
+            business_id = visitor_business[visitor_index]
+            deltas.add(business_id, "events", created_at, event_type)
+            if event_type == "page_view":
+                deltas.add(business_id, "page_views", created_at, page_url)
+            yield {
+                "visitor_id": visitor_index + 1,
+                "event_type": event_type,
+                "page_url": page_url,
+                "page_title": "Benchmark page",
+                "duration": rng.random() * 120 if event_type == "page_exit" else None,
+                "created_at": created_at
+            }
+
+    chunked_insert(db, WebsiteEvent.__table__, event_rows())
+
+    for index in range(visitors):
+        deltas.add(visitor_business[index], "new_visitors", visitor_created[index])
+    rollups.apply_rollups(db, deltas)
+
+    accounts = businesses * 3
+    db.execute(insert(SocialMediaAccount.__table__), [
+        {
+            "id": account_id,
+            "business_id": (account_id - 1) // 3 + 1,
+            "platform": list(PlatformType)[account_id % len(PlatformType)],
+            "account_name": f"account-{account_id}"
+        }
+        for account_id in range(1, accounts + 1)
+    ])
+    chunked_insert(db, SocialMediaPost.__table__, (
+        {"account_id": rng.randrange(1, accounts + 1), "content": "Benchmark post", "is_published": True}
+        for _ in range(accounts * 200)
+    ))
+    chunked_insert(db, AdCampaign.__table__, (
+        {"account_id": rng.randrange(1, accounts + 1), "name": "Benchmark campaign"}
+        for _ in range(accounts * 20)
+    ))
+    db.commit()
+
+def sample_keys(db: Session) -> dict:
+    """Representative parameters for the queries, taken from the seeded data"""
+    business_id = db.query(WebsiteVisitor.business_id).group_by(WebsiteVisitor.business_id).order_by(
+        func.count().desc()
+    ).limit(1).scalar()
+    visitor = db.query(WebsiteVisitor.id, WebsiteVisitor.visitor_id).filter(
+        WebsiteVisitor.business_id == business_id
+    ).order_by(WebsiteVisitor.id).limit(1).first()
+    batch_visitor_ids = [row[0] for row in db.query(WebsiteVisitor.visitor_id).filter(
+        WebsiteVisitor.business_id == business_id
+    ).limit(50)]
+    account_id = db.query(SocialMediaAccount.id).filter(SocialMediaAccount.business_id == business_id).limit(1).scalar()
+    deep_cursor = db.query(WebsiteVisitor.last_visit, WebsiteVisitor.id).filter(
+        WebsiteVisitor.business_id == business_id,
+        WebsiteVisitor.last_visit.isnot(None)
+    ).order_by(WebsiteVisitor.last_visit.desc(), WebsiteVisitor.id.desc()).offset(1000).limit(1).first()
+    latest = db.query(func.max(WebsiteEvent.created_at)).scalar()
+    return {
+        "business_id": business_id,
+        "visitor_pk": visitor.id,
+        "visitor_id": visitor.visitor_id,
+        "batch_visitor_ids": batch_visitor_ids,
+        "deep_cursor": tuple(deep_cursor) if deep_cursor else None,
+        "account_id": account_id,
+        "range_end": rollups.as_utc(latest) if latest else datetime.utcnow()
+    }
+
+def listing_page(query, after=None, limit: int = 100):
+    """First keyset phase of the visitor listings (see app.core.pagination)"""
+    query = query.filter(WebsiteVisitor.last_visit.isnot(None))
+    if after is not None:
+        query = query.filter(tuple_(WebsiteVisitor.last_visit, WebsiteVisitor.id) < tuple_(*after))
+    return query.order_by(WebsiteVisitor.last_visit.desc(), WebsiteVisitor.id.desc()).limit(limit)
+
+def build_queries(db: Session, keys: dict) -> dict:
+    """The endpoint queries, keyed by name, as SQLAlchemy statements"""
+    business_id = keys["business_id"]
+    range_end = keys["range_end"]
+    range_start = range_end - timedelta(days=7)
+
+    return {
+        # tracking_store.resolve_visitors: pixel, track-event, beacon
+        "resolve_visitors": db.query(
+            WebsiteVisitor.id, WebsiteVisitor.business_id, WebsiteVisitor.visitor_id
+        ).filter(WebsiteVisitor.visitor_id.in_(keys["batch_visitor_ids"])),
+        "resolve_visitor_in_business": db.query(WebsiteVisitor.id).filter(
+            WebsiteVisitor.business_id == business_id,
+            WebsiteVisitor.visitor_id == keys["visitor_id"]
+        ),
+        # GET /leads/{business_id}, first page
+        "leads_page": listing_page(db.query(WebsiteVisitor).filter(
+            WebsiteVisitor.business_id == business_id,
+            WebsiteVisitor.is_lead == True
+        )),
+        # GET /visitors/{business_id}, first page and a page deep into the listing
+        "visitors_page": listing_page(db.query(WebsiteVisitor).filter(
+            WebsiteVisitor.business_id == business_id
+        )),
+        "visitors_deep_page": listing_page(db.query(WebsiteVisitor).filter(
+            WebsiteVisitor.business_id == business_id
+        ), keys["deep_cursor"]),
+        # Per-visitor event history (lead scoring, visitor detail)
+        "visitor_page_views": db.query(WebsiteEvent).filter(
+            WebsiteEvent.visitor_id == keys["visitor_pk"],
+            WebsiteEvent.event_type == "page_view",
+            WebsiteEvent.created_at >= range_start
+        ),
+        # backfill_rollups.rebuild_chunk
+        "events_in_range": db.query(
+            WebsiteVisitor.business_id, WebsiteEvent.visitor_id, WebsiteEvent.event_type, WebsiteEvent.created_at
+        ).join(
+            WebsiteVisitor, WebsiteEvent.visitor_id == WebsiteVisitor.id
+        ).filter(
+            WebsiteEvent.created_at >= range_end - timedelta(hours=1),
+            WebsiteEvent.created_at < range_end
+        ),
+        # GET /analytics/{business_id}
+        "analytics_metric_total": rollups.rollup_query(db, business_id, "day", range_start, range_end).filter(
+            AnalyticsRollup.metric == "page_views"
+        ).with_entities(func.coalesce(func.sum(AnalyticsRollup.value), 0)),
+        "analytics_top_pages": rollups.rollup_query(db, business_id, "day", range_start, range_end).filter(
+            AnalyticsRollup.metric == "page_views"
+        ).with_entities(
+            AnalyticsRollup.dimension, func.sum(AnalyticsRollup.value)
+        ).group_by(AnalyticsRollup.dimension).order_by(func.sum(AnalyticsRollup.value).desc()).limit(10),
+        # GET /analytics/{business_id}/timeseries
+        "analytics_timeseries": rollups.rollup_query(db, business_id, "hour", range_start, range_end).with_entities(
+            AnalyticsRollup.bucket_start, AnalyticsRollup.metric, func.sum(AnalyticsRollup.value)
+        ).group_by(AnalyticsRollup.bucket_start, AnalyticsRollup.metric),
+        # Social media analytics
+        "social_accounts_by_business": db.query(SocialMediaAccount).filter(
+            SocialMediaAccount.business_id == business_id
+        ),
+        "social_posts_by_account": db.query(SocialMediaPost).filter(
+            SocialMediaPost.account_id == keys["account_id"]
+        ),
+        "ad_campaigns_by_account": db.query(AdCampaign).filter(
+            AdCampaign.account_id == keys["account_id"]
+        ),
+    }
+
+def explain(db: Session, query) -> list:
+    """Plan lines for a query on the session's dialect"""
+    dialect = db.get_bind().dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    if dialect.name == "sqlite":
+        return [row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    return [row[0] for row in db.execute(text(f"EXPLAIN {sql}"))]
+
+def full_scans(plan: list) -> list:
+    """Plan lines that read a whole table instead of using an index"""
+    scans = []
+    for line in plan:
+        stripped = line.strip()
+        if "Seq Scan" in stripped:
+            scans.append(stripped)
+        elif stripped.startswith("SCAN ") and " USING " not in stripped:
+            scans.append(stripped)
+    return scans
+
+_INDEX_NAME = re.compile(r"(?:USING (?:COVERING )?INDEX|Index (?:Only )?Scan using|Bitmap Index Scan on) (\w+)")
+
+def indexes_used(plan: list) -> list:
+    return sorted({match for line in plan for match in _INDEX_NAME.findall(line)})
+
+def time_query(query, repeat: int) -> dict:
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(query.all())
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "rows": rows,
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3)
+    }
+
+def run(db: Session, repeat: int) -> dict:
+    keys = sample_keys(db)
+    results = {}
+    for name, query in build_queries(db, keys).items():
+        plan = explain(db, query)
+        results[name] = {
+            "plan": plan,
+            "indexes": indexes_used(plan),
+            "full_scans": full_scans(plan),
+            **time_query(query, repeat)
+        }
+        db.expunge_all()
+    return results
+
+def compare(results: dict, baseline: dict) -> list:
+    """Regressions against a baseline run: new full scans, indexes no longer used, or large slowdowns"""
+    problems = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        new_scans = set(result["full_scans"]) - set(previous["full_scans"])
+        if new_scans:
+            problems.append(f"{name}: now scans {', '.join(sorted(new_scans))}")
+        lost_indexes = set(previous.get("indexes", [])) - set(result["indexes"])
+        if lost_indexes:
+            problems.append(f"{name}: no longer uses {', '.join(sorted(lost_indexes))}")
+        limit = max(previous["median_ms"] * SLOWDOWN_FACTOR, previous["median_ms"] + SLOWDOWN_FLOOR_MS)
+        if result["median_ms"] > limit:
+            problems.append(f"{name}: median {result['median_ms']:.1f} ms vs baseline {previous['median_ms']:.1f} ms")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///bench_query_plans.db",
+                        help="Scratch database; it is dropped and reseeded unless --skip-seed is given")
+    parser.add_argument("--businesses", type=int, default=50)
+    parser.add_argument("--visitors", type=int, default=200000)
+    parser.add_argument("--events", type=int, default=2000000)
+    parser.add_argument("--lead-ratio", type=float, default=0.05)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in the database")
+    parser.add_argument("--output", help="Write the plans and timings to this JSON file")
+    parser.add_argument("--baseline", help="Fail if plans or timings regressed against this JSON file")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+
+    if not args.skip_seed:
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        started = time.perf_counter()
+        with Session(engine) as db:
+            seed(db, args.businesses, args.visitors, args.events, args.lead_ratio, args.days)
+        with engine.connect() as connection:
+            connection.execute(text("ANALYZE"))
+            connection.commit()
+        print(f"Seeded {args.visitors} visitors and {args.events} events in {time.perf_counter() - started:.1f}s")
+
+    with Session(engine) as db:
+        results = run(db, args.repeat)
+
+    for name, result in results.items():
+        flag = "  FULL SCAN" if result["full_scans"] else ""
+        print(f"{name:<30} {result['median_ms']:10.3f} ms  {result['rows']:>8} rows{flag}")
+        for line in result["plan"]:
+            print(f"    {line}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"database": engine.dialect.name, "queries": results}, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["queries"]
+        problems = compare(results, baseline)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print("No plan or timing regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
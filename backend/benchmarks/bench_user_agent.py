@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for memoized user-agent parsing.
+
+Replays a Zipf-distributed stream of User-Agent headers through the raw
+user_agents parser and through app.core.user_agent.parse_user_agent and
+reports the per-request cost of each.
+
+Usage:
+    python benchmarks/bench_user_agent.py [--requests 20000] [--distinct 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import user_agents
+from app.core.user_agent import parse_user_agent, get_device_type, cache_stats, clear_cache
+
+BASE_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.{v} Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_{v} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "Mozilla/5.0 (iPad; CPU OS 16_{v} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html) v{v}",
+]
+
+def build_traffic(requests: int, distinct: int, seed: int = 42) -> list:
+    """Zipf-like traffic: a few UA strings account for most requests"""
+    pool = [BASE_USER_AGENTS[i % len(BASE_USER_AGENTS)].format(v=100 + i) for i in range(distinct)]
+    weights = [1.0 / (rank + 1) for rank in range(distinct)]
+    return random.Random(seed).choices(pool, weights=weights, k=requests)
+
+def parse_uncached(user_agent_string: str) -> tuple:
+    user_agent = user_agents.parse(user_agent_string)
+    return (get_device_type(user_agent), user_agent.browser.family, user_agent.os.family, user_agent.is_bot)
+
+def run(label: str, func, traffic: list) -> float:
+    started = time.perf_counter()
+    for user_agent_string in traffic:
+        func(user_agent_string)
+    elapsed = time.perf_counter() - started
+    per_request_us = elapsed / len(traffic) * 1e6
+    print(f"{label:<10} {elapsed:8.3f}s total  {per_request_us:10.2f} us/request")
+    return per_request_us
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--distinct", type=int, default=200)
+    args = parser.parse_args()
+
+    traffic = build_traffic(args.requests, args.distinct)
+    print(f"{args.requests} requests, {args.distinct} distinct user agents")
+
+    clear_cache()
+    uncached = run("uncached", parse_uncached, traffic)
+    memoized = run("memoized", parse_user_agent, traffic)
+
+    stats = cache_stats()
+    print(f"hit ratio {stats['hit_ratio']:.2%}, saving {uncached - memoized:.2f} us/request ({uncached / memoized:.0f}x)")
+
+if __name__ == "__main__":
+    main()
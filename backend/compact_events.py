@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Retention job for raw website events.
+
+Creates the upcoming monthly partitions (Postgres), moves closed months out
+of the hot website_events table into monthly tables (SQLite), then compacts
+every month older than the retention period: business-days missing from the
+daily rollups are rebuilt from the raw events, and the month's partition is
+dropped. Raw events in an unpartitioned table (or in the DEFAULT partition)
+are deleted in batches.
+
+--partition-existing converts an unpartitioned Postgres website_events
+first (see event_partitions.partition_existing_events_table); it validates
+every existing row, so run it once, in a maintenance window.
+
+Run it daily, e.g. from cron.
+
+Usage:
+    python compact_events.py [--retention-days 400] [--batch-size 10000] [--months-ahead 3] [--partition-existing]
+"""
+
+import argparse
+import os
+import sys
+
+# Add the app directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal, engine
+from app.core import event_partitions
+
+DEFAULT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "400"))
+
+def compact(retention_days=DEFAULT_RETENTION_DAYS, batch_size=event_partitions.DEFAULT_BATCH_SIZE, months_ahead=3, partition_existing=False):
+    if partition_existing and event_partitions.partition_existing_events_table(engine):
+        print(f"{event_partitions.EVENTS_TABLE} is now partitioned; existing rows are in {event_partitions.LEGACY_TABLE}")
+
+    created = event_partitions.ensure_partitions(engine, months_ahead)
+    if created:
+        print(f"Partitions ready: {', '.join(created)}")
+
+    db = SessionLocal()
+    try:
+        summary = event_partitions.compact_expired(db, retention_days, batch_size)
+    finally:
+        db.close()
+
+    print(f"  moved to monthly tables: {summary['moved']} events")
+    print(f"  business-days summarized: {summary['rebuilt_days']}")
+    print(f"  dropped: {', '.join(summary['dropped']) or 'nothing'}")
+    print(f"  deleted from website_events: {summary['deleted']} events")
+    print("✅ Event retention complete")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact and drop raw website events past the retention period")
+    parser.add_argument("--retention-days", type=int, default=DEFAULT_RETENTION_DAYS, help="Days of raw events to keep")
+    parser.add_argument("--batch-size", type=int, default=event_partitions.DEFAULT_BATCH_SIZE, help="Rows moved or deleted per transaction")
+    parser.add_argument("--months-ahead", type=int, default=3, help="Future monthly partitions to create (Postgres)")
+    parser.add_argument("--partition-existing", action="store_true", help="Convert an unpartitioned website_events first (Postgres)")
+    args = parser.parse_args()
+
+    compact(args.retention_days, args.batch_size, args.months_ahead, args.partition_existing)
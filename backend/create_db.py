@@ -13,8 +13,9 @@ from sqlalchemy.exc import OperationalError
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app.core.database import Base, DATABASE_URL
+from app.core import event_partitions
 from app.models import (
-    Business, Lead, Campaign, WebsiteVisitor, WebsiteEvent,
+    Business, Lead, Campaign, WebsiteVisitor, WebsiteEvent, VisitorSession, AnalyticsRollup, VisitorSketch, LeadFeatures,
     SocialMediaAccount, SocialMediaPost, AdCampaign,
     AIGeneratedContent, ContentAsset,
     EmailTemplate, SMSTemplate, EmailCampaign, SMSCampaign,
@@ -29,8 +30,16 @@ def create_database():
         
         # Create all tables
         print("Creating database tables...")
+        # On Postgres website_events is created partitioned by month first; create_all then skips it
+        if event_partitions.create_partitioned_events_table(engine):
+            print("  website_events is partitioned by month")
         Base.metadata.create_all(bind=engine)
         
+        # create_all skips tables that already exist, so add any indexes they are missing
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        
         print("✅ Database tables created successfully!")
         print("\nCreated tables:")
         for table_name in Base.metadata.tables.keys():
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Export a business's raw website events to CSV or Parquet files.
+
+The time range is split into chunks (one day by default) and each chunk is
+written to its own file, e.g. events_1_2024-01-01.parquet. Files are written
+under a .part name and renamed when complete, so re-running the same command
+after an interruption skips the finished chunks and resumes where it stopped.
+
+Usage:
+    python export_events.py --business-id 1 --start 2024-01-01 [--end 2024-02-01] [--format parquet] [--output-dir exports]
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add the app directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal
+from app.core import event_export
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def export_chunk(db, business_id, export_format, start, end, path, chunk_size):
+    """Write one time range to path; returns the number of bytes written"""
+    partial_path = path + ".part"
+    size = 0
+    with open(partial_path, "wb") as f:
+        for data in event_export.export_stream(db, business_id, export_format, start, end, chunk_size):
+            f.write(data)
+            size += len(data)
+    os.replace(partial_path, path)
+    return size
+
+def export(business_id, start, end=None, export_format="csv", output_dir="exports", chunk_days=1, chunk_size=event_export.DEFAULT_CHUNK_SIZE):
+    if export_format == "parquet" and not event_export.PYARROW_AVAILABLE:
+        print("❌ Parquet export requires pyarrow (pip install pyarrow)")
+        sys.exit(1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    end = end or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    chunk = timedelta(days=chunk_days)
+
+    db = SessionLocal()
+    try:
+        current = start
+        while current < end:
+            chunk_end = min(current + chunk, end)
+            path = os.path.join(output_dir, f"events_{business_id}_{current:%Y-%m-%d}.{export_format}")
+            if os.path.exists(path):
+                print(f"  {current:%Y-%m-%d}: already exported, skipping")
+            else:
+                size = export_chunk(db, business_id, export_format, current, chunk_end, path, chunk_size)
+                db.rollback()  # Release the snapshot between chunks
+                print(f"  {current:%Y-%m-%d} -> {chunk_end:%Y-%m-%d}: {size} bytes")
+            current = chunk_end
+
+        print(f"✅ Events exported to {output_dir}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export raw website events to CSV or Parquet")
+    parser.add_argument("--business-id", type=int, required=True, help="Business to export")
+    parser.add_argument("--start", type=parse_date, required=True, help="First day to export (YYYY-MM-DD)")
+    parser.add_argument("--end", type=parse_date, help="Day to stop before (YYYY-MM-DD, default: tomorrow)")
+    parser.add_argument("--format", choices=event_export.EXPORT_FORMATS, default="csv")
+    parser.add_argument("--output-dir", default="exports")
+    parser.add_argument("--chunk-days", type=int, default=1, help="Days written per file")
+    parser.add_argument("--chunk-size", type=int, default=event_export.DEFAULT_CHUNK_SIZE, help="Rows per fetch and per Parquet row group")
+    args = parser.parse_args()
+
+    export(args.business_id, args.start, args.end, args.format, args.output_dir, args.chunk_days, args.chunk_size)
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy.orm import Session
 from typing import List, Optional
 import uvicorn
 
@@ -28,6 +29,12 @@ from app.api import (
 )
 from app.api.website_tracking import router as website_tracking_router
 from app.api.ai_content import router as ai_content_router
+from app.core.database import get_db
+from app.core.event_buffer import event_buffer
+from app.core.sessionizer import recover_sessions
+from app.core.event_dedup import warm_deduplicator
+from app.core.tracking_cache import get_tracking_config
+from app.core.tracking_script import get_compiled_script, SCRIPT_MAX_AGE
 
 # Include routers
 app.include_router(lead_scoring.router, prefix="/api/leads", tags=["Lead Scoring"])
@@ -38,172 +45,71 @@ app.include_router(social_media.router, prefix="/api/social", tags=["Social Medi
 app.include_router(website_tracking_router, prefix="/api/tracking", tags=["Website Tracking"])
 app.include_router(ai_content_router, prefix="/api/ai", tags=["AI Content Generation"])
 
+@app.on_event("startup")
+async def start_tracking_buffer():
+    # Pick up sessions that were still open when the process last stopped
+    recover_sessions()
+    # Recent event ids, so retries that straddle a restart are still dropped
+    warm_deduplicator()
+    event_buffer.start()
+
+@app.on_event("shutdown")
+async def flush_tracking_buffer():
+    # Write out any tracking events still queued before the process exits
+    event_buffer.stop()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to AI Marketing Automation Platform"}
 
-@app.get("/tracking-script/{business_id}")
-async def get_tracking_script(business_id: int):
-    """Serve the JavaScript tracking script for businesses to embed on their websites"""
-    
-    script = f"""
-(function() {{
-    var businessId = {business_id};
-    var apiUrl = 'http://localhost:8000/api/tracking';
-    
-    // Generate or get visitor ID
-    var visitorId = getCookie('visitor_id') || generateUUID();
-    setCookie('visitor_id', visitorId, 365);
-    
-    // Load tracking pixel
-    var img = new Image();
-    img.src = apiUrl + '/pixel/' + businessId;
-    
-    // Track page view
-    trackEvent('page_view', {{
-        url: window.location.href,
-        title: document.title,
-        referrer: document.referrer
-    }});
-    
-    // Track time on page
-    var startTime = Date.now();
-    window.addEventListener('beforeunload', function() {{
-        var timeSpent = (Date.now() - startTime) / 1000;
-        trackEvent('page_exit', {{
-            url: window.location.href,
-            duration: timeSpent
-        }});
-    }});
-    
-    // Track form submissions
-    document.addEventListener('submit', function(e) {{
-        var form = e.target;
-        var formData = new FormData(form);
-        var fields = {{}};
-        
-        for (var pair of formData.entries()) {{
-            fields[pair[0]] = pair[1];
-        }}
-        
-        // Check if email or phone is captured
-        var email = fields.email || fields.Email || fields.EMAIL;
-        var phone = fields.phone || fields.Phone || fields.PHONE || fields.tel;
-        var name = fields.name || fields.Name || fields.NAME || fields.full_name;
-        
-        if (email || phone) {{
-            // This is a lead capture
-            captureLeadData({{
-                email: email,
-                phone: phone,
-                name: name,
-                form_fields: fields
-            }});
-        }}
-        
-        trackEvent('form_submit', {{
-            url: window.location.href,
-            form_fields: fields
-        }});
-    }});
+@app.get("/tracking-script/{business_id}.js")
+async def get_tracking_script_js(
+    business_id: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Serve the minified tracking script as cacheable JavaScript.
+    Pre-compressed bodies, strong ETags and 304s keep repeat page loads off the origin.
+    """
+    if not get_tracking_config(db, business_id)["enabled"]:
+        raise HTTPException(status_code=404, detail="Tracking not found")
     
-    // Track clicks on important elements
-    document.addEventListener('click', function(e) {{
-        var element = e.target;
-        var tagName = element.tagName.toLowerCase();
-        
-        if (tagName === 'a' || tagName === 'button' || element.getAttribute('data-track')) {{
-            trackEvent('element_click', {{
-                url: window.location.href,
-                element_type: tagName,
-                element_text: element.textContent.trim(),
-                element_id: element.id,
-                element_class: element.className
-            }});
-        }}
-    }});
-    
-    function trackEvent(eventType, eventData) {{
-        fetch(apiUrl + '/track-event', {{
-            method: 'POST',
-            headers: {{
-                'Content-Type': 'application/json'
-            }},
-            body: JSON.stringify({{
-                business_id: businessId,
-                visitor_id: visitorId,
-                event_type: eventType,
-                page_url: window.location.href,
-                page_title: document.title,
-                event_data: eventData
-            }})
-        }}).catch(function(error) {{
-            console.log('Tracking error:', error);
-        }});
-    }}
-    
-    function captureLeadData(leadData) {{
-        fetch(apiUrl + '/capture-lead', {{
-            method: 'POST',
-            headers: {{
-                'Content-Type': 'application/json'
-            }},
-            body: JSON.stringify({{
-                business_id: businessId,
-                visitor_id: visitorId,
-                email: leadData.email,
-                phone: leadData.phone,
-                name: leadData.name,
-                form_fields: leadData.form_fields
-            }})
-        }}).catch(function(error) {{
-            console.log('Lead capture error:', error);
-        }});
-    }}
-    
-    function generateUUID() {{
-        return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {{
-            var r = Math.random() * 16 | 0, v = c == 'x' ? r : (r & 0x3 | 0x8);
-            return v.toString(16);
-        }});
-    }}
+    script = get_compiled_script(business_id)
+    encoding = script.negotiate(request.headers.get("accept-encoding", ""))
+    headers = {
+        "ETag": script.etags[encoding],
+        "Cache-Control": f"public, max-age={SCRIPT_MAX_AGE}",
+        "Vary": "Accept-Encoding"
+    }
     
-    function getCookie(name) {{
-        var value = "; " + document.cookie;
-        var parts = value.split("; " + name + "=");
-        if (parts.length == 2) return parts.pop().split(";").shift();
-    }}
+    if script.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
     
-    function setCookie(name, value, days) {{
-        var expires = "";
-        if (days) {{
-            var date = new Date();
-            date.setTime(date.getTime() + (days * 24 * 60 * 60 * 1000));
-            expires = "; expires=" + date.toUTCString();
-        }}
-        document.cookie = name + "=" + (value || "") + expires + "; path=/";
-    }}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=script.encodings[encoding], media_type="application/javascript", headers=headers)
+
+@app.get("/tracking-script/{business_id}")
+async def get_tracking_script(business_id: int):
+    """Serve the JavaScript tracking script for businesses to embed on their websites"""
     
-    // Expose lead capture function globally for manual use
-    window.captureLeadData = captureLeadData;
-    window.trackEvent = trackEvent;
-}})();
-"""
+    script = get_compiled_script(business_id).source
     
     return {
         "script": script,
         "instructions": f"""
 To install this tracking script on your website:
 
-1. Copy the script below and paste it before the closing </body> tag on every page:
+1. Include it as an external script before the closing </body> tag on every page (recommended, cached by browsers):
+<script src="http://localhost:8000/tracking-script/{business_id}.js" async></script>
+
+2. Alternative: Copy the script below and paste it inline:
 
 <script>
 {script}
 </script>
 
-2. Alternative: Include it as an external script:
-<script src="http://localhost:8000/tracking-script/{business_id}"></script>
-
 Features:
 - Automatic visitor tracking and lead scoring
 - Form submission monitoring and lead capture
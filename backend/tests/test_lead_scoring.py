@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from app.models.business import Business
+from app.models.lead import Lead
+from app.models.website_tracking import WebsiteVisitor, WebsiteEvent
+from app.core import lead_model
+
+@pytest.fixture(autouse=True)
+def reset_lead_model():
+    yield
+    lead_model.configure()
+
+def lead_payload(lead_id, interactions, company=None, days_ago=1):
+    return {
+        "id": lead_id,
+        "name": f"Lead {lead_id}",
+        "email": f"{lead_id}@example.com",
+        "company": company,
+        "interactions": interactions,
+        "last_contact": (datetime.utcnow() - timedelta(days=days_ago)).isoformat()
+    }
+
+def test_featurize_counts_interaction_types():
+    now = datetime(2024, 5, 10)
+    leads = [
+        SimpleNamespace(
+            interactions=[
+                {"type": "page_view", "description": "/pricing", "timestamp": "2024-05-09T00:00:00Z"},
+                {"type": "page_view", "description": "/"},
+                {"type": "Form_Submit", "description": "demo"},
+                {"type": "tweet", "description": "mention"}
+            ],
+            last_contact=datetime(2024, 5, 3),
+            company="Acme"
+        ),
+        SimpleNamespace(interactions=[], last_contact=datetime(2024, 5, 9), company=None)
+    ]
+    features = lead_model.featurize(leads, now)
+    assert features.shape == (2, len(lead_model.FEATURE_NAMES))
+
+    first = dict(zip(lead_model.FEATURE_NAMES, features[0]))
+    assert first["count_page_view"] == pytest.approx(np.log1p(2))
+    assert first["count_form_submit"] == pytest.approx(np.log1p(1))
+    assert first["count_other"] == pytest.approx(np.log1p(1))
+    assert first["distinct_types"] == 3
+    assert first["days_since_contact"] == pytest.approx(np.log1p(7))
+    assert first["days_since_interaction"] == pytest.approx(np.log1p(1))
+    assert first["has_company"] == 1.0
+
+    second = dict(zip(lead_model.FEATURE_NAMES, features[1]))
+    assert second["interactions"] == 0.0
+    assert second["days_since_interaction"] == second["days_since_contact"]
+
+def test_score_batch_without_model(client, tmp_path):
+    lead_model.configure(path=str(tmp_path / "missing.joblib"))
+    response = client.post("/api/leads/score/batch", json={"leads": [lead_payload("a", [])]})
+    assert response.status_code == 503
+
+def test_train_from_history_and_score_batch(client, db):
+    pytest.importorskip("sklearn")
+    business = Business(name="Scoring Business", is_tracking_enabled=True)
+    db.add(business)
+    db.commit()
+    business_id = business.id
+
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=lead_model.TRAINING_HORIZON_DAYS)
+    for n in range(40):
+        won = n % 2 == 0
+        email = f"lead-{n}@example.com"
+        touches = [{"type": "email_open", "description": "newsletter", "timestamp": (cutoff - timedelta(days=3)).isoformat()}]
+        db.add(Lead(
+            business_id=business_id,
+            email=email,
+            company="Acme" if won else None,
+            status="closed" if won else "lost",
+            last_contact_date=cutoff - timedelta(days=2 if won else 40),
+            converted_at=now if won else None,
+            updated_at=now,
+            # CRM touches go into the features; undated ones and those after the cutoff do not
+            custom_fields={"interactions": touches + [
+                {"type": "meeting", "description": "closing call", "timestamp": (now - timedelta(days=1)).isoformat()},
+                {"type": "call", "description": "undated"}
+            ]}
+        ))
+        visitor = WebsiteVisitor(business_id=business_id, visitor_id=f"v-{n}", email=email)
+        db.add(visitor)
+        db.flush()
+        for event_number in range(12 if won else 1):
+            db.add(WebsiteEvent(
+                visitor_id=visitor.id,
+                event_type="form_submit" if won and event_number == 0 else "page_view",
+                page_url="/pricing",
+                created_at=cutoff - timedelta(days=1, minutes=event_number)
+            ))
+        # Activity on the way to the outcome is not known at the cutoff
+        db.add(WebsiteEvent(visitor_id=visitor.id, event_type="download", page_url="/contract", created_at=now - timedelta(hours=1)))
+    # Still open, so not part of the training data
+    db.add(Lead(business_id=business_id, email="open@example.com", status="qualified"))
+    db.commit()
+
+    features, outcomes = lead_model.training_data(db, business_id)
+    assert features.shape == (40, len(lead_model.FEATURE_NAMES))
+    assert outcomes.sum() == 20
+
+    # Same features as the scoring endpoint computes for the lead as it was at the cutoff
+    first_won = SimpleNamespace(
+        interactions=[{"type": "form_submit", "timestamp": cutoff - timedelta(days=1)}]
+        + [{"type": "page_view", "timestamp": cutoff - timedelta(days=1, minutes=minute)} for minute in range(1, 12)]
+        + [{"type": "email_open", "timestamp": cutoff - timedelta(days=3)}],
+        last_contact=cutoff - timedelta(days=2),
+        company="Acme"
+    )
+    np.testing.assert_allclose(features[0], lead_model.featurize([first_won], cutoff)[0], atol=1e-4)
+    named = dict(zip(lead_model.FEATURE_NAMES, features[0]))
+    assert named["count_download"] == named["count_meeting"] == named["count_call"] == 0
+
+    bundle = lead_model.train(features, outcomes)
+    assert bundle["samples"] == 40
+    lead_model.configure(bundle=bundle)
+
+    engaged = lead_payload(
+        "engaged",
+        [{"type": "page_view", "description": "/pricing"}] * 11 + [{"type": "form_submit", "description": "demo"}],
+        company="Acme"
+    )
+    cold = lead_payload("cold", [{"type": "page_view", "description": "/"}], days_ago=40)
+    response = client.post("/api/leads/score/batch", json={"leads": [engaged, cold]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["model"]["samples"] == 40
+    scores = {score["lead_id"]: score for score in data["scores"]}
+    assert scores["engaged"]["score"] > 80 > 20 > scores["cold"]["score"]
+    assert scores["engaged"]["recommendations"][0] == "Schedule a sales call"
@@ -0,0 +1,99 @@
+import pytest
+import user_agents
+from app.core import user_agent
+from app.core.user_agent import parse_user_agent, get_device_type, cache_stats, clear_cache
+from app.models.business import Business
+from app.models.website_tracking import WebsiteVisitor
+
+IPHONE = (
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 "
+    "(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1"
+)
+DESKTOP = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+)
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+    yield
+    clear_cache()
+
+def test_cache_hit_ratio():
+    parse_user_agent(DESKTOP)
+    parse_user_agent(DESKTOP)
+    parse_user_agent(DESKTOP)
+    parse_user_agent(IPHONE)
+
+    stats = cache_stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["hit_ratio"] == 0.5
+
+def test_cache_is_bounded():
+    maxsize = cache_stats()["maxsize"]
+    for n in range(maxsize + 10):
+        parse_user_agent(f"{DESKTOP} build/{n}")
+    assert cache_stats()["size"] == maxsize
+
+    # Overlong headers share the cache entry of their truncated prefix
+    long_header = DESKTOP + "x" * user_agent.MAX_USER_AGENT_LENGTH
+    assert parse_user_agent(long_header) is parse_user_agent(long_header[:user_agent.MAX_USER_AGENT_LENGTH])
+
+@pytest.mark.parametrize("user_agent_string", [IPHONE, DESKTOP])
+def test_memoized_result_matches_direct_parse(user_agent_string):
+    parsed = user_agents.parse(user_agent_string)
+    expected = (get_device_type(parsed), parsed.browser.family, parsed.os.family)
+    info = parse_user_agent(user_agent_string)
+    assert info[:3] == expected
+    # Served from the cache the second time, unchanged
+    assert parse_user_agent(user_agent_string) == info
+
+def test_pixel_visitor_matches_parsed_user_agent(client, db):
+    business = Business(name="UA Business", is_tracking_enabled=True)
+    db.add(business)
+    db.commit()
+    business_id = business.id
+
+    client.cookies.set("visitor_id", "ua-visitor")
+    response = client.get(f"/api/tracking/pixel/{business_id}", headers={"User-Agent": IPHONE})
+    assert response.status_code == 200
+
+    visitor = db.query(WebsiteVisitor).filter(WebsiteVisitor.visitor_id == "ua-visitor").one()
+    parsed = user_agents.parse(IPHONE)
+    assert (visitor.device_type, visitor.browser, visitor.os) == (
+        get_device_type(parsed), parsed.browser.family, parsed.os.family
+    )
+    assert visitor.device_type == "mobile"
+
+@pytest.mark.parametrize("user_agent_string", [
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 (compatible; Baiduspider/2.0; +http://www.baidu.com/search/spider.html)",
+    "Mozilla/5.0 (compatible; Yahoo! Slurp; http://help.yahoo.com/help/us/ysearch/slurp)",
+    "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+    "Twitterbot/1.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/124.0.0.0 Safari/537.36",
+    "python-requests/2.31.0",
+    "curl/8.4.0",
+    ""
+])
+def test_crawlers_and_clients_are_bots(user_agent_string):
+    assert parse_user_agent(user_agent_string).is_bot
+
+@pytest.mark.parametrize("user_agent_string", [
+    IPHONE,
+    DESKTOP,
+    # Device names and in-app browser tokens that contain "bot" or other crawler-ish words
+    "Mozilla/5.0 (Linux; Android 10; CUBOT NOTE 20) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 12; CUBOT_KINGKONG_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.6045.163 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/24.0 Chrome/117.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 "
+    "[FBAN/FBIOS;FBAV/458.0.0.28.108;FBDV/iPhone15,2;FBMD/iPhone;FBSN/iOS;FBSV/17.4;FBSS/3;FBID/phone;FBLC/en_US;FBOP/5]",
+    "Mozilla/5.0 (Linux; Android 13; Pixel 7 Build/TQ3A.230901.001; wv) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Version/4.0 Chrome/116.0.0.0 Mobile Safari/537.36 Instagram 301.0.0.29.124 Android"
+])
+def test_mainstream_browsers_are_not_bots(user_agent_string):
+    assert not parse_user_agent(user_agent_string).is_bot
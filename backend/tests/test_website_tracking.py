@@ -0,0 +1,1015 @@
+import asyncio
+import calendar
+import csv
+import io
+import json
+import time
+import pytest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import event as sqlalchemy_event, literal, select
+from sqlalchemy.orm import sessionmaker
+from app.models.business import Business
+from app.models.website_tracking import WebsiteVisitor, WebsiteEvent, VisitorSession
+from app.models.analytics import VisitorSketch, LeadFeatures
+from app.core import geoip, bot_filter, rate_limit, visitor_scoring, event_export, event_partitions, rollups, funnels, tracking_store, visitor_sketches, lead_features
+from app.core.hll import HyperLogLog
+from app.core.event_buffer import EventBuffer, event_buffer
+from app.core.tracking_cache import visitor_cache, business_config_cache
+from app.core.sessionizer import Sessionizer, sessionizer
+from app.core.live_analytics import live_hub
+from app.core.event_dedup import deduplicator, RotatingBloomFilter
+from app.api.website_tracking import live_events
+
+@pytest.fixture(autouse=True)
+def tracking_buffer(db, monkeypatch):
+    # Flush the write-behind buffer explicitly, into the test database
+    monkeypatch.setattr(event_buffer, "session_factory", sessionmaker(bind=db.get_bind()))
+    monkeypatch.setattr(event_buffer, "start", lambda: None)
+    yield event_buffer
+    event_buffer.flush()
+
+@pytest.fixture(autouse=True)
+def reset_tracking_caches():
+    # Cached primary keys would point at rows from a previous test database
+    visitor_cache.clear()
+    business_config_cache.clear()
+    sessionizer.clear()
+    live_hub.clear()
+    bot_filter.bot_counters.clear()
+    deduplicator.clear()
+    rate_limit.admission.clear()
+    yield
+    visitor_cache.clear()
+    business_config_cache.clear()
+    sessionizer.clear()
+    live_hub.clear()
+
+@pytest.fixture(scope="function")
+def test_business(db):
+    business = Business(name="Test Business", is_tracking_enabled=True)
+    db.add(business)
+    db.commit()
+    db.refresh(business)
+    return business
+
+def test_track_events_batch(client, db, test_business):
+    response = client.post(
+        "/api/tracking/track-events",
+        json={
+            "events": [
+                {"business_id": test_business.id, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/", "duration": 120},
+                {"business_id": test_business.id, "visitor_id": "v-1", "event_type": "element_click", "page_url": "/"},
+                {"business_id": test_business.id, "visitor_id": "v-2", "event_type": "page_view", "page_url": "/pricing"}
+            ]
+        }
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["accepted"] == 3
+    assert data["rejected"] == 0
+    assert all(result["status"] == "accepted" for result in data["results"])
+
+    assert db.query(WebsiteEvent).count() == 3
+    visitor = db.query(WebsiteVisitor).filter(WebsiteVisitor.visitor_id == "v-1").one()
+    assert visitor.total_page_views == 2
+    assert visitor.total_time_spent == 2.0
+
+def test_track_events_batch_rejects_per_event(client, db, test_business):
+    response = client.post(
+        "/api/tracking/track-events",
+        json={
+            "events": [
+                {"business_id": test_business.id, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/"},
+                {"business_id": test_business.id + 1, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/"},
+                {"business_id": test_business.id, "event_type": "page_view", "page_url": "/"},
+                {"event_type": "page_view"}
+            ]
+        }
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["accepted"] == 1
+    assert [result["status"] for result in data["results"]] == ["accepted", "rejected", "rejected", "rejected"]
+    assert db.query(WebsiteEvent).count() == 1
+
+def test_visitor_id_of_another_business_rejected_per_event(client, db, test_business):
+    other = Business(name="Other Business", is_tracking_enabled=True)
+    db.add(other)
+    db.commit()
+    business_id, other_id = test_business.id, other.id
+    db.add(WebsiteVisitor(business_id=other_id, visitor_id="shared"))
+    db.commit()
+
+    response = client.post(
+        "/api/tracking/track-events",
+        json={
+            "events": [
+                {"business_id": business_id, "visitor_id": "shared", "event_type": "page_view", "page_url": "/"},
+                {"business_id": business_id, "visitor_id": "new", "event_type": "page_view", "page_url": "/"},
+                {"business_id": other_id, "visitor_id": "new", "event_type": "page_view", "page_url": "/"}
+            ]
+        }
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["accepted"] == 1
+    assert [result["status"] for result in data["results"]] == ["rejected", "accepted", "rejected"]
+    assert data["results"][0]["error"] == "visitor_id belongs to another business"
+    assert db.query(WebsiteEvent).count() == 1
+    assert db.query(WebsiteVisitor).filter(WebsiteVisitor.business_id == business_id).count() == 1
+
+    response = client.post(
+        "/api/tracking/track-event",
+        json={"business_id": business_id, "visitor_id": "shared", "event_type": "page_view", "page_url": "/"}
+    )
+    assert response.status_code == 409
+
+def test_track_event_is_buffered(client, db, test_business):
+    response = client.post(
+        "/api/tracking/track-event",
+        json={"business_id": test_business.id, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/", "duration": 60}
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "queued"
+
+    event_buffer.flush()
+    assert db.query(WebsiteEvent).count() == 1
+    visitor = db.query(WebsiteVisitor).filter(WebsiteVisitor.visitor_id == "v-1").one()
+    db.refresh(visitor)
+    assert visitor.total_page_views == 1
+    assert visitor.total_time_spent == 1.0
+
+def test_oversized_event_fields_rejected(client, test_business):
+    response = client.post(
+        "/api/tracking/track-events",
+        json={
+            "events": [
+                {"business_id": test_business.id, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/" + "a" * 500},
+                {"business_id": test_business.id, "visitor_id": "v" * 101, "event_type": "page_view", "page_url": "/"},
+                {"business_id": test_business.id, "visitor_id": "v-1", "event_type": "e" * 51, "page_url": "/"},
+                {"business_id": test_business.id, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/", "page_title": "t" * 256}
+            ]
+        }
+    )
+    assert response.status_code == 200
+    assert response.json()["rejected"] == 4
+
+def test_failing_flush_bisected_into_dead_letters(db, test_business):
+    business_id = test_business.id
+    visitors = [WebsiteVisitor(business_id=business_id, visitor_id=f"v-{n}") for n in range(4)]
+    db.add_all(visitors)
+    db.commit()
+    visitor_pks = [visitor.id for visitor in visitors]
+
+    buffer = EventBuffer(sessionmaker(bind=db.get_bind()), max_retries=2)
+    now = datetime.utcnow()
+    for visitor_pk in visitor_pks:
+        # A value the JSON column cannot serialize makes every write of this row fail
+        event_data = {"bad": object()} if visitor_pk == visitor_pks[2] else None
+        row = {"visitor_id": visitor_pk, "event_type": "page_view", "page_url": "/", "event_data": event_data, "created_at": now}
+        buffer.enqueue(row, visitor_pk, business_id, None, now)
+
+    assert buffer.flush() == 0
+    assert buffer.stats()["depth"] == 4
+
+    assert buffer.flush() == 3
+    stats = buffer.stats()
+    assert stats["depth"] == 0
+    assert stats["failed_flushes"] == 2
+    assert stats["dead_lettered_events"] == 1
+    assert [letter["rows"][0]["visitor_id"] for letter in buffer.dead_letters()] == [visitor_pks[2]]
+    assert db.query(WebsiteEvent).count() == 3
+
+    db.expire_all()
+    page_views = dict(db.query(WebsiteVisitor.id, WebsiteVisitor.total_page_views))
+    assert page_views[visitor_pks[2]] == 0
+    assert page_views[visitor_pks[3]] == 1
+
+def test_bisect_keeps_rollups_of_a_dead_lettered_half(db, test_business):
+    business_id = test_business.id
+    visitors = [WebsiteVisitor(business_id=business_id, visitor_id=f"v-{n}") for n in range(4)]
+    db.add_all(visitors)
+    db.commit()
+    visitor_pks = [visitor.id for visitor in visitors]
+
+    buffer = EventBuffer(sessionmaker(bind=db.get_bind()), max_retries=1)
+    now = datetime.utcnow()
+    for visitor_pk in visitor_pks:
+        # The poisoned visitor ends up alone in the half that carries the rollups
+        event_data = {"bad": object()} if visitor_pk == visitor_pks[0] else None
+        row = {"visitor_id": visitor_pk, "event_type": "page_view", "page_url": "/", "event_data": event_data, "created_at": now}
+        buffer.enqueue(row, visitor_pk, business_id, None, now)
+    buffer.record_rollup(business_id, "new_visitors", now, amount=4)
+
+    assert buffer.flush() == 3
+    assert buffer.stats()["dead_lettered_events"] == 1
+    today = rollups.bucket_start(now, "day")
+    assert rollups.metric_total(db, business_id, "page_views", today) == 3
+    assert rollups.metric_total(db, business_id, "events", today) == 3
+    assert rollups.metric_total(db, business_id, "new_visitors", today) == 4
+
+def test_restore_drops_deltas_with_overflowing_rows(test_business):
+    business_id = test_business.id
+    buffer = EventBuffer(lambda: None, max_size=2)
+    now = datetime.utcnow()
+    buffer.enqueue({"visitor_id": 1, "event_type": "page_view"}, 1, business_id, 60, now)
+
+    rows = [
+        {"visitor_id": 2, "event_type": "page_view", "client_event_id": "e-2"},
+        {"visitor_id": 3, "event_type": "page_view", "duration": 60, "client_event_id": "e-3"},
+        {"visitor_id": 2, "event_type": "page_view"}
+    ]
+    buffer._event_keys.update({(2, "e-2"), (3, "e-3")})
+    deltas = {}
+    tracking_store.add_visitor_delta(deltas, 2, business_id, None, now)
+    tracking_store.add_visitor_delta(deltas, 3, business_id, 60, now)
+    tracking_store.add_visitor_delta(deltas, 2, business_id, None, now)
+    buffer._restore(rows, deltas, rollups.RollupDeltas())
+
+    assert [row["visitor_id"] for row in buffer._rows] == [2, 1]
+    assert buffer._deltas[2]["page_views"] == 1
+    assert 3 not in buffer._deltas
+    assert buffer.stats()["dropped_events"] == 2
+    # Dropped rows are no longer reported to the deduplicator
+    assert buffer.has_event(2, "e-2")
+    assert not buffer.has_event(3, "e-3")
+
+def test_visitor_cache_skips_lookup(client, db, test_business):
+    business_id = test_business.id
+    client.cookies.set("visitor_id", "v-1")
+    assert client.get(f"/api/tracking/pixel/{business_id}").status_code == 200
+    assert visitor_cache.get((business_id, "v-1")) is not None
+
+    misses = visitor_cache.misses
+    assert client.get(f"/api/tracking/pixel/{business_id}").status_code == 200
+    assert visitor_cache.misses == misses
+
+    event_buffer.flush()
+    visitor = db.query(WebsiteVisitor).filter(WebsiteVisitor.visitor_id == "v-1").one()
+    assert visitor.total_visits == 2
+
+def test_business_config_cache_invalidated_on_update(client, db, test_business):
+    business_id = test_business.id
+    assert client.get(f"/api/tracking/pixel/{business_id}").status_code == 200
+    assert business_config_cache.get(business_id)["enabled"] is True
+
+    business = db.get(Business, business_id)
+    business.is_tracking_enabled = False
+    db.commit()
+    assert business_config_cache.get(business_id) is None
+    assert client.get(f"/api/tracking/pixel/{business_id}").status_code == 404
+
+def test_tracking_script_is_cacheable(client, test_business):
+    response = client.get(
+        f"/tracking-script/{test_business.id}.js",
+        headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/javascript")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "max-age" in response.headers["cache-control"]
+    assert f"var businessId = {test_business.id};" in response.text
+
+    response = client.get(
+        f"/tracking-script/{test_business.id}.js",
+        headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == 304
+
+def test_beacon_accepts_text_plain_batches(client, db, test_business):
+    payload = {
+        "events": [
+            {"business_id": test_business.id, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/"},
+            {"business_id": test_business.id, "visitor_id": "v-1", "event_type": "page_exit", "page_url": "/", "duration": 30}
+        ]
+    }
+    response = client.post(
+        "/api/tracking/beacon",
+        content=json.dumps(payload),
+        headers={"Content-Type": "text/plain;charset=UTF-8"}
+    )
+    assert response.status_code == 204
+
+    event_buffer.flush()
+    assert db.query(WebsiteEvent).count() == 2
+
+def test_beacon_rejects_malformed_payload(client):
+    response = client.post("/api/tracking/beacon", content="not json", headers={"Content-Type": "text/plain"})
+    assert response.status_code == 400
+
+class FakeGeoReader:
+    """Stands in for a GeoIP2 City database with a single network"""
+
+    def __init__(self):
+        self.lookups = 0
+
+    def city(self, ip_address):
+        self.lookups += 1
+        if not ip_address.startswith("81.2.69."):
+            raise ValueError("not found")
+        return SimpleNamespace(
+            country=SimpleNamespace(name="United Kingdom"),
+            city=SimpleNamespace(name="London"),
+            subdivisions=SimpleNamespace(most_specific=SimpleNamespace(name="England"))
+        )
+
+def test_geoip_enrichment_uses_prefix_cache(db, test_business):
+    reader = FakeGeoReader()
+    geoip.configure(reader=reader)
+    try:
+        visitor = WebsiteVisitor(business_id=test_business.id, visitor_id="v-geo")
+        db.add(visitor)
+        db.commit()
+
+        geoip.enrich_visitors([visitor.id], "81.2.69.142", session_factory=sessionmaker(bind=db.get_bind()))
+        assert geoip.lookup("81.2.69.7").city == "London"
+        assert reader.lookups == 1
+
+        db.refresh(visitor)
+        assert (visitor.country, visitor.city, visitor.region) == ("United Kingdom", "London", "England")
+        assert geoip.lookup("127.0.0.1") is None
+    finally:
+        geoip.configure()
+
+def test_geoip_enrichment_keeps_first_unique_visit(db, test_business):
+    business_id = test_business.id
+    geoip.configure(reader=FakeGeoReader())
+    try:
+        visitor = WebsiteVisitor(business_id=business_id, visitor_id="v-geo-new", total_visits=0)
+        db.add(visitor)
+        db.commit()
+        visitor_pk = visitor.id
+
+        session_factory = sessionmaker(bind=db.get_bind())
+        buffer = EventBuffer(session_factory)
+        now = datetime.utcnow()
+        buffer.enqueue({"visitor_id": visitor_pk, "event_type": "page_view", "page_url": "/", "created_at": now}, visitor_pk, business_id, None, now)
+        # Enrichment runs before the buffer flushes and must not stamp last_visit
+        geoip.enrich_visitors([visitor_pk], "81.2.69.142", session_factory=session_factory)
+        db.expire_all()
+        assert db.query(WebsiteVisitor.city, WebsiteVisitor.last_visit).filter(WebsiteVisitor.id == visitor_pk).one() == ("London", None)
+
+        assert buffer.flush() == 1
+        assert rollups.metric_total(db, business_id, "unique_visitors", rollups.bucket_start(now, "day")) == 1
+    finally:
+        geoip.configure()
+
+def test_geoip_degrades_without_database():
+    geoip.configure(path="/nonexistent/GeoLite2-City.mmdb")
+    try:
+        assert geoip.lookup("81.2.69.142") is None
+    finally:
+        geoip.configure()
+
+def test_analytics_served_from_rollups(client, db, test_business):
+    business_id = test_business.id
+    client.cookies.set("visitor_id", "v-1")
+    client.get(f"/api/tracking/pixel/{business_id}")
+    client.get(f"/api/tracking/pixel/{business_id}")
+    client.post(
+        "/api/tracking/track-events",
+        json={
+            "events": [
+                {"business_id": business_id, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/pricing"},
+                {"business_id": business_id, "visitor_id": "v-1", "event_type": "page_view", "page_url": "/pricing"},
+                {"business_id": business_id, "visitor_id": "v-2", "event_type": "page_view", "page_url": "/"}
+            ]
+        }
+    )
+    client.post("/api/tracking/capture-lead", json={"business_id": business_id, "visitor_id": "v-1", "email": "lead@example.com"})
+    event_buffer.flush()
+
+    data = client.get(f"/api/tracking/analytics/{business_id}").json()
+    assert data["total_visitors"] == 2
+    assert data["total_leads"] == 1
+    assert data["total_page_views"] == 3
+    assert data["conversion_rate"] == 50
+    assert data["top_pages"] == ["/pricing", "/"]
+
+    buckets = client.get(f"/api/tracking/analytics/{business_id}/timeseries?granularity=hour").json()["buckets"]
+    assert len(buckets) == 1
+    assert buckets[0]["unique_visitors"] == 2
+
+def test_visitor_listing_keyset_pagination(client, db, test_business):
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    for index in range(5):
+        db.add(WebsiteVisitor(
+            business_id=test_business.id,
+            visitor_id=f"page-{index}",
+            last_visit=base + timedelta(minutes=index % 3),
+            is_lead=index % 2 == 0
+        ))
+    # Not flushed yet: no last_visit, listed after every dated visitor
+    db.add(WebsiteVisitor(business_id=test_business.id, visitor_id="page-new"))
+    db.commit()
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, "fields": "visitor_id,last_visit"}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get(f"/api/tracking/visitors/{test_business.id}", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert all(set(row) == {"id", "visitor_id", "last_visit"} for row in data["visitors"])
+        seen.extend(row["visitor_id"] for row in data["visitors"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == ["page-2", "page-4", "page-1", "page-3", "page-0", "page-new"]
+
+    response = client.get(f"/api/tracking/visitors/{test_business.id}", params={"fields": "password"})
+    assert response.status_code == 400
+    response = client.get(f"/api/tracking/visitors/{test_business.id}", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_lead_listing_streams_ndjson(client, db, test_business):
+    for index in range(3):
+        db.add(WebsiteVisitor(
+            business_id=test_business.id,
+            visitor_id=f"lead-{index}",
+            last_visit=datetime(2024, 1, 1, index),
+            is_lead=index != 1,
+            email=f"lead-{index}@example.com"
+        ))
+    db.commit()
+
+    response = client.get(f"/api/tracking/leads/{test_business.id}", params={"format": "ndjson", "fields": "email"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["email"] for row in rows] == ["lead-2@example.com", "lead-0@example.com"]
+
+def _add_export_events(db, business):
+    visitor = WebsiteVisitor(business_id=business.id, visitor_id="export-1")
+    db.add(visitor)
+    db.flush()
+    for hour in range(3):
+        db.add(WebsiteEvent(
+            visitor_id=visitor.id,
+            event_type="page_view",
+            page_url=f"/page-{hour}",
+            event_data={"hour": hour},
+            created_at=datetime(2024, 1, 1, hour)
+        ))
+    db.commit()
+
+def test_export_events_csv(client, db, test_business):
+    _add_export_events(db, test_business)
+
+    response = client.get(
+        f"/api/tracking/export/{test_business.id}",
+        params={"format": "csv", "start_date": "2024-01-01T01:00:00"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["page_url"] for row in rows] == ["/page-1", "/page-2"]
+    assert rows[0]["visitor_id"] == "export-1"
+    assert json.loads(rows[0]["event_data"]) == {"hour": 1}
+
+def test_export_events_parquet_row_groups(db, test_business):
+    pq = pytest.importorskip("pyarrow.parquet")
+    _add_export_events(db, test_business)
+
+    data = b"".join(event_export.export_stream(db, test_business.id, "parquet", chunk_size=2))
+    parquet_file = pq.ParquetFile(io.BytesIO(data))
+    assert parquet_file.metadata.num_row_groups == 2
+    assert parquet_file.read().column("page_url").to_pylist() == ["/page-0", "/page-1", "/page-2"]
+
+def test_event_retention_rotates_and_compacts(db, test_business):
+    visitor = WebsiteVisitor(business_id=test_business.id, visitor_id="archived-1", created_at=datetime(2024, 1, 5))
+    db.add(visitor)
+    db.flush()
+    for day in (5, 6, 6):
+        db.add(WebsiteEvent(visitor_id=visitor.id, event_type="page_view", page_url="/old", created_at=datetime(2024, 1, day, 10)))
+    db.add(WebsiteEvent(visitor_id=visitor.id, event_type="page_view", page_url="/new", created_at=datetime(2024, 3, 2, 10)))
+    db.commit()
+    now = datetime(2024, 3, 15)
+
+    moved = event_partitions.rotate_closed_months(db, batch_size=2, now=now)
+    assert moved == 3
+    assert db.query(WebsiteEvent).count() == 1
+    assert event_partitions.list_partitions(db) == ["website_events_2024_01"]
+    # Reads over a range still see the archived month
+    assert len(db.execute(event_export.events_query(db, test_business.id)).all()) == 4
+
+    summary = event_partitions.compact_expired(db, retention_days=30, now=now)
+    assert summary["dropped"] == ["website_events_2024_01"]
+    assert summary["rebuilt_days"] == 2
+    assert event_partitions.list_partitions(db) == []
+    assert rollups.metric_total(db, test_business.id, "page_views", datetime(2024, 1, 1), datetime(2024, 2, 1)) == 3
+    assert db.query(WebsiteEvent).count() == 1
+
+def test_rebuild_rollups_keeps_metrics_not_derived_from_events(db, test_business):
+    business_id = test_business.id
+    visitor = WebsiteVisitor(business_id=business_id, visitor_id="rebuilt-1", created_at=datetime(2024, 1, 5, 9))
+    db.add(visitor)
+    db.flush()
+    db.add(WebsiteEvent(visitor_id=visitor.id, event_type="page_view", page_url="/", created_at=datetime(2024, 1, 5, 10)))
+    deltas = rollups.RollupDeltas()
+    deltas.add(business_id, "page_views", datetime(2024, 1, 5, 10), "/", amount=7)
+    deltas.add(business_id, "sessions", datetime(2024, 1, 5, 10))
+    rollups.apply_rollups(db, deltas)
+    db.commit()
+
+    rollups.rebuild_rollups(db, datetime(2024, 1, 5), datetime(2024, 1, 6), business_id)
+    db.commit()
+    day = (datetime(2024, 1, 5), datetime(2024, 1, 6))
+    assert rollups.metric_total(db, business_id, "page_views", *day) == 1
+    assert rollups.metric_total(db, business_id, "new_visitors", *day) == 1
+    assert rollups.metric_total(db, business_id, "sessions", *day) == 1
+
+def test_sessions_split_on_inactivity_and_are_written(client, db, test_business, tracking_buffer):
+    response = client.post(
+        "/api/tracking/track-events",
+        json={"events": [
+            {"business_id": test_business.id, "visitor_id": "s-1", "event_type": "page_view", "page_url": "/"},
+            {"business_id": test_business.id, "visitor_id": "s-1", "event_type": "page_view", "page_url": "/pricing"},
+            {"business_id": test_business.id, "visitor_id": "s-1", "event_type": "element_click", "page_url": "/pricing"}
+        ]}
+    )
+    assert response.status_code == 200
+    session_ids = {event.session_id for event in db.query(WebsiteEvent)}
+    assert len(session_ids) == 1 and None not in session_ids
+
+    # Nothing is written while the session is open; an idle session is closed by the next flush
+    tracking_buffer.flush()
+    assert db.query(VisitorSession).count() == 0
+    sessionizer.timeout = timedelta(seconds=0)
+    try:
+        tracking_buffer.flush()
+    finally:
+        sessionizer.timeout = timedelta(seconds=1800)
+
+    session = db.query(VisitorSession).one()
+    assert session.session_id in session_ids
+    assert session.page_views == 2
+    assert session.event_count == 3
+    assert session.entry_page == "/"
+    assert session.exit_page == "/pricing"
+
+def test_sessionizer_timeout_and_recovery(db, test_business):
+    visitor = WebsiteVisitor(business_id=test_business.id, visitor_id="s-2")
+    db.add(visitor)
+    db.commit()
+    deltas = {visitor.id: {"business_id": test_business.id}}
+    start = datetime(2024, 1, 1, 12, 0)
+
+    engine = Sessionizer(timeout=1800)
+    rows = [
+        {"visitor_id": visitor.id, "event_type": "page_view", "page_url": f"/{minute}", "created_at": start + timedelta(minutes=minute)}
+        for minute in (0, 10, 50, 55)
+    ]
+    engine.assign(rows, deltas)
+    assert rows[0]["session_id"] == rows[1]["session_id"] != rows[2]["session_id"] == rows[3]["session_id"]
+
+    finished = engine.expire(now=start + timedelta(minutes=56))
+    assert [(row["entry_page"], row["page_views"]) for row in finished] == [("/0", 2)]
+
+    # A restarted process picks the open session back up from the stored events
+    for row in rows:
+        db.add(WebsiteEvent(**row))
+    db.add(VisitorSession(**finished[0]))
+    db.commit()
+
+    restarted = Sessionizer(timeout=1800)
+    assert restarted.recover(db, now=start + timedelta(minutes=60)) == 1
+    later = [{"visitor_id": visitor.id, "event_type": "page_view", "page_url": "/70", "created_at": start + timedelta(minutes=70)}]
+    restarted.assign(later, deltas)
+    assert later[0]["session_id"] == rows[3]["session_id"]
+    (session,) = restarted.expire(now=start + timedelta(hours=2))
+    assert (session["entry_page"], session["exit_page"], session["page_views"]) == ("/50", "/70", 3)
+
+def test_funnel_ordered_steps(client, db, test_business):
+    funnels.clear_cache()
+    start = datetime(2024, 1, 1, 12, 0)
+    journeys = {
+        # Completes the funnel
+        "f-1": [("page_view", "/pricing", None), ("element_click", "/pricing", "Signup now"), ("form_submit", "/signup", None)],
+        # Clicks before viewing pricing: only the first step counts
+        "f-2": [("element_click", "/", "signup-button"), ("page_view", "/pricing", None)],
+        # Clicks something else
+        "f-3": [("page_view", "/pricing?plan=pro", None), ("element_click", "/pricing", "Contact")],
+    }
+    for visitor_id, events in journeys.items():
+        visitor = WebsiteVisitor(business_id=test_business.id, visitor_id=visitor_id)
+        db.add(visitor)
+        db.flush()
+        for offset, (event_type, page_url, element) in enumerate(events):
+            db.add(WebsiteEvent(
+                visitor_id=visitor.id,
+                event_type=event_type,
+                page_url=page_url,
+                event_data={"element_text": element} if element else None,
+                created_at=start + timedelta(minutes=offset)
+            ))
+    db.commit()
+
+    definition = {"steps": [
+        {"event_type": "page_view", "page_url": "/pricing"},
+        {"event_type": "element_click", "element": "signup"},
+        {"event_type": "form_submit"}
+    ]}
+    response = client.post(f"/api/tracking/funnels/{test_business.id}", json=definition)
+    assert response.status_code == 200
+    steps = response.json()["steps"]
+    assert [step["visitors"] for step in steps] == [3, 1, 1]
+    assert steps[1]["drop_off"] == 2
+    assert steps[2]["step_conversion_rate"] == 100.0
+
+    # Served from the cache until it expires
+    assert funnels.cache_stats()["size"] == 1
+    response = client.post(f"/api/tracking/funnels/{test_business.id}", json={"steps": []})
+    assert response.status_code == 400
+
+def test_hyperloglog_estimate_and_merge():
+    first, second = HyperLogLog(), HyperLogLog()
+    first.update(range(20000))
+    second.update(range(10000, 30000))
+    assert abs(first.count() - 20000) / 20000 < 0.03
+    assert HyperLogLog.from_bytes(first.to_bytes()).count() == first.count()
+
+    # Re-adding items changes nothing; merging estimates the union
+    before = first.count()
+    first.update(range(5000))
+    assert first.count() == before
+    first.merge(second)
+    assert abs(first.count() - 30000) / 30000 < 0.03
+
+def test_hyperloglog_rank_exact_beyond_float_precision():
+    # At precision 4 the remainder is 60 bits wide; 2**59 - 1 rounds up to 2**59 as a float64
+    sketch = HyperLogLog(4)
+    sketch.add_hashes([(3 << 60) | ((1 << 59) - 1), (5 << 60) | 1])
+    assert sketch.registers[3] == 2
+    assert sketch.registers[5] == 60
+
+def test_unique_visitors_from_daily_sketches(client, db, test_business):
+    visitor_sketches.clear_cache()
+    day = datetime(2024, 3, 1, 9, 0)
+    visitors = [WebsiteVisitor(business_id=test_business.id, visitor_id=f"u-{index}") for index in range(3)]
+    db.add_all(visitors)
+    db.commit()
+
+    # u-0 on both days, u-1 on day one, u-2 on day two
+    rows, deltas = [], {}
+    for visitor, at in [(visitors[0], day), (visitors[1], day), (visitors[0], day + timedelta(days=1)), (visitors[2], day + timedelta(days=1))]:
+        rows.append({"visitor_id": visitor.id, "session_id": None, "event_type": "page_view", "page_url": "/",
+                     "page_title": None, "event_data": None, "duration": None, "form_fields": None, "created_at": at})
+        tracking_store.add_visitor_delta(deltas, visitor.id, test_business.id, seen_at=at)
+    tracking_store.write_events(db, rows, deltas)
+    db.commit()
+    visitor_sketches.clear_cache()
+
+    url = f"/api/tracking/analytics/{test_business.id}/unique-visitors"
+    both_days = {"start_date": "2024-03-01T00:00:00", "end_date": "2024-03-03T00:00:00"}
+    assert client.get(url, params=both_days).json()["unique_visitors"] == 3
+    assert client.get(url, params={"start_date": "2024-03-02T00:00:00", "end_date": "2024-03-03T00:00:00"}).json()["unique_visitors"] == 2
+
+    exact = client.get(url, params={**both_days, "exact": "true"}).json()
+    assert exact == {"unique_visitors": 3, "mode": "exact", "relative_error": 0.0}
+
+    # The day sketches are now cached; one row per business-day is stored
+    assert visitor_sketches.cache_stats()["hits"] >= 1
+    assert db.query(VisitorSketch).count() == 2
+
+def test_sketch_cache_updated_only_after_commit(db, test_business):
+    visitor_sketches.clear_cache()
+    business_id = test_business.id
+    day = datetime(2024, 3, 1)
+    visitor = WebsiteVisitor(business_id=business_id, visitor_id="sketched-1", first_visit=day - timedelta(days=7), last_visit=day)
+    db.add(visitor)
+    db.commit()
+    visitor_pk = visitor.id
+
+    visitor_sketches.apply_sketches(db, {(business_id, day): {visitor_pk}})
+    db.rollback()
+    assert visitor_sketches.count_approximate(db, business_id, day, day + timedelta(days=1)) == 0
+
+    visitor_sketches.apply_sketches(db, {(business_id, day): {visitor_pk}})
+    assert visitor_sketches._sketch_cache.get((business_id, day)) is None
+    db.commit()
+    assert visitor_sketches._sketch_cache.get((business_id, day)).count() == 1
+    # A repeat visit without events counts through last_visit
+    assert visitor_sketches.count_exact(db, business_id, day, day + timedelta(days=1)) == 1
+
+def test_live_counters_coalesce_flushes(client, db, test_business, tracking_buffer):
+    business_id = test_business.id
+    subscription = live_hub.subscribe(business_id)
+    for visitor_id in ("l-1", "l-2", "l-1"):
+        client.post("/api/tracking/track-event", json={
+            "business_id": business_id, "visitor_id": visitor_id, "event_type": "page_view", "page_url": "/"
+        })
+        tracking_buffer.flush()
+
+    # Three flushes, one accumulated delta
+    assert subscription.drain() == {"page_views": 3, "new_visitors": 2}
+    assert subscription.drain() is None
+    assert live_hub.active_visitors(business_id) == 2
+
+    class Request:
+        calls = 0
+        async def is_disconnected(self):
+            self.calls += 1
+            return self.calls > 2
+
+    async def collect():
+        return [message async for message in live_events(Request(), subscription, interval=0, heartbeat=60)]
+
+    client.post("/api/tracking/track-event", json={
+        "business_id": business_id, "visitor_id": "l-3", "event_type": "page_view", "page_url": "/"
+    })
+    tracking_buffer.flush()
+    messages = asyncio.run(collect())
+    assert len(messages) == 2
+    assert messages[0].startswith("event: counters\n")
+    assert json.loads(messages[1].split("data: ")[1]) == {"page_views": 1, "new_visitors": 1, "new_leads": 0, "active_visitors": 3}
+    # Disconnecting unsubscribes
+    assert live_hub.stats()["subscribers"] == 0
+
+    # Synchronous batches are published once committed, too
+    subscription = live_hub.subscribe(business_id)
+    client.post("/api/tracking/track-events", json={"events": [
+        {"business_id": business_id, "visitor_id": "l-4", "event_type": "page_view", "page_url": "/"},
+        {"business_id": business_id, "visitor_id": "l-1", "event_type": "page_view", "page_url": "/"}
+    ]})
+    assert subscription.drain() == {"page_views": 2, "new_visitors": 1}
+    assert live_hub.active_visitors(business_id) == 4
+
+def test_bot_traffic_rejected_before_storage(client, db, test_business, tracking_buffer, monkeypatch):
+    business_id = test_business.id
+    # Record every rejected hit in the bot_hits rollup
+    monkeypatch.setattr(bot_filter, "sampled", lambda sample_rate=None: 1)
+    crawler = {"user-agent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"}
+    event = {"business_id": business_id, "visitor_id": "b-1", "event_type": "page_view", "page_url": "/"}
+
+    assert client.get(f"/api/tracking/pixel/{business_id}", headers=crawler).status_code == 200
+    assert client.post("/api/tracking/track-event", json=event, headers={"user-agent": "curl/8.4.0"}).json() == {"status": "ignored"}
+    response = client.post("/api/tracking/track-events", json={"events": [event, event]}, headers=crawler)
+    assert response.json()["rejected"] == 2
+
+    # Known bad ranges are rejected whatever the user agent
+    monkeypatch.setattr(bot_filter, "blocked_ranges", bot_filter.IPRanges(["10.0.0.0/8", "10.2.0.0/16", "2001:db8::/32"]))
+    assert "10.1.2.3" in bot_filter.blocked_ranges and "2001:db8::1" in bot_filter.blocked_ranges
+    assert "11.0.0.1" not in bot_filter.blocked_ranges
+    monkeypatch.setattr(bot_filter, "classify", lambda user_agent, ip: bot_filter.REASON_IP)
+    client.post("/api/tracking/track-event", json=event)
+    tracking_buffer.flush()
+
+    assert db.query(WebsiteVisitor).count() == 0
+    assert db.query(WebsiteEvent).count() == 0
+    counts = client.get(f"/api/tracking/bots/{business_id}").json()
+    assert counts == {"rejected": 5, "by_reason": {"user_agent": 4, "ip_range": 1}}
+
+    # bot_hits cannot be recomputed from raw events, so a rebuild keeps it
+    today = rollups.bucket_start(datetime.utcnow(), "day")
+    assert rollups.metric_total(db, business_id, "bot_hits", today) == 5
+    rollups.rebuild_rollups(db, today, today + timedelta(days=1), business_id)
+    db.commit()
+    assert rollups.metric_total(db, business_id, "bot_hits", today) == 5
+
+def test_retried_events_deduplicated_by_event_id(client, db, test_business, tracking_buffer):
+    event = {"business_id": test_business.id, "visitor_id": "d-1", "event_type": "page_view", "page_url": "/", "event_id": "e-1"}
+
+    # A retry while the first copy is still buffered, and another after it is stored
+    assert client.post("/api/tracking/track-event", json=event).json() == {"status": "queued"}
+    assert client.post("/api/tracking/track-event", json=event).json() == {"status": "duplicate"}
+    visitor_pk = db.query(WebsiteVisitor.id).filter(WebsiteVisitor.visitor_id == "d-1").scalar()
+    assert tracking_buffer.has_event(visitor_pk, "e-1")
+    tracking_buffer.flush()
+    assert not tracking_buffer.has_event(visitor_pk, "e-1")
+    # A restarted process reloads the recent ids from the stored events
+    deduplicator.clear()
+    assert deduplicator.warm(db) == 1
+    client.post("/api/tracking/track-event", json=event)
+    client.post("/api/tracking/beacon", content=json.dumps({"events": [event]}), headers={"content-type": "text/plain"})
+
+    # Duplicates within a batch, next to a new event
+    other = {**event, "event_id": "e-2"}
+    data = client.post("/api/tracking/track-events", json={"events": [other, other, event]}).json()
+    assert [result["status"] for result in data["results"]] == ["accepted", "duplicate", "duplicate"]
+    assert data["accepted"] == 1 and data["duplicates"] == 2 and data["rejected"] == 0
+    tracking_buffer.flush()
+
+    assert sorted(row.client_event_id for row in db.query(WebsiteEvent)) == ["e-1", "e-2"]
+    visitor = db.query(WebsiteVisitor).filter(WebsiteVisitor.visitor_id == "d-1").one()
+    assert visitor.total_page_views == 2
+
+    stats = deduplicator.stats()
+    assert stats["duplicates"] == 5 and stats["false_positives"] == 0
+
+def test_rotating_bloom_filter_forgets_after_window():
+    now = [0.0]
+    bloom = RotatingBloomFilter(window=60, generations=3, capacity=1000, clock=lambda: now[0])
+    assert not bloom.check_and_add("a")
+    assert bloom.check_and_add("a")
+    now[0] = 45.0
+    assert bloom.check_and_add("a")
+    now[0] = 70.0
+    assert bloom.check_and_add("a")
+    now[0] = 130.0
+    assert not bloom.check_and_add("a")
+
+def test_rate_limits_shed_load_per_business_and_visitor(client, db, test_business, tracking_buffer, monkeypatch):
+    business_id = test_business.id
+    now = [0.0]
+    monkeypatch.setattr(rate_limit, "admission", rate_limit.AdmissionControl(
+        rate_limit.TokenBucketLimiter(rate=1, burst=5, clock=lambda: now[0]),
+        rate_limit.TokenBucketLimiter(rate=1, burst=3, clock=lambda: now[0])
+    ))
+    # Record every throttled hit in the throttled_events rollup
+    monkeypatch.setattr(bot_filter, "sampled", lambda sample_rate=None: 1)
+    event = {"business_id": business_id, "visitor_id": "r-1", "event_type": "page_view", "page_url": "/"}
+
+    # A looping visitor is cut off after its burst without using up the business's tokens
+    statuses = [client.post("/api/tracking/track-event", json=event).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+    # The business bucket sheds the rest of a batch from other visitors
+    batch = [{**event, "visitor_id": f"r-{index}"} for index in range(2, 6)]
+    results = client.post("/api/tracking/track-events", json={"events": batch}).json()["results"]
+    assert [result["status"] for result in results] == ["accepted", "accepted", "rejected", "rejected"]
+    assert results[2]["error"] == "Rate limited"
+
+    # Tokens refill over time
+    now[0] = 1.0
+    assert client.post("/api/tracking/track-event", json={**event, "visitor_id": "r-9"}).status_code == 200
+
+    counts = client.get(f"/api/tracking/throttle/{business_id}").json()
+    assert counts == {"admitted": 6, "throttled": 3, "by_limit": {"visitor": 1, "business": 2}}
+    assert client.get("/api/tracking/stats").json()["throttle"]["top_throttled"][0]["business_id"] == business_id
+
+    # throttled_events cannot be recomputed from raw events, so a rebuild keeps it
+    tracking_buffer.flush()
+    today = rollups.bucket_start(datetime.utcnow(), "day")
+    assert rollups.metric_total(db, business_id, "throttled_events", today) == 3
+    rollups.rebuild_rollups(db, today, today + timedelta(days=1), business_id)
+    db.commit()
+    assert rollups.metric_total(db, business_id, "throttled_events", today) == 3
+
+def test_visitor_counters_coalesced_into_one_atomic_update(client, db, test_business, tracking_buffer):
+    business_id = test_business.id
+    visitor = WebsiteVisitor(business_id=business_id, visitor_id="c-1", total_visits=1, total_page_views=0, total_time_spent=0.0)
+    db.add(visitor)
+    db.commit()
+    visitor_pk = visitor.id
+    later = datetime.utcnow() + timedelta(days=1)
+    db.query(WebsiteVisitor).filter(WebsiteVisitor.id == visitor_pk).update({"last_visit": later})
+    db.commit()
+
+    for _ in range(50):
+        client.post("/api/tracking/track-event", json={
+            "business_id": business_id, "visitor_id": "c-1", "event_type": "page_view", "page_url": "/", "duration": 6
+        })
+
+    updates = []
+    def record_update(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE website_visitors"):
+            updates.append(len(parameters) if executemany else 1)
+    sqlalchemy_event.listen(db.get_bind(), "before_cursor_execute", record_update)
+    try:
+        tracking_buffer.flush()
+    finally:
+        sqlalchemy_event.remove(db.get_bind(), "before_cursor_execute", record_update)
+
+    # 50 events, one UPDATE ... SET total_page_views = total_page_views + 50
+    assert updates == [1]
+    total_page_views, total_time_spent, last_visit = db.query(
+        WebsiteVisitor.total_page_views, WebsiteVisitor.total_time_spent, WebsiteVisitor.last_visit
+    ).filter(WebsiteVisitor.id == visitor_pk).one()
+    assert total_page_views == 50
+    assert total_time_spent == pytest.approx(5.0)
+    # A flush carrying an older last_visit (e.g. from another worker) does not move it back
+    assert rollups.as_utc(last_visit) == later
+
+def test_lead_score_maintained_on_ingest_with_threshold_hook(client, db, test_business, tracking_buffer):
+    business_id = test_business.id
+    crossings = []
+    hook = lambda *crossing: crossings.append(crossing)
+    visitor_scoring.add_threshold_hook(hook)
+    try:
+        event = {"business_id": business_id, "visitor_id": "s-1", "event_type": "page_view", "page_url": "/", "duration": 600}
+        client.post("/api/tracking/track-event", json=event)
+        tracking_buffer.flush()
+        visitor_pk, lead_score = db.query(WebsiteVisitor.id, WebsiteVisitor.lead_score).filter(
+            WebsiteVisitor.visitor_id == "s-1"
+        ).one()
+        # 1 visit, 1 page view, 10 minutes on site
+        assert lead_score == 2 + 1 + 10
+
+        response = client.post("/api/tracking/capture-lead", json={
+            "business_id": business_id, "visitor_id": "s-1", "email": "s@example.com", "name": "S"
+        })
+        assert response.json()["lead_score"] == 43
+        assert crossings == []
+
+        # Later events keep raising the score inside the counter UPDATE; page views cap at 25
+        selects = []
+        def record_select(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("SELECT") and "website_visitors.lead_score" in statement:
+                selects.append(statement)
+        for _ in range(30):
+            client.post("/api/tracking/track-event", json=event)
+        sqlalchemy_event.listen(db.get_bind(), "before_cursor_execute", record_select)
+        try:
+            tracking_buffer.flush()
+        finally:
+            sqlalchemy_event.remove(db.get_bind(), "before_cursor_execute", record_select)
+        db.expire_all()
+        visitor = db.get(WebsiteVisitor, visitor_pk)
+        expected = visitor_scoring.score_visitor(visitor)
+        assert visitor.lead_score == expected == 10 + 2 + 30 + 25 + 15 + 5
+        assert crossings == [(visitor_pk, business_id, 43, expected)]
+        # Only the crossing check reads scores back, limited to visitors at or above the threshold
+        assert len(selects) == 1
+
+        # No second crossing once above the threshold
+        client.post("/api/tracking/track-event", json=event)
+        tracking_buffer.flush()
+        assert len(crossings) == 1
+    finally:
+        visitor_scoring.remove_threshold_hook(hook)
+
+@pytest.mark.parametrize("time_spent", [0.0, 2.4, 2.6, 29.99, 45.5])
+def test_score_expression_matches_components(db, test_business, time_spent):
+    visitor = WebsiteVisitor(business_id=test_business.id, visitor_id="s-expr", total_visits=1, total_page_views=3, total_time_spent=1.0, email="e@example.com")
+    db.add(visitor)
+    db.commit()
+    visitors = WebsiteVisitor.__table__
+    expression = visitor_scoring.score_expression(visitors, literal(1), literal(2), literal(time_spent))
+    score = db.execute(select(expression).where(visitors.c.id == visitor.id)).scalar()
+    assert score == visitor_scoring.components(False, 2, 1.0 + time_spent, 5, "e@example.com").score
+
+def test_lead_features_maintained_on_ingest_and_loaded_as_matrix(client, db, test_business, tracking_buffer):
+    business_id = test_business.id
+
+    def post(visitor_id, events):
+        response = client.post("/api/tracking/track-events", json={"events": [
+            {"business_id": business_id, "visitor_id": visitor_id, "event_type": event_type, "page_url": page_url}
+            for event_type, page_url in events
+        ]})
+        assert response.json()["accepted"] == len(events)
+
+    post("f-1", [
+        ("page_view", "https://example.com/?utm_source=LinkedIn&utm_medium=social"),
+        ("page_view", "https://example.com/pricing"),
+        ("form_submit", "https://example.com/signup")
+    ])
+    post("f-2", [("page_view", "https://example.com/blog?utm_source=somewhere")])
+    tracking_buffer.flush()
+    # Later traffic adds to the same rows; the first-touch source is kept
+    post("f-1", [("page_view", "https://example.com/plans/team?utm_source=google")])
+    sessionizer.timeout = timedelta(seconds=0)
+    try:
+        tracking_buffer.flush()
+    finally:
+        sessionizer.timeout = timedelta(seconds=1800)
+    client.post("/api/tracking/capture-lead", json={"business_id": business_id, "visitor_id": "f-1", "email": "f@example.com"})
+
+    first_pk = db.query(WebsiteVisitor.id).filter(WebsiteVisitor.visitor_id == "f-1").scalar()
+    row = db.get(LeadFeatures, first_pk)
+    assert (row.events, row.page_views, row.form_submits, row.pricing_page_views) == (4, 3, 1, 2)
+    assert (row.sessions, row.session_page_views) == (1, 3)
+    assert row.utm_source_code == lead_features.UTM_SOURCES.index("linkedin") + 1
+    assert row.first_seen_at <= row.last_seen_at
+
+    visitor_pks, matrix = lead_features.load_matrix(db, business_id, now=row.last_seen_at + 2 * 86400)
+    assert matrix.shape == (2, len(lead_features.MATRIX_COLUMNS))
+    features = dict(zip(lead_features.MATRIX_COLUMNS, matrix[list(visitor_pks).index(first_pk)]))
+    assert features["recency_days"] == pytest.approx(2.0)
+    assert (features["sessions"], features["events"], features["pages_per_session"]) == (1, 4, 3.0)
+    assert (features["form_submits"], features["pricing_page_views"]) == (1, 2)
+    second = dict(zip(lead_features.MATRIX_COLUMNS, matrix[1 - list(visitor_pks).index(first_pk)]))
+    assert second["utm_source_code"] == lead_features.UTM_OTHER
+
+    lead_pks, lead_matrix = lead_features.load_matrix(db, business_id, leads_only=True)
+    assert lead_pks.tolist() == [first_pk]
+    assert lead_matrix.shape == (1, len(lead_features.MATRIX_COLUMNS))
+
+@pytest.mark.skipif(not hasattr(time, "tzset"), reason="time.tzset is not available")
+def test_lead_feature_recency_independent_of_server_time_zone(db, test_business, monkeypatch):
+    business_id = test_business.id
+    visitor = WebsiteVisitor(business_id=business_id, visitor_id="f-tz")
+    db.add(visitor)
+    db.commit()
+    visitor_pk = visitor.id
+
+    seen_at = datetime(2024, 3, 1, 12, 0)
+    deltas = {}
+    tracking_store.add_visitor_delta(deltas, visitor_pk, business_id, None, seen_at)
+    one_day_later = calendar.timegm(seen_at.timetuple()) + 86400
+    try:
+        for zone in ("UTC", "America/New_York", "Asia/Kolkata"):
+            monkeypatch.setenv("TZ", zone)
+            time.tzset()
+            db.query(LeadFeatures).delete()
+            lead_features.apply_features(db, lead_features.collect([], deltas))
+            db.commit()
+            _, matrix = lead_features.load_matrix(db, business_id, now=one_day_later)
+            assert matrix[0, lead_features.MATRIX_COLUMNS.index("recency_days")] == pytest.approx(1.0)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
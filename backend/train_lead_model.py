@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Train the local lead scoring model used by POST /api/leads/score/batch.
+
+Historical leads that were won (status "closed", or with a conversion date)
+or lost are read from the leads table, featurized from the website events
+of their visitors and the CRM touches stored on the lead as they were
+LEAD_MODEL_HORIZON_DAYS (default 7) before the outcome (see
+app/core/lead_model.py), and fitted with a standardized logistic
+regression. Leads kept outside the database can be added with --input, a
+JSON lines file of lead payloads (as accepted by the scoring endpoint) with
+a boolean "converted" field.
+
+The model is written to LEAD_MODEL_PATH; restart the API to pick it up.
+
+Usage:
+    python train_lead_model.py [--business-id 1] [--input leads.jsonl] [--output data/lead_model.joblib]
+"""
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+# Add the app directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal
+from app.core import lead_model
+from app.api.lead_scoring import Lead
+
+def load_input(path):
+    """Features and outcomes of the leads in a JSON lines file"""
+    leads, outcomes = [], []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            outcomes.append(1 if record.pop("converted") else 0)
+            leads.append(Lead(**record))
+    return lead_model.featurize(leads), np.array(outcomes, dtype=np.int64)
+
+def train(business_id=None, input_path=None, output=lead_model.LEAD_MODEL_PATH, min_samples=50, test_size=0.2):
+    if not lead_model.SKLEARN_AVAILABLE:
+        sys.exit("scikit-learn is not installed")
+
+    db = SessionLocal()
+    try:
+        features, outcomes = lead_model.training_data(db, business_id)
+    finally:
+        db.close()
+    print(f"Historical leads in the database: {len(outcomes)} ({int(outcomes.sum())} won)")
+
+    if input_path:
+        extra_features, extra_outcomes = load_input(input_path)
+        print(f"Leads from {input_path}: {len(extra_outcomes)} ({int(extra_outcomes.sum())} won)")
+        features = np.vstack([features, extra_features])
+        outcomes = np.concatenate([outcomes, extra_outcomes])
+
+    if len(outcomes) < min_samples:
+        sys.exit(f"Only {len(outcomes)} historical leads; at least {min_samples} are needed")
+
+    try:
+        bundle = lead_model.train(features, outcomes, test_size)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    path = lead_model.save(bundle, output)
+    auc = bundle["holdout_auc"]
+    print(f"  samples: {bundle['samples']} ({bundle['won']} won)")
+    print(f"  holdout ROC AUC: {auc:.3f}" if auc is not None else "  holdout ROC AUC: not enough leads to hold out")
+    print(f"✅ Lead scoring model written to {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the local lead scoring model from historical won and lost leads")
+    parser.add_argument("--business-id", type=int, help="Only train on this business's leads")
+    parser.add_argument("--input", help="JSON lines file of additional lead payloads with a boolean 'converted' field")
+    parser.add_argument("--output", default=lead_model.LEAD_MODEL_PATH, help="Where to write the model")
+    parser.add_argument("--min-samples", type=int, default=50, help="Refuse to train on fewer historical leads")
+    parser.add_argument("--test-size", type=float, default=0.2, help="Share of leads held out to measure ROC AUC")
+    args = parser.parse_args()
+
+    train(args.business_id, args.input, args.output, args.min_samples, args.test_size)